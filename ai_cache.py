@@ -0,0 +1,132 @@
+"""
+AI response cache for Alpha Nex
+Identical analysis requests (same function, model and normalized inputs) are answered
+from an in-process LRU backed by the ai_cache_entry table, with TTL and size bounds
+"""
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from app import app, db
+from models import AiCacheEntry
+
+DEFAULT_TTL_HOURS = 7 * 24
+MEMORY_MAX_ENTRIES = 2000
+DB_MAX_ENTRIES = 50000
+PRUNE_EVERY_WRITES = 200
+TOUCH_AFTER = timedelta(hours=1)  # don't rewrite last_used_at on every hit
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_table = AiCacheEntry.__table__
+
+
+def normalize(text):
+    return _WHITESPACE_RE.sub(' ', str(text or '')).strip().lower()
+
+
+def cache_key(function, model, *inputs):
+    payload = json.dumps([function, model] + [normalize(i) for i in inputs])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Two-level cache: bounded in-process LRU in front of a TTL'd, size-bounded table"""
+
+    def __init__(self, memory_max=MEMORY_MAX_ENTRIES, db_max=DB_MAX_ENTRIES):
+        self.memory_max = memory_max
+        self.db_max = db_max
+        self._memory = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'writes': 0, 'errors': 0}
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_max:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Cached value for key, or None"""
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[1] > now:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[0]
+            if entry:
+                del self._memory[key]
+
+        try:
+            # Own connection/transaction so a cache lookup never commits the caller's session
+            with db.engine.begin() as conn:
+                row = conn.execute(select(_table).where(_table.c.key == key)).first()
+                if not row or row.expires_at <= now:
+                    self.stats['misses'] += 1
+                    return None
+                changes = {'hits': _table.c.hits + 1}
+                if not row.last_used_at or now - row.last_used_at > TOUCH_AFTER:
+                    changes['last_used_at'] = now
+                conn.execute(_table.update().where(_table.c.key == key).values(**changes))
+            value = json.loads(row.value)
+            self._remember(key, value, row.expires_at)
+            self.stats['db_hits'] += 1
+            return value
+        except Exception as e:
+            self.stats['errors'] += 1
+            app.logger.warning(f"AI cache read failed: {e}")
+            return None
+
+    def set(self, key, function, value, ttl_hours=DEFAULT_TTL_HOURS):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(hours=ttl_hours)
+        self._remember(key, value, expires_at)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(_table.delete().where(_table.c.key == key))
+                conn.execute(_table.insert().values(
+                    key=key, function=function, value=json.dumps(value), hits=0,
+                    created_at=now, last_used_at=now, expires_at=expires_at))
+            self.stats['writes'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            app.logger.warning(f"AI cache write failed: {e}")
+            return
+
+        self._writes += 1
+        if self._writes % PRUNE_EVERY_WRITES == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows, then the least recently used ones beyond db_max"""
+        try:
+            with db.engine.begin() as conn:
+                expired = conn.execute(_table.delete().where(_table.c.expires_at <= datetime.utcnow())).rowcount
+                total = conn.execute(select(func.count()).select_from(_table)).scalar() or 0
+                evicted = 0
+                if total > self.db_max:
+                    cutoff = conn.execute(
+                        select(_table.c.last_used_at)
+                        .order_by(_table.c.last_used_at.desc())
+                        .offset(self.db_max).limit(1)
+                    ).scalar()
+                    if cutoff:
+                        evicted = conn.execute(_table.delete().where(_table.c.last_used_at <= cutoff)).rowcount
+            return expired, evicted
+        except Exception as e:
+            app.logger.warning(f"AI cache prune failed: {e}")
+            return 0, 0
+
+    def summary(self):
+        lookups = self.stats['memory_hits'] + self.stats['db_hits'] + self.stats['misses']
+        hits = self.stats['memory_hits'] + self.stats['db_hits']
+        return dict(self.stats, lookups=lookups, memory_entries=len(self._memory),
+                    hit_rate=round(hits / lookups, 4) if lookups else None)
+
+
+analysis_cache = AnalysisCache()
@@ -0,0 +1,230 @@
+"""
+Pooled asyncio client for the AI provider
+Calls from worker threads run on one background event loop with bounded concurrency,
+request/token-per-minute rate limits, per-call deadlines and a circuit breaker, so
+a slow or failing provider costs callers a bounded wait and then a fast failure
+"""
+import asyncio
+import concurrent.futures
+import inspect
+import os
+import threading
+import time
+
+MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "8"))
+REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", "300"))
+TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TOKENS_PER_MINUTE", "60000"))
+CALL_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_TIMEOUT_SECONDS", "20"))
+BREAKER_FAILURES = 5  # consecutive failures that open the circuit
+BREAKER_COOLDOWN_SECONDS = 30
+
+
+class AnalysisUnavailable(Exception):
+    """The provider can't answer within the deadline (open circuit, timeout, error)"""
+
+
+class RateLimited(AnalysisUnavailable):
+    """The rate limit would delay the call past its deadline"""
+
+
+class Saturated(RateLimited):
+    """Every concurrency slot stayed busy until the call's deadline"""
+
+
+class _ProviderError(Exception):
+    """The provider itself failed or was too slow; only these count against the breaker"""
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough prompt size (about 4 characters per token) plus the completion budget"""
+    chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + max_tokens
+
+
+class RateLimiter:
+    """Two token buckets (requests and tokens per minute), refilled continuously"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.capacity = {'requests': float(requests_per_minute), 'tokens': float(tokens_per_minute)}
+        self.available = dict(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        for name, capacity in self.capacity.items():
+            self.available[name] = min(capacity, self.available[name] + elapsed * capacity / 60.0)
+
+    def _wait_for(self, needed):
+        wait = 0.0
+        for name, amount in needed.items():
+            amount = min(amount, self.capacity[name])  # an oversized call waits for a full bucket
+            missing = amount - self.available[name]
+            if missing > 0:
+                wait = max(wait, missing * 60.0 / self.capacity[name])
+        return wait
+
+    async def acquire(self, tokens, deadline):
+        needed = {'requests': 1, 'tokens': tokens}
+        async with self._lock:  # FIFO: later calls queue behind the one waiting for capacity
+            self._refill()
+            wait = self._wait_for(needed)
+            if wait > 0:
+                if time.monotonic() + wait > deadline:
+                    raise RateLimited(f"rate limit wait {wait:.1f}s exceeds deadline")
+                await asyncio.sleep(wait)
+                self._refill()
+            for name, amount in needed.items():
+                self.available[name] -= min(amount, self.capacity[name])
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> one half-open trial after a cooldown"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self):
+        with self._lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class AnalysisClientPool:
+    """
+    Blocking complete() for worker threads on top of an async client running on a
+    dedicated event loop thread. client_factory builds the async client inside that
+    loop; any object with a chat.completions.create coroutine works (e.g. an
+    AsyncOpenAI pointed at a local fake server through OPENAI_BASE_URL).
+    """
+
+    def __init__(self, client_factory, max_concurrency=MAX_CONCURRENCY,
+                 requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 timeout=CALL_TIMEOUT_SECONDS):
+        self.client_factory = client_factory
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self.stats = {'calls': 0, 'succeeded': 0, 'failed': 0, 'timed_out': 0,
+                      'rate_limited': 0, 'saturated': 0, 'short_circuited': 0, 'local_errors': 0}
+        self._loop = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        # A forked worker inherits the object but not the loop thread
+        with self._start_lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='ai-client-loop', daemon=True).start()
+            asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+            self._loop, self._pid = loop, os.getpid()
+            return loop
+
+    async def _setup(self):
+        self._client = self.client_factory()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+
+    async def _call(self, kwargs, deadline):
+        budget = deadline - time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise Saturated(f"all {self.max_concurrency} slots busy until the deadline") from None
+        try:
+            await self._limiter.acquire(estimate_tokens(kwargs['messages'], kwargs.get('max_tokens', 0)), deadline)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RateLimited("deadline passed waiting for the rate limit")
+            try:
+                response = self._client.chat.completions.create(**kwargs)
+                if inspect.isawaitable(response):
+                    response = await asyncio.wait_for(response, remaining)
+                return response.choices[0].message.content
+            except asyncio.TimeoutError as e:
+                if remaining < budget / 2:
+                    # Most of the budget went on queueing here; the provider never had a fair chance
+                    raise Saturated("deadline mostly spent waiting for a slot") from e
+                raise _ProviderError("timed out") from e
+            except Exception as e:
+                raise _ProviderError(str(e) or type(e).__name__) from e
+        finally:
+            self._semaphore.release()
+
+    def complete(self, timeout=None, **kwargs):
+        """Message content of one chat completion; raises AnalysisUnavailable on any failure"""
+        self.stats['calls'] += 1
+        if not self.breaker.allow():
+            self.stats['short_circuited'] += 1
+            raise AnalysisUnavailable("circuit open")
+
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        future = asyncio.run_coroutine_threadsafe(self._call(kwargs, deadline), self._ensure_loop())
+        try:
+            content = future.result(timeout + 1)  # the loop enforces the deadline; this is a backstop
+        except RateLimited as e:
+            # Our own budget, not a provider fault: don't trip the breaker
+            self.stats['saturated' if isinstance(e, Saturated) else 'rate_limited'] += 1
+            self.breaker.release_trial()
+            raise
+        except _ProviderError as e:
+            self.breaker.record_failure()
+            timed_out = isinstance(e.__cause__, asyncio.TimeoutError)
+            self.stats['timed_out' if timed_out else 'failed'] += 1
+            raise AnalysisUnavailable("timed out" if timed_out else str(e)) from e.__cause__
+        except Exception as e:
+            # The backstop fired or our own code failed; says nothing about the provider
+            future.cancel()
+            self.breaker.release_trial()
+            self.stats['local_errors'] += 1
+            timed_out = isinstance(e, concurrent.futures.TimeoutError)
+            raise AnalysisUnavailable("timed out locally" if timed_out else str(e)) from e
+        self.breaker.record_success()
+        self.stats['succeeded'] += 1
+        return content
+
+    def summary(self):
+        return dict(self.stats, breaker=self.breaker.state, max_concurrency=self.max_concurrency,
+                    requests_per_minute=self.requests_per_minute, tokens_per_minute=self.tokens_per_minute)
@@ -0,0 +1,172 @@
+"""
+Background AI analysis for Alpha Nex
+Uploads are queued in the analysis_job table and analyzed in batches (one AI request
+per batch) by a small thread pool driven by the scheduler, so the upload request never
+waits on the AI provider. Duplicate indexing and the deep archive inspection
+(decompressing nested and compressed archives) run here too, after the upload's
+commit has put its file in place.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_, and_
+from app import app, db, scheduler
+from models import Upload, AnalysisJob
+
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "4"))
+POLL_INTERVAL_SECONDS = 5
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+STALE_RUNNING_MINUTES = 10  # a job 'running' this long belonged to a worker that died
+SPAM_REJECT_THRESHOLD = 0.9
+
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='analysis')
+
+
+def enqueue_analysis(upload):
+    """Queue an upload for analysis. The caller commits (with the upload itself)."""
+    job = AnalysisJob()
+    job.upload_id = upload.id
+    job.status = 'queued'
+    job.attempts = 0
+    job.run_after = datetime.utcnow()
+    db.session.add(job)
+    return job
+
+
+def _claim(job_id):
+    """Move a job to running; False if another worker got it first"""
+    stale = datetime.utcnow() - timedelta(minutes=STALE_RUNNING_MINUTES)
+    claimed = db.session.execute(
+        update(AnalysisJob)
+        .where(AnalysisJob.id == job_id, or_(
+            AnalysisJob.status == 'queued',
+            and_(AnalysisJob.status == 'running', AnalysisJob.updated_at < stale),
+        ))
+        .values(status='running', attempts=AnalysisJob.attempts + 1, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return bool(claimed)
+
+
+def _due_job_ids():
+    now = datetime.utcnow()
+    stale = now - timedelta(minutes=STALE_RUNNING_MINUTES)
+    rows = db.session.query(AnalysisJob.id).filter(or_(
+        and_(AnalysisJob.status == 'queued', AnalysisJob.run_after <= now),
+        and_(AnalysisJob.status == 'running', AnalysisJob.updated_at < stale),
+    )).order_by(AnalysisJob.run_after).limit(BATCH_SIZE).all()
+    return [job_id for (job_id,) in rows]
+
+
+def analyze_upload(upload, use_fallbacks=False):
+    """
+    Run duplicate/spam/category analysis and apply the results to the upload.
+    Provider errors propagate so the job is retried with backoff, unless use_fallbacks
+    (the last attempt) accepts the local heuristic answers instead.
+    """
+    from openai_service import detect_duplicate_content, analyze_content_description
+
+    duplicate_score, spam_score = detect_duplicate_content(
+        upload.file_path, upload.description, upload.category,
+        content_hash=upload.content_hash, upload_id=upload.id, raise_errors=not use_fallbacks)
+    analysis = analyze_content_description(upload.description, upload.category,
+                                           raise_errors=not use_fallbacks)
+    _apply(upload, duplicate_score, spam_score, analysis.get('appropriate'))
+
+
+def _apply(upload, duplicate_score, spam_score, appropriate):
+    upload.duplicate_score = duplicate_score
+    upload.spam_score = spam_score
+    if upload.status == 'pending' and (spam_score >= SPAM_REJECT_THRESHOLD or appropriate is False):
+        upload.status = 'rejected'
+
+
+def _record_failure(job, error):
+    job.last_error = str(error)[:1000]
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = 'failed'
+        app.logger.error(f"Analysis of upload {job.upload_id} failed permanently: {error}")
+    else:
+        # Exponential backoff: 1, 2, 4, 8 minutes
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(minutes=2 ** (job.attempts - 1))
+
+
+def _run_batch(job_ids):
+    """Claim a group of jobs and analyze their uploads with one batched AI request"""
+    from openai_service import analyze_descriptions_batch
+    from preview import inspect_upload
+    from duplicate_index import index_upload
+
+    with app.app_context():
+        try:
+            claimed = [job_id for job_id in job_ids if _claim(job_id)]
+            if not claimed:
+                return
+            jobs = AnalysisJob.query.filter(AnalysisJob.id.in_(claimed)).all()
+            uploads = {u.id: u for u in Upload.query.filter(Upload.id.in_([j.upload_id for j in jobs]))}
+            results = analyze_descriptions_batch([
+                {'id': u.id, 'description': u.description, 'category': u.category}
+                for u in uploads.values()
+            ])
+
+            for job in jobs:
+                upload = uploads.get(job.upload_id)
+                if upload is None:
+                    job.status = 'done'  # Upload was deleted while queued
+                    continue
+                try:
+                    rejected = inspect_upload(upload)
+                    if rejected:
+                        app.logger.info(f"Upload {upload.id} rejected by archive inspection: {rejected}")
+                        if upload.status == 'pending':
+                            upload.status = 'rejected'
+                        job.status = 'done'
+                        job.last_error = None
+                        continue
+                    # Score against the local index and add the upload to it
+                    duplicate_score = index_upload(upload)
+                    result = results.get(upload.id)
+                    if result is not None:
+                        _apply(upload, duplicate_score, result['spam_score'], result['appropriate'])
+                    else:
+                        # Single requests; provider errors raise and back off, the last try falls back
+                        analyze_upload(upload, use_fallbacks=job.attempts >= MAX_ATTEMPTS)
+                    job.status = 'done'
+                    job.last_error = None
+                except Exception as e:
+                    _record_failure(job, e)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Analysis batch {job_ids} error: {e}")
+        finally:
+            db.session.remove()
+
+
+def dispatch_analysis_jobs():
+    """Hand due jobs to the worker pool in batches (scheduled)"""
+    from openai_service import BATCH_MAX_ITEMS
+
+    with app.app_context():
+        try:
+            job_ids = _due_job_ids()
+        except Exception as e:
+            app.logger.error(f"Analysis queue poll failed: {e}")
+            return
+        finally:
+            db.session.remove()
+
+    for start in range(0, len(job_ids), BATCH_MAX_ITEMS):
+        _executor.submit(_run_batch, job_ids[start:start + BATCH_MAX_ITEMS])
+
+
+if scheduler:
+    try:
+        scheduler.add_job(dispatch_analysis_jobs, 'interval', seconds=POLL_INTERVAL_SECONDS,
+                          id='dispatch_analysis_jobs', replace_existing=True,
+                          max_instances=1, coalesce=True)
+    except Exception as e:
+        app.logger.error(f"Analysis job registration failed: {e}")
@@ -60,8 +60,8 @@ except Exception as e:
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        from models import User
-        return User.query.get(int(user_id))
+        from identity import load_user_by_id
+        return load_user_by_id(int(user_id))
     except Exception as e:
         app.logger.error(f"User loading failed: {e}")
         return None
@@ -83,12 +83,45 @@ try:
     atexit.register(lambda: scheduler.shutdown())
 except Exception as e:
     app.logger.error(f"Scheduler initialization failed: {e}")
+    scheduler = None
     # Continue without scheduler - not critical for basic functionality
 
+def sync_schema():
+    """Add columns and indexes that create_all() skips on existing tables"""
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=db.engine.dialect)}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+            with db.engine.begin() as conn:
+                conn.execute(text(ddl))
+            app.logger.info(f"Added column {table.name}.{column.name}")
+
+        existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.engine, checkfirst=True)
+                app.logger.info(f"Created index {index.name}")
+
+
 with app.app_context():
     # Import models to ensure tables are created
     import models  # noqa: F401
     import routes  # noqa: F401
+    import resumable_upload  # noqa: F401
+    import upload_status  # noqa: F401
+    import guest_gc  # noqa: F401
+    import commands  # noqa: F401
 
     try:
         db.create_all()
@@ -96,6 +129,11 @@ with app.app_context():
         app.logger.error(f"Database initialization error: {e}")
         # Continue running even if DB init fails
 
+    try:
+        sync_schema()
+    except Exception as e:
+        app.logger.error(f"Schema sync error: {e}")
+
 # Comprehensive error handlers to prevent crashes
 @app.errorhandler(404)
 def not_found(e):
@@ -0,0 +1,286 @@
+"""
+Archive inspection for Alpha Nex
+The quick check (upload requests) decompresses nothing: zip central directories are
+walked record by record, plain tar headers are streamed, and nested archives and
+compressed streams are only counted. The deep check (analysis worker) also decompresses:
+compressed tarballs and single compressed files are counted as they decompress, and
+small inner zips are extracted to a size-capped temp file and walked in turn. Entry
+count, total uncompressed size and compression ratio are tallied as we go, so zip bombs
+are rejected as soon as a limit is crossed, in bounded memory.
+"""
+import bz2
+import gzip
+import lzma
+import os
+import struct
+import tarfile
+import tempfile
+import zipfile
+import zlib
+
+MAX_MEMBERS = int(os.environ.get("ARCHIVE_MAX_MEMBERS", "10000"))
+MAX_UNCOMPRESSED_BYTES = int(os.environ.get("ARCHIVE_MAX_UNCOMPRESSED_BYTES", str(2 * 1024 ** 3)))
+MAX_RATIO = float(os.environ.get("ARCHIVE_MAX_RATIO", "100"))
+MAX_NESTING = int(os.environ.get("ARCHIVE_MAX_NESTING", "2"))
+RATIO_MIN_BYTES = 10 * 1024 * 1024  # small, highly compressible archives (text, logs) are fine
+NESTED_INSPECT_MAX_BYTES = 64 * 1024 * 1024  # larger inner zips are counted, not opened
+NESTED_EXTRACT_TOTAL_BYTES = 256 * 1024 * 1024  # inner zips extracted per deep check
+LISTED_MEMBERS = 50
+READ_CHUNK_SIZE = 64 * 1024
+
+NESTED_EXTENSIONS = ('.zip', '.jar', '.tar', '.tgz', '.gz', '.bz2', '.xz', '.7z', '.rar')
+
+_EOCD = struct.Struct('<4s4H2LH')
+_ZIP64_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_EOCD = struct.Struct('<4sQ2H2L4Q')
+_CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+
+
+class ArchiveRejected(ValueError):
+    """The archive crosses a safety limit or contains unsafe paths"""
+
+
+def unsafe_member_name(name):
+    """True for absolute paths, drive letters and anything climbing out with '..'"""
+    normalized = name.replace('\\', '/')
+    if normalized.startswith('/') or (len(normalized) > 1 and normalized[1] == ':'):
+        return True
+    return '..' in normalized.split('/')
+
+
+class _Tally:
+    """Running totals for one archive (and anything nested in it), checked on every entry"""
+
+    def __init__(self, fmt, compressed_size):
+        self.fmt = fmt
+        self.compressed_size = compressed_size
+        self.member_count = 0
+        self.uncompressed_size = 0
+        self.nested_archives = 0
+        self.max_depth = 0
+        self.extracted = 0
+        self.members = []
+
+    def add(self, name, size, depth=0, is_dir=False, compressed=None):
+        if unsafe_member_name(name):
+            raise ArchiveRejected(f"unsafe path in archive: {name!r}")
+        self.member_count += 1
+        self.uncompressed_size += size
+        if self.member_count > MAX_MEMBERS:
+            raise ArchiveRejected(f"more than {MAX_MEMBERS} entries")
+        if self.uncompressed_size > MAX_UNCOMPRESSED_BYTES:
+            raise ArchiveRejected(f"expands to more than {MAX_UNCOMPRESSED_BYTES} bytes")
+        if compressed is not None and size > RATIO_MIN_BYTES and size > compressed * MAX_RATIO:
+            raise ArchiveRejected(f"entry {name!r} compresses more than {MAX_RATIO:g}:1")
+        if not is_dir and name.lower().endswith(NESTED_EXTENSIONS):
+            self.nested_archives += 1
+        if depth == 0 and len(self.members) < LISTED_MEMBERS:
+            member = {'name': name, 'size': size}
+            if is_dir:
+                member['is_dir'] = True
+            self.members.append(member)
+
+    def check_ratio(self):
+        if (self.uncompressed_size > RATIO_MIN_BYTES
+                and self.uncompressed_size > max(self.compressed_size, 1) * MAX_RATIO):
+            raise ArchiveRejected(f"compresses more than {MAX_RATIO:g}:1 overall")
+
+    def report(self):
+        return {
+            'format': self.fmt,
+            'inspected': True,
+            'member_count': self.member_count,
+            'uncompressed_size': self.uncompressed_size,
+            'compressed_size': self.compressed_size,
+            'ratio': round(self.uncompressed_size / max(self.compressed_size, 1), 2),
+            'nested_archives': self.nested_archives,
+            'nesting_depth': self.max_depth,
+            'members': self.members,
+        }
+
+
+def _zip_directory(f):
+    """(entry count, central directory size, offset) from the end records, zip64 included"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    tail_size = min(size, _EOCD.size + 0xFFFF)  # the trailing comment is at most 64KB
+    f.seek(size - tail_size)
+    tail = f.read(tail_size)
+    position = tail.rfind(b'PK\x05\x06')
+    if position < 0 or len(tail) - position < _EOCD.size:
+        raise zipfile.BadZipFile("end of central directory not found")
+    _, _, _, _, entries, cd_size, cd_offset, _ = _EOCD.unpack_from(tail, position)
+
+    locator_at = position - _ZIP64_LOCATOR.size
+    if locator_at >= 0 and tail[locator_at:locator_at + 4] == b'PK\x06\x07':
+        _, _, zip64_offset, _ = _ZIP64_LOCATOR.unpack_from(tail, locator_at)
+        f.seek(zip64_offset)
+        record = f.read(_ZIP64_EOCD.size)
+        if len(record) == _ZIP64_EOCD.size and record[:4] == b'PK\x06\x06':
+            fields = _ZIP64_EOCD.unpack(record)
+            entries, cd_size, cd_offset = fields[7], fields[8], fields[9]
+    return entries, cd_size, cd_offset, size
+
+
+def _zip64_sizes(extra, file_size, compress_size):
+    """Real sizes from the zip64 extra field when the 32-bit ones are saturated"""
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from('<2H', extra, position)
+        if tag == 0x0001:
+            values = extra[position + 4:position + 4 + length]
+            index = 0
+            if file_size == 0xFFFFFFFF and len(values) >= index + 8:
+                file_size = struct.unpack_from('<Q', values, index)[0]
+                index += 8
+            if compress_size == 0xFFFFFFFF and len(values) >= index + 8:
+                compress_size = struct.unpack_from('<Q', values, index)[0]
+            break
+        position += 4 + length
+    return file_size, compress_size
+
+
+def _extract_nested(archive, name, tally):
+    """Copy an inner zip to a temp file (seekable, unlike the decompressing stream), or None past the caps"""
+    budget = min(NESTED_INSPECT_MAX_BYTES, NESTED_EXTRACT_TOTAL_BYTES - tally.extracted)
+    temp = tempfile.TemporaryFile()
+    try:
+        with archive.open(name) as inner:
+            for chunk in iter(lambda: inner.read(READ_CHUNK_SIZE), b''):
+                tally.extracted += len(chunk)
+                budget -= len(chunk)
+                if budget < 0:
+                    temp.close()
+                    return None
+                temp.write(chunk)
+    except BaseException:
+        temp.close()
+        raise
+    return temp
+
+
+def _walk_zip(f, tally, depth, deep):
+    """Stream the central directory one record at a time; with deep, walk small inner zips too"""
+    entries, cd_size, cd_offset, archive_size = _zip_directory(f)
+    if depth > MAX_NESTING:
+        raise ArchiveRejected(f"archives nested more than {MAX_NESTING} levels deep")
+    tally.max_depth = max(tally.max_depth, depth)
+    if tally.member_count + entries > MAX_MEMBERS:
+        raise ArchiveRejected(f"more than {MAX_MEMBERS} entries")
+
+    nested = []
+    compressed_total = 0
+    f.seek(cd_offset)
+    for _ in range(entries):
+        header = f.read(_CENTRAL_HEADER.size)
+        if len(header) < _CENTRAL_HEADER.size or header[:4] != b'PK\x01\x02':
+            raise zipfile.BadZipFile("corrupt central directory")
+        fields = _CENTRAL_HEADER.unpack(header)
+        compress_size, file_size = fields[8], fields[9]
+        name_length, extra_length, comment_length = fields[10], fields[11], fields[12]
+        flags = fields[3]
+        raw_name = f.read(name_length)
+        extra = f.read(extra_length)
+        f.seek(comment_length, os.SEEK_CUR)
+
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437', 'replace')
+        file_size, compress_size = _zip64_sizes(extra, file_size, compress_size)
+        compressed_total += compress_size
+        is_dir = name.endswith('/')
+        tally.add(name, file_size, depth, is_dir=is_dir, compressed=compress_size)
+        if (deep and name.lower().endswith(('.zip', '.jar')) and not is_dir
+                and file_size <= NESTED_INSPECT_MAX_BYTES):
+            nested.append(name)
+
+    # Entries sharing compressed bytes (overlapping local headers) are a bomb technique
+    if compressed_total > archive_size:
+        raise ArchiveRejected("zip entries overlap")
+
+    if not nested:
+        return
+    f.seek(0)
+    with zipfile.ZipFile(f) as archive:
+        for name in nested:
+            try:
+                inner = _extract_nested(archive, name, tally)
+                if inner is None:
+                    continue  # bigger than declared, or the extraction budget is spent
+                with inner:
+                    _walk_zip(inner, tally, depth + 1, deep)
+            except (zipfile.BadZipFile, struct.error, NotImplementedError, RuntimeError, KeyError,
+                    EOFError, zlib.error):
+                continue  # not really a zip, corrupt or encrypted: it still counted as a member
+
+
+def _inspect_zip(path, deep):
+    tally = _Tally('zip', os.path.getsize(path))
+    try:
+        with open(path, 'rb') as f:
+            _walk_zip(f, tally, 0, deep)
+    except (zipfile.BadZipFile, struct.error) as e:
+        raise ArchiveRejected(f"corrupt zip archive: {e}")
+    tally.check_ratio()
+    return tally
+
+
+def _inspect_tar(path, fmt):
+    """Stream tar headers; returns None if the file is a lone compressed file, not a tarball"""
+    tally = _Tally('tar' if fmt == 'tar' else f'tar.{fmt}', os.path.getsize(path))
+    try:
+        with tarfile.open(path, 'r|*') as archive:
+            for info in archive:
+                if (info.issym() or info.islnk()) and unsafe_member_name(info.linkname):
+                    raise ArchiveRejected(f"link escapes the archive: {info.name!r}")
+                if info.isdev():
+                    raise ArchiveRejected(f"device file in archive: {info.name!r}")
+                tally.add(info.name, info.size, is_dir=info.isdir())
+                if tally.member_count % 100 == 0:
+                    tally.check_ratio()
+    except tarfile.ReadError:
+        if tally.member_count == 0 and fmt != 'tar':
+            return None
+        raise ArchiveRejected("corrupt tar archive")
+    if tally.member_count == 0 and fmt != 'tar':
+        return None  # zero blocks read as an empty tarball; count the stream instead
+    tally.check_ratio()
+    return tally
+
+
+_OPENERS = {'gzip': gzip.open, 'bzip2': bz2.open, 'xz': lzma.open}
+
+
+def _inspect_compressed_file(path, fmt, filename):
+    """A single compressed file: count decompressed bytes, stopping at the first limit crossed"""
+    tally = _Tally(fmt, os.path.getsize(path))
+    size = 0
+    try:
+        with _OPENERS[fmt](path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > MAX_UNCOMPRESSED_BYTES:
+                    raise ArchiveRejected(f"expands to more than {MAX_UNCOMPRESSED_BYTES} bytes")
+                if size > RATIO_MIN_BYTES and size > max(tally.compressed_size, 1) * MAX_RATIO:
+                    raise ArchiveRejected(f"compresses more than {MAX_RATIO:g}:1 overall")
+    except (OSError, EOFError, lzma.LZMAError) as e:
+        raise ArchiveRejected(f"corrupt {fmt} stream: {e}")
+    name = os.path.basename(filename) or 'data'
+    tally.add(name.rsplit('.', 1)[0] if '.' in name else name, size)
+    return tally
+
+
+def inspect_archive(path, fmt, filename='', deep=False):
+    """
+    Report for an archive of the sniffed format: entry count, sizes, ratio and the first
+    LISTED_MEMBERS members. Zip and plain tar are always inspected; gzip, bzip2 and xz
+    (which have to be decompressed) and inner zips only with deep. Anything else is
+    reported as not inspected. Raises ArchiveRejected as soon as a limit is crossed.
+    """
+    if fmt == 'zip':
+        return _inspect_zip(path, deep).report()
+    if fmt == 'tar' or (deep and fmt in _OPENERS):
+        tally = _inspect_tar(path, fmt)
+        if tally is None:
+            tally = _inspect_compressed_file(path, fmt, filename)
+        return tally.report()
+    return {'format': fmt, 'inspected': False, 'compressed_size': os.path.getsize(path),
+            'members': []}
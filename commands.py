@@ -0,0 +1,104 @@
+"""
+Alpha Nex maintenance commands (run with `flask --app main <command>`)
+"""
+import click
+from sqlalchemy import func, select, update
+from app import app, db
+from models import Upload, Review
+
+
+@app.cli.command('repair-review-counts')
+def repair_review_counts():
+    """Recompute Upload.review_count/good_count/bad_count from the review table"""
+    def count_reviews(*conditions):
+        return select(func.count(Review.id))\
+            .where(Review.upload_id == Upload.id, *conditions)\
+            .scalar_subquery()
+
+    result = db.session.execute(
+        update(Upload).values(
+            review_count=count_reviews(),
+            good_count=count_reviews(Review.rating == 'good'),
+            bad_count=count_reviews(Review.rating == 'bad'),
+        )
+    )
+    db.session.commit()
+    click.echo(f"Recounted reviews for {result.rowcount} uploads")
+
+
+@app.cli.command('prune-ai-cache')
+def prune_ai_cache():
+    """Drop expired and least recently used AI analysis cache entries"""
+    from ai_cache import analysis_cache
+    expired, evicted = analysis_cache.prune()
+    click.echo(f"Removed {expired} expired and {evicted} least recently used cache entries")
+
+
+@app.cli.command('train-text-classifier')
+@click.option('--epochs', default=5, show_default=True)
+@click.option('--output', default=None, help='Model file (defaults to TEXT_MODEL_PATH)')
+def train_text_classifier(epochs, output):
+    """Train the local spam/quality classifier from review ratings and rejected uploads"""
+    from datetime import datetime
+    from text_classifier import MODEL_PATH, save_models, train_models
+
+    spam_examples = []
+    rows = db.session.query(Upload.description, Upload.status, Upload.good_count, Upload.bad_count)\
+        .filter((Upload.review_count > 0) | Upload.status.in_(['approved', 'rejected']))
+    for description, status, good, bad in rows.yield_per(1000):
+        if status == 'rejected' or bad > good:
+            spam_examples.append((description, 1))
+        elif status == 'approved' or good > bad:
+            spam_examples.append((description, 0))
+
+    quality_examples = [
+        (description, 0 if flagged or (quality is not None and quality < 0.5) else 1)
+        for description, flagged, quality in db.session.query(
+            Review.description, Review.is_flagged, Review.quality_score).yield_per(1000)
+    ]
+
+    models, report = train_models(spam_examples, quality_examples, epochs=epochs)
+    for name, stats in report.items():
+        click.echo(f"{name}: {stats}")
+    if not models:
+        click.echo("Not enough labelled data; no model written")
+        return
+    path = output or MODEL_PATH
+    save_models(models, path, meta={'trained_at': datetime.utcnow().isoformat(), 'report': report})
+    click.echo(f"Wrote {', '.join(models)} model(s) to {path}")
+
+
+@app.cli.command('collect-guests')
+@click.option('--max-age-days', default=None, type=int, help='Defaults to GUEST_MAX_AGE_DAYS')
+def collect_guests_command(max_age_days):
+    """Delete abandoned guest users now (the scheduler also does this periodically)"""
+    from guest_gc import GUEST_MAX_AGE_DAYS, collect_guests
+    deleted, batches = collect_guests(
+        max_age_days=GUEST_MAX_AGE_DAYS if max_age_days is None else max_age_days,
+        max_batches=10 ** 6)
+    click.echo(f"Deleted {deleted} abandoned guest users in {batches} batches")
+
+
+@app.cli.command('mark-legacy-guests')
+@click.option('--batch-size', default=500, show_default=True)
+def mark_legacy_guests(batch_size):
+    """Flag per-session users created before User.is_guest existed, so the guest GC sees them"""
+    from models import User
+
+    # The old session users were named user_<8 chars of a uuid4> with that name @alphanex.com;
+    # the pattern is enough, so no per-row check of their shared password hash (a slow KDF)
+    legacy = (User.is_guest.is_(False),
+              User.username.like('user\\_' + '_' * 8, escape='\\'),
+              User.email == User.username + '@alphanex.com')
+    marked, last_id = 0, 0
+    while True:
+        ids = db.session.execute(select(User.id).where(User.id > last_id, *legacy)
+                                 .order_by(User.id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        db.session.execute(update(User).where(User.id.in_(ids)).values(is_guest=True))
+        db.session.commit()
+        marked += len(ids)
+        last_id = ids[-1]
+        click.echo(f"Marked {marked} users so far")
+    click.echo(f"Marked {marked} legacy session users as guests")
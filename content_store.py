@@ -0,0 +1,131 @@
+"""
+Content-addressed upload storage for Alpha Nex
+Files are stored once per SHA-256 under uploads/objects/ab/cd/<hash> and
+reference-counted, so identical uploads share bytes on disk. Reference changes
+run in the caller's transaction; the matching file moves and deletions only
+happen once that transaction commits, so a rollback never leaves rows without
+bytes or bytes without rows.
+"""
+import hashlib
+import os
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import app, db
+from models import StoredObject
+
+OBJECTS_DIR = 'objects'
+READ_CHUNK_SIZE = 1024 * 1024
+_PENDING_KEY = 'content_store_on_commit'
+_UPSERTS = {'postgresql': postgresql_insert, 'sqlite': sqlite_insert}
+
+
+def object_path(sha256):
+    """Sharded location for a hash: two levels of two hex chars keep directories small"""
+    root = os.path.join(app.config.get('UPLOAD_FOLDER', 'uploads'), OBJECTS_DIR)
+    return os.path.join(root, sha256[:2], sha256[2:4], sha256)
+
+
+def hash_file(path):
+    """SHA-256 of a file on disk, read in bounded chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def on_commit(action):
+    """Run action() after the current transaction commits; it is dropped on rollback"""
+    db.session.info.setdefault(_PENDING_KEY, []).append(action)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _run_on_commit(session):
+    for action in session.info.pop(_PENDING_KEY, []):
+        try:
+            action()
+        except Exception as e:
+            app.logger.error(f"Post-commit file operation failed: {e}")
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _drop_on_rollback(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+
+
+def _add_reference(sha256, path, size):
+    """Insert the object's row or bump its reference count, as one atomic statement"""
+    upsert = _UPSERTS.get(db.session.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(StoredObject).values(sha256=sha256, path=path, size=size, ref_count=1)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[StoredObject.sha256],
+            set_={'ref_count': StoredObject.ref_count + 1, 'path': stmt.excluded.path}))
+        return
+    stored = StoredObject.query.get(sha256)
+    if stored:
+        stored.path = path
+        stored.ref_count = StoredObject.ref_count + 1
+    else:
+        db.session.add(StoredObject(sha256=sha256, path=path, size=size, ref_count=1))
+
+
+def _place(temp_path, path):
+    if os.path.exists(path):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)  # the bytes are already stored
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+
+
+def ingest(temp_path, sha256, size):
+    """
+    Take a reference on a finished temp file within the caller's transaction.
+    The file moves into the store when the transaction commits (or is dropped if
+    the bytes are already stored); on rollback temp_path is left where it is.
+    Returns the object's path.
+    """
+    path = object_path(sha256)
+    _add_reference(sha256, path, size)
+    on_commit(lambda: _place(temp_path, path))
+    return path
+
+
+def _remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def remove_after_commit(path):
+    """Delete a file outside the store (legacy uploads) once the transaction commits"""
+    on_commit(lambda: _remove_file(path))
+
+
+def _unlink_unreferenced(sha256, path):
+    # A concurrent upload may have re-created the row since our commit
+    with db.engine.connect() as connection:
+        if connection.execute(select(StoredObject.sha256).where(StoredObject.sha256 == sha256)).first():
+            return
+    _remove_file(path)
+
+
+def release(sha256):
+    """
+    Drop one reference in the caller's transaction. When it was the last one the
+    row goes too (returns True then) and the bytes are deleted after the commit.
+    """
+    db.session.execute(
+        update(StoredObject)
+        .where(StoredObject.sha256 == sha256, StoredObject.ref_count > 0)
+        .values(ref_count=StoredObject.ref_count - 1)
+    )
+    stored = StoredObject.query.get(sha256)
+    if stored and stored.ref_count <= 0:
+        path = stored.path
+        db.session.delete(stored)
+        on_commit(lambda: _unlink_unreferenced(sha256, path))
+        return True
+    return False
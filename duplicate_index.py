@@ -0,0 +1,165 @@
+"""
+Duplicate detection index for Alpha Nex
+Exact duplicates come from the content hash; near duplicates of text, code and
+documents from MinHash signatures with an LSH band lookup stored in the database,
+and of images from perceptual hashes (see image_hash.py)
+"""
+import hashlib
+import re
+import struct
+from app import app, db
+from models import Upload, ContentSignature, LshBucket
+from image_hash import compute_hashes, image_duplicate_score, index_image, remove_image
+
+TEXT_CATEGORIES = {'text', 'code', 'document'}
+SAMPLE_BYTES = 256 * 1024  # only the head of a file is fingerprinted
+SHINGLE_SIZE = 5
+NUM_BINS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_BINS // BANDS
+EMPTY_BIN = 2 ** 64 - 1
+MIN_SHINGLES = 8  # too little text to say anything useful
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _read_text_sample(file_path):
+    """Decoded head of a file, or None for binary content"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(SAMPLE_BYTES)
+    if b'\x00' in sample[:8192]:
+        return None
+    return sample.decode('utf-8', errors='ignore')
+
+
+def _shingle_hashes(text):
+    tokens = _TOKEN_RE.findall(text.lower())
+    for i in range(len(tokens) - SHINGLE_SIZE + 1):
+        shingle = ' '.join(tokens[i:i + SHINGLE_SIZE]).encode('utf-8')
+        yield int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big')
+
+
+def compute_minhash(text):
+    """
+    One-permutation MinHash: each shingle is hashed once, its hash picks a bin and
+    each bin keeps its minimum. Returns a tuple of NUM_BINS ints, or None if the
+    text is too short.
+    """
+    bins = [EMPTY_BIN] * NUM_BINS
+    shingles = 0
+    for h in _shingle_hashes(text):
+        shingles += 1
+        b, value = h % NUM_BINS, h // NUM_BINS
+        if value < bins[b]:
+            bins[b] = value
+    if shingles < MIN_SHINGLES:
+        return None
+    return tuple(bins)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity from bins filled in either signature"""
+    compared = matches = 0
+    for a, b in zip(sig_a, sig_b):
+        if a == EMPTY_BIN and b == EMPTY_BIN:
+            continue
+        compared += 1
+        matches += a == b
+    return matches / compared if compared else 0.0
+
+
+def _pack(signature):
+    return struct.pack(f'>{NUM_BINS}Q', *signature)
+
+
+def _unpack(blob):
+    return struct.unpack(f'>{NUM_BINS}Q', blob)
+
+
+def _pack_rows(rows):
+    return struct.pack(f'>{len(rows)}Q', *rows)
+
+
+def _band_keys(signature):
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(_pack_rows(rows), digest_size=16).hexdigest()
+        keys.append(f"{band:02d}{digest}")
+    return keys
+
+
+def _best_near_match(signature, exclude_id=None):
+    """Highest similarity against LSH candidates sharing at least one band"""
+    query = db.session.query(LshBucket.upload_id)\
+        .filter(LshBucket.band_key.in_(_band_keys(signature)))
+    if exclude_id is not None:
+        query = query.filter(LshBucket.upload_id != exclude_id)
+    candidate_ids = {upload_id for (upload_id,) in query.distinct().limit(200)}
+    if not candidate_ids:
+        return 0.0
+
+    best = 0.0
+    for row in ContentSignature.query.filter(ContentSignature.upload_id.in_(candidate_ids)):
+        best = max(best, similarity(signature, _unpack(row.minhash)))
+    return best
+
+
+def signature_for_file(file_path, category):
+    """
+    MinHash signature for a text-like upload, or None if it doesn't apply (binary or
+    too short). Raises OSError if the file can't be read.
+    """
+    if category not in TEXT_CATEGORIES:
+        return None
+    text = _read_text_sample(file_path)
+    return compute_minhash(text) if text else None
+
+
+def _score(content_hash, signature, exclude_id=None):
+    if content_hash:
+        exact = Upload.query.filter(Upload.content_hash == content_hash)
+        if exclude_id is not None:
+            exact = exact.filter(Upload.id != exclude_id)
+        if exact.first():
+            return 1.0
+    if signature is None:
+        return 0.0
+    return round(_best_near_match(signature, exclude_id), 3)
+
+
+def duplicate_score(file_path, category, content_hash=None, exclude_id=None):
+    """Score 0.0-1.0 of how much this file duplicates stored uploads (lookup only)"""
+    score = _score(content_hash, signature_for_file(file_path, category), exclude_id)
+    if category == 'image' and score < 1.0:
+        score = max(score, image_duplicate_score(compute_hashes(file_path), exclude_id))
+    return score
+
+
+def index_upload(upload):
+    """
+    Score an upload against the index, then add it (replacing any rows from an earlier
+    attempt) and return the score. The caller commits. Raises if the file can't be read,
+    so the analysis job is retried instead of leaving the upload out of the index.
+    """
+    try:
+        remove_from_index(upload.id)
+        signature = signature_for_file(upload.file_path, upload.category)
+        upload.duplicate_score = _score(upload.content_hash, signature, exclude_id=upload.id)
+        if upload.category == 'image':
+            upload.duplicate_score = max(upload.duplicate_score, index_image(upload))
+        if signature is not None:
+            db.session.add(ContentSignature(upload_id=upload.id, minhash=_pack(signature)))
+            for key in _band_keys(signature):
+                db.session.add(LshBucket(band_key=key, upload_id=upload.id))
+    except Exception as e:
+        app.logger.error(f"Duplicate indexing failed for upload {upload.id}: {e}")
+        raise
+    return upload.duplicate_score
+
+
+def remove_from_index(upload_id):
+    """Drop an upload's signature, LSH bands and image hashes. The caller commits."""
+    LshBucket.query.filter_by(upload_id=upload_id).delete()
+    ContentSignature.query.filter_by(upload_id=upload_id).delete()
+    remove_image(upload_id)
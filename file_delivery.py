@@ -0,0 +1,96 @@
+"""
+File delivery for Alpha Nex
+Uploads are served with strong ETags taken from their content hash, conditional and
+byte-range requests (seeking in audio/video), and optionally handed off to a fronting
+proxy via X-Accel-Redirect (nginx) or X-Sendfile (Apache/lighttpd), so large media is
+sent by the proxy instead of streaming through a Python worker
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+from flask import Response, request, send_file
+from app import app
+
+# '', 'x-accel-redirect' or 'x-sendfile'
+OFFLOAD_MODE = os.environ.get("FILE_OFFLOAD", "").lower()
+# nginx `internal` location that aliases the upload folder
+ACCEL_PREFIX = os.environ.get("FILE_ACCEL_PREFIX", "/_protected_uploads/")
+CACHE_MAX_AGE = 24 * 3600  # an upload's bytes never change under its id
+# Only types a browser plays or paints without running anything may be shown inline;
+# html, svg, xml, pdf and scripts always download
+INLINE_IMAGE_TYPES = frozenset(('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp',
+                                'image/avif'))
+
+
+def _content_disposition(as_attachment, download_name):
+    disposition = 'attachment' if as_attachment else 'inline'
+    try:
+        download_name.encode('ascii')
+        return f'{disposition}; filename="{download_name}"'
+    except UnicodeEncodeError:
+        fallback = download_name.encode('ascii', 'ignore').decode('ascii') or 'download'
+        return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(download_name, safe='')}"
+
+
+def _offload_target(path):
+    """Header name and value for the configured proxy, or None to serve from Python"""
+    abs_path = os.path.abspath(path)
+    if OFFLOAD_MODE == 'x-sendfile':
+        return 'X-Sendfile', abs_path
+    if OFFLOAD_MODE == 'x-accel-redirect':
+        relative = os.path.relpath(abs_path, os.path.abspath(app.config['UPLOAD_FOLDER']))
+        if relative.startswith('..'):
+            return None  # outside the aliased folder
+        return 'X-Accel-Redirect', ACCEL_PREFIX.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+    return None
+
+
+def inline_allowed(mimetype):
+    return mimetype.startswith(('audio/', 'video/')) or mimetype in INLINE_IMAGE_TYPES
+
+
+def _protect(response):
+    """Uploads are untrusted: no type sniffing, and anything rendered runs sandboxed"""
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    return response
+
+
+def _private_cache(response):
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    return response
+
+
+def deliver_upload(upload, as_attachment=True):
+    """
+    Response for an upload's bytes. Raises FileNotFoundError if the file is gone
+    (only when serving from Python; a proxy reports its own 404). Inline delivery is
+    only honoured for audio, video and raster images; everything else downloads.
+    """
+    etag = upload.content_hash  # strong: the SHA-256 of the exact bytes
+    download_name = upload.original_filename
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    as_attachment = as_attachment or not inline_allowed(mimetype)
+    target = _offload_target(upload.file_path)
+
+    if target is None:
+        response = send_file(upload.file_path, mimetype=mimetype, as_attachment=as_attachment,
+                             download_name=download_name, conditional=True,
+                             etag=etag or True, max_age=CACHE_MAX_AGE)
+        return _protect(_private_cache(response))
+
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return _protect(_private_cache(response))
+
+    # The proxy does the byte ranges and If-Range; it sees our ETag on the response
+    response = Response(status=200, mimetype=mimetype)
+    response.headers[target[0]] = target[1]
+    response.headers['Content-Disposition'] = _content_disposition(as_attachment, download_name)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if etag:
+        response.set_etag(etag)
+    return _protect(_private_cache(response))
@@ -3,6 +3,7 @@ from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms import StringField, TextAreaField, PasswordField, SelectField, BooleanField, IntegerField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError
 from models import User
+from utils import validate_content_description
 
 class SignupForm(FlaskForm):
     """User registration form with validation"""
@@ -68,6 +69,11 @@ class UploadForm(FlaskForm):
         validators=[DataRequired()]
     )
 
+    def validate_description(self, field):
+        valid, message = validate_content_description(field.data)
+        if not valid:
+            raise ValidationError(message)
+
 class ReviewForm(FlaskForm):
     rating = SelectField('Rating', validators=[DataRequired()], choices=[
         ('good', 'Good - High quality content'),
@@ -0,0 +1,93 @@
+"""
+Garbage collection of abandoned guest users for Alpha Nex
+Guest rows with no XP and nothing attached (uploads, reviews, ratings, strikes, ...)
+are deleted by a scheduled job in bounded batches once they are older than
+GUEST_MAX_AGE_DAYS
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, exists, func, select
+from app import app, db, scheduler
+from models import (User, Upload, Review, Rating, Strike, WithdrawalRequest, AdminAction,
+                    PartialUpload)
+
+GUEST_MAX_AGE_DAYS = int(os.environ.get("GUEST_MAX_AGE_DAYS", "30"))
+BATCH_SIZE = 500
+MAX_BATCHES_PER_RUN = 20  # at most 10k rows per run; the backlog drains over later runs
+GC_INTERVAL_MINUTES = 30
+
+# Every table that points at user.id; a row in any of them keeps the user
+_REFERENCES = [
+    (Upload, Upload.user_id),
+    (Review, Review.reviewer_id),
+    (Rating, Rating.user_id),
+    (Strike, Strike.user_id),
+    (WithdrawalRequest, WithdrawalRequest.user_id),
+    (AdminAction, AdminAction.admin_id),
+    (PartialUpload, PartialUpload.user_id),
+]
+
+gc_stats = {'runs': 0, 'deleted_total': 0, 'last_run_at': None, 'last_deleted': 0,
+            'last_batches': 0, 'last_duration_ms': 0, 'last_error': None}
+
+
+def _abandoned(cutoff):
+    """Condition for guest users created before cutoff with no XP and nothing referencing them"""
+    # XP outlives the rows that earned it (a reviewer keeps it after the upload is deleted)
+    conditions = [User.is_guest.is_(True), User.created_at < cutoff,
+                  func.coalesce(User.xp_points, 0) == 0]
+    conditions += [~exists().where(column == User.id) for _, column in _REFERENCES]
+    return and_(*conditions)
+
+
+def collect_guests(max_age_days=GUEST_MAX_AGE_DAYS, batch_size=BATCH_SIZE,
+                   max_batches=MAX_BATCHES_PER_RUN):
+    """Delete abandoned guests batch by batch (one short transaction each); returns rows deleted"""
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    deleted = batches = 0
+    while batches < max_batches:
+        ids = [user_id for (user_id,) in db.session.execute(
+            select(User.id).where(_abandoned(cutoff)).order_by(User.id).limit(batch_size))]
+        if not ids:
+            break
+        # Re-check the condition in the DELETE so a guest that just wrote something survives
+        result = db.session.execute(
+            delete(User).where(User.id.in_(ids), _abandoned(cutoff))
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        deleted += result.rowcount
+        batches += 1
+        if len(ids) < batch_size:
+            break
+    return deleted, batches
+
+
+def collect_abandoned_guests():
+    """Scheduled guest GC with run metrics (leaderboard totals catch up on their next refresh)"""
+    with app.app_context():
+        started = time.monotonic()
+        gc_stats['runs'] += 1
+        gc_stats['last_run_at'] = datetime.utcnow().isoformat()
+        try:
+            deleted, batches = collect_guests()
+            gc_stats.update(last_deleted=deleted, last_batches=batches, last_error=None)
+            gc_stats['deleted_total'] += deleted
+            if deleted:
+                app.logger.info(f"Guest GC removed {deleted} abandoned users in {batches} batches")
+        except Exception as e:
+            db.session.rollback()
+            gc_stats['last_error'] = str(e)
+            app.logger.error(f"Guest GC failed: {e}")
+        finally:
+            gc_stats['last_duration_ms'] = int((time.monotonic() - started) * 1000)
+            db.session.remove()
+
+
+if scheduler:
+    try:
+        scheduler.add_job(collect_abandoned_guests, 'interval', minutes=GC_INTERVAL_MINUTES,
+                          id='collect_abandoned_guests', replace_existing=True,
+                          max_instances=1, coalesce=True)
+    except Exception as e:
+        app.logger.error(f"Guest GC job registration failed: {e}")
@@ -0,0 +1,183 @@
+"""
+Request identity for Alpha Nex
+The session's user is resolved at most once per request and memoized on flask.g. A
+visitor who has never written anything is an unsaved guest and costs no query at all.
+Immutable identity fields (id, username, is_guest) are also kept in a short-TTL
+process cache for endpoints that only need to know who is calling.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from flask import g, has_request_context, session
+from app import db
+from models import User
+from leaderboard import register_new_user
+
+IDENTITY_CACHE_TTL_SECONDS = float(os.environ.get("IDENTITY_CACHE_TTL_SECONDS", "60"))
+IDENTITY_CACHE_MAX_ENTRIES = 10000
+
+# Guests never log in, so they get a marker instead of a (deliberately slow) password hash;
+# check_password_hash() rejects it
+GUEST_PASSWORD_HASH = '!guest'
+
+Identity = namedtuple('Identity', 'id username is_guest')
+
+
+class IdentityCache:
+    """LRU of Identity by user id and by username, each entry valid for a short TTL"""
+
+    def __init__(self, ttl=IDENTITY_CACHE_TTL_SECONDS, max_entries=IDENTITY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # ('id', 7) / ('username', 'user_ab12') -> (Identity, expires)
+        self._lock = threading.Lock()
+
+    def get(self, kind, value):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get((kind, value))
+            if not entry:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[(kind, value)]
+                return None
+            self._entries.move_to_end((kind, value))
+            return entry[0]
+
+    def put(self, user):
+        if self.ttl <= 0 or user.id is None:
+            return
+        identity = Identity(user.id, user.username, bool(user.is_guest))
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key in (('id', user.id), ('username', user.username)):
+                self._entries[key] = (identity, expires)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+identity_cache = IdentityCache()
+
+
+def _session_username():
+    session_id = session.get('session_id')
+    if not session_id:
+        session_id = str(uuid.uuid4())[:8]
+        session['session_id'] = session_id
+    return f"user_{session_id}"
+
+
+def _new_guest(username):
+    """Unsaved guest User for a visitor who hasn't written anything yet"""
+    now = datetime.utcnow()
+    user = User()
+    user.username = username
+    user.name = session.get('user_name', 'Demo User')
+    user.email = f"{username}@alphanex.com"
+    user.password_hash = GUEST_PASSWORD_HASH
+    user.is_guest = True
+    user.is_verified = False
+    user.kyc_verified = False
+    user.xp_points = 0
+    user.daily_upload_count = 0
+    user.daily_upload_bytes = 0
+    user.daily_review_count = 0
+    user.daily_upload_reset = now
+    user.daily_review_reset = now
+    user.uploader_strikes = 0
+    user.reviewer_strikes = 0
+    user.is_banned = False
+    user.created_at = now
+    return user
+
+
+def _loaded_users():
+    """Per-request map of user id -> User already loaded in this request"""
+    if 'identity_users' not in g:
+        g.identity_users = {}
+    return g.identity_users
+
+
+def _remember(user):
+    if user is not None and user.id is not None:
+        _loaded_users()[user.id] = user
+        identity_cache.put(user)
+    return user
+
+
+def load_user_by_id(user_id):
+    """User by id, reusing a row already loaded in this request"""
+    if has_request_context():
+        user = _loaded_users().get(user_id)
+        if user is not None:
+            return user
+        return _remember(User.query.get(user_id))
+    return User.query.get(user_id)
+
+
+def _resolve():
+    user_id = session.get('user_id')
+    if user_id:
+        user = load_user_by_id(user_id)
+        if user:
+            return user
+    username = _session_username()
+    if not (user_id or session.get('guest_saved')):
+        return _new_guest(username)  # never wrote anything: nothing to look up
+    cached = identity_cache.get('username', username)
+    if cached:
+        user = load_user_by_id(cached.id)
+    else:
+        user = _remember(User.query.filter_by(username=username).first())
+    return user or _new_guest(username)
+
+
+def get_session_user():
+    """
+    User for this browser session, without writing anything: a logged-in user, the
+    session's saved guest, or else an unsaved guest (crawlers and first visits cost
+    no query, no INSERT and no password hash). Resolved once per request.
+    """
+    if 'session_user' not in g:
+        g.session_user = _resolve()
+    return g.session_user
+
+
+def get_or_create_user_for_session():
+    """
+    Session user for a request that writes. An unsaved guest is added and flushed for
+    its id, so its INSERT commits together with the write instead of on its own.
+    Guest INSERTs are not batched across requests: the write needs the row's id for its
+    foreign keys in the same transaction, and read-only visitors never insert at all.
+    """
+    user = get_session_user()
+    if user.id is None:
+        db.session.add(user)
+        db.session.flush()
+        register_new_user()
+        # Only a hint that a row may exist: if the write rolls back, the lookup just misses
+        session['guest_saved'] = True
+    return user
+
+
+def get_session_identity():
+    """
+    Identity (id, username, is_guest) of the session's saved user, or None for an unsaved
+    guest. Served from the process cache when possible, so it usually costs no query.
+    """
+    if 'session_user' in g:
+        user = g.session_user
+        return Identity(user.id, user.username, bool(user.is_guest)) if user.id is not None else None
+    user_id = session.get('user_id')
+    cached = identity_cache.get('id', user_id) if user_id else None
+    if cached is None and not user_id and session.get('guest_saved') and session.get('session_id'):
+        cached = identity_cache.get('username', f"user_{session['session_id']}")
+    if cached is not None:
+        return cached
+    user = get_session_user()
+    return Identity(user.id, user.username, bool(user.is_guest)) if user.id is not None else None
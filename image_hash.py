@@ -0,0 +1,162 @@
+"""
+Perceptual image hashing for Alpha Nex
+aHash/dHash/pHash of a downscaled grayscale copy, looked up by Hamming distance
+through a multi-index on four 16-bit chunks of the pHash
+"""
+import math
+from itertools import combinations
+from sqlalchemy import case, or_
+from app import db
+from models import ImageHash
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+# Each chunk is probed with every value within PROBE_BITS of it. A hash within
+# CHUNKS * (PROBE_BITS + 1) - 1 bits has some chunk that close (pigeonhole), so the
+# candidates are complete up to that distance, which must cover MAX_DISTANCE.
+PROBE_BITS = 2
+MAX_DISTANCE = 10
+MAX_CANDIDATES = 500
+assert MAX_DISTANCE <= CHUNKS * (PROBE_BITS + 1) - 1
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+            for u in range(_DCT_KEEP)]
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _to_signed(value):
+    """Store unsigned 64-bit hashes in a signed BIGINT column"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _chunks(value):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(CHUNKS)]
+
+
+def _probes(chunk):
+    """The chunk and every value within PROBE_BITS bits of it (137 for 16-bit chunks)"""
+    values = [chunk]
+    for flips in range(1, PROBE_BITS + 1):
+        for bits in combinations(range(CHUNK_BITS), flips):
+            value = chunk
+            for bit in bits:
+                value ^= 1 << bit
+            values.append(value)
+    return values
+
+
+def hamming(a, b):
+    return bin(_to_unsigned(a) ^ _to_unsigned(b)).count('1')
+
+
+def _pixels(img, width, height):
+    from PIL import Image
+    return list(img.resize((width, height), Image.LANCZOS).getdata())
+
+
+def compute_hashes(file_path):
+    """
+    Return (ahash, dhash, phash) as unsigned 64-bit ints, or None if the file isn't a
+    decodable image. Raises OSError if the file itself can't be read.
+    """
+    with open(file_path, 'rb') as f:
+        return _hashes(f)
+
+
+def _hashes(f):
+    """Hashes of an open file; None if it doesn't decode as an image"""
+    try:
+        from PIL import Image
+        with Image.open(f) as img:
+            # Let JPEG decode at reduced size; only a 32x32 copy is needed
+            img.draft('L', (_DCT_SIZE * 2, _DCT_SIZE * 2))
+            gray = img.convert('L')
+            gray.thumbnail((_DCT_SIZE * 4, _DCT_SIZE * 4))
+
+            small = _pixels(gray, 8, 8)
+            mean = sum(small) / len(small)
+            ahash = _bits_to_int(p > mean for p in small)
+
+            wide = _pixels(gray, 9, 8)
+            dhash = _bits_to_int(wide[row * 9 + col] > wide[row * 9 + col + 1]
+                                 for row in range(8) for col in range(8))
+
+            pixels = _pixels(gray, _DCT_SIZE, _DCT_SIZE)
+            rows = [pixels[r * _DCT_SIZE:(r + 1) * _DCT_SIZE] for r in range(_DCT_SIZE)]
+            # Separable 2D DCT-II, keeping only the 8x8 low frequencies
+            row_dct = [[sum(c * p for c, p in zip(_DCT_COS[u], row)) for u in range(_DCT_KEEP)]
+                       for row in rows]
+            coeffs = [sum(_DCT_COS[v][r] * row_dct[r][u] for r in range(_DCT_SIZE))
+                      for v in range(_DCT_KEEP) for u in range(_DCT_KEEP)]
+            median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]  # skip the DC term
+            phash = _bits_to_int(c > median for c in coeffs)
+
+            return ahash, dhash, phash
+    except Exception:
+        return None
+
+
+def _nearest(phash, dhash, exclude_id=None):
+    """Smallest distance (the worse of pHash/dHash) among stored hashes near in some pHash chunk"""
+    columns = [getattr(ImageHash, f'phash_{i}') for i in range(CHUNKS)]
+    chunks = _chunks(phash)
+    query = db.session.query(ImageHash.phash, ImageHash.dhash).filter(
+        or_(*[column.in_(_probes(chunk)) for column, chunk in zip(columns, chunks)]))
+    if exclude_id is not None:
+        query = query.filter(ImageHash.upload_id != exclude_id)
+    # Rows sharing more chunks exactly are closer on average; score those first when capped
+    exact_chunks = sum(case((column == chunk, 1), else_=0) for column, chunk in zip(columns, chunks))
+
+    best = None
+    for row in query.order_by(exact_chunks.desc()).limit(MAX_CANDIDATES):
+        distance = max(hamming(phash, row.phash), hamming(dhash, row.dhash))
+        if best is None or distance < best:
+            best = distance
+            if best == 0:
+                break
+    return best
+
+
+def image_duplicate_score(hashes, exclude_id=None):
+    """1.0 for a perceptually identical image, falling to 0.0 at MAX_DISTANCE bits apart"""
+    if not hashes:
+        return 0.0
+    _, dhash, phash = hashes
+    distance = _nearest(phash, dhash, exclude_id)
+    if distance is None or distance >= MAX_DISTANCE:
+        return 0.0
+    return round(1.0 - distance / MAX_DISTANCE, 3)
+
+
+def index_image(upload):
+    """Score an image upload against stored hashes and store its own. The caller commits."""
+    hashes = compute_hashes(upload.file_path)
+    if not hashes:
+        return 0.0
+    score = image_duplicate_score(hashes, exclude_id=upload.id)
+
+    ahash, dhash, phash = hashes
+    row = ImageHash(upload_id=upload.id, ahash=_to_signed(ahash),
+                    dhash=_to_signed(dhash), phash=_to_signed(phash))
+    for i, chunk in enumerate(_chunks(phash)):
+        setattr(row, f'phash_{i}', chunk)
+    db.session.add(row)
+    return score
+
+
+def remove_image(upload_id):
+    ImageHash.query.filter_by(upload_id=upload_id).delete()
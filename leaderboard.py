@@ -0,0 +1,141 @@
+"""
+Leaderboard service for Alpha Nex
+Keeps uploader/reviewer standings in memory so /ranking doesn't aggregate on every hit
+"""
+import threading
+from sqlalchemy import func
+from app import app, db, scheduler
+from models import User, Upload, Review
+from rank_service import CountHistogram
+
+LEADERBOARD_SIZE = 10
+REFRESH_INTERVAL_MINUTES = 5
+
+
+class Leaderboard:
+    """Per-user activity counts, a sorted top-N list and a count histogram, updated incrementally"""
+
+    def __init__(self, name, count_query, size=LEADERBOARD_SIZE):
+        self.name = name
+        self.size = size
+        self._count_query = count_query
+        self._counts = {}
+        self._top = []  # [(count, user_id)] sorted best first
+        self.histogram = CountHistogram()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def refresh(self):
+        """Reload every user's count from the database (one GROUP BY)"""
+        counts = {user_id: count for user_id, count in self._count_query() if count}
+        total_users = User.query.count()
+        with self._lock:
+            self.histogram.rebuild(counts, total_users)
+            self._counts = counts
+            self._top = sorted(((c, uid) for uid, c in counts.items()),
+                               key=lambda entry: (-entry[0], entry[1]))[:self.size]
+            self._loaded = True
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def adjust(self, user_id, delta=1):
+        """Apply an upload/review write to the standings"""
+        with self._lock:
+            if not self._loaded:
+                return  # The next refresh picks the write up
+            previous = self._counts.get(user_id, 0)
+            count = max(previous + delta, 0)
+            self.histogram.move(previous, count)
+            if count:
+                self._counts[user_id] = count
+            else:
+                self._counts.pop(user_id, None)
+
+            in_top = any(uid == user_id for _, uid in self._top)
+            if in_top and delta < 0 and len(self._counts) > self.size:
+                # Someone outside the list may now outrank this user
+                self._top = sorted(((c, uid) for uid, c in self._counts.items()),
+                                   key=lambda entry: (-entry[0], entry[1]))[:self.size]
+                return
+
+            entries = [(c, uid) for c, uid in self._top if uid != user_id]
+            if count:
+                entries.append((count, user_id))
+            entries.sort(key=lambda entry: (-entry[0], entry[1]))
+            self._top = entries[:self.size]
+
+    def add_user(self):
+        """Count a newly created user (with no activity) in the histogram"""
+        if self._loaded:
+            self.histogram.add_user()
+
+    def top_percent(self, count):
+        """Percentage of users at or above this count, or None when standings aren't loaded"""
+        if not self._loaded:
+            return None
+        return self.histogram.top_percent(count)
+
+    def count_for(self, user_id):
+        """Current count for a user, or None when standings aren't loaded"""
+        if not self._loaded:
+            return None
+        return self._counts.get(user_id, 0)
+
+    def top_users(self):
+        """Return the top users as (User, count) pairs, loading User rows in one query"""
+        self.ensure_loaded()
+        with self._lock:
+            top = list(self._top)
+        if not top:
+            return []
+
+        users = {u.id: u for u in User.query.filter(User.id.in_([uid for _, uid in top])).all()}
+        ranked = [(users[uid], count) for count, uid in top if uid in users]
+        ranked.sort(key=lambda entry: (-entry[1], -(entry[0].xp_points or 0)))
+        return ranked
+
+
+def _upload_counts():
+    return db.session.query(Upload.user_id, func.count(Upload.id))\
+        .group_by(Upload.user_id).all()
+
+
+def _review_counts():
+    return db.session.query(Review.reviewer_id, func.count(Review.id))\
+        .group_by(Review.reviewer_id).all()
+
+
+uploader_board = Leaderboard('uploaders', _upload_counts)
+reviewer_board = Leaderboard('reviewers', _review_counts)
+
+
+def register_new_user():
+    """Tell both boards a user row was created so percentiles stay accurate"""
+    uploader_board.add_user()
+    reviewer_board.add_user()
+
+
+def refresh_leaderboards():
+    """Rebuild both boards from the database (scheduled; also fixes drift between workers)"""
+    with app.app_context():
+        try:
+            uploader_board.refresh()
+            reviewer_board.refresh()
+        except Exception as e:
+            app.logger.error(f"Leaderboard refresh failed: {e}")
+        finally:
+            db.session.remove()
+
+
+if scheduler:
+    try:
+        scheduler.add_job(refresh_leaderboards, 'interval', minutes=REFRESH_INTERVAL_MINUTES,
+                          id='refresh_leaderboards', replace_existing=True)
+    except Exception as e:
+        app.logger.error(f"Leaderboard job registration failed: {e}")
@@ -1,8 +1,27 @@
 from app import db
 from flask_login import UserMixin
 from datetime import datetime, timedelta
+from flask import g, has_app_context
 from sqlalchemy import func
 
+# Daily quota policy
+DAILY_UPLOAD_LIMIT = 3
+DAILY_UPLOAD_BYTES = 500 * 1024 * 1024  # 500MB
+DAILY_REVIEW_LIMIT = 5
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024  # 100MB per file
+
+
+def _request_memo(name):
+    """Per-request memo dict kept on flask.g (a throwaway dict outside an app context)"""
+    if not has_app_context():
+        return {}
+    memo = g.get(name)
+    if memo is None:
+        memo = {}
+        setattr(g, name, memo)
+    return memo
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -16,6 +35,14 @@ class User(UserMixin, db.Model):
     is_banned = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Per-session anonymous identity (no password, saved on its first write)
+    is_guest = db.Column(db.Boolean, default=False, nullable=False, server_default='0')
+
+    # Guest GC candidates (see guest_gc.py)
+    __table_args__ = (
+        db.Index('ix_user_guest_created', 'is_guest', 'created_at'),
+    )
+
     # KYC fields
     kyc_verified = db.Column(db.Boolean, default=False)
     document_path = db.Column(db.String(255))
@@ -36,78 +63,71 @@ class User(UserMixin, db.Model):
     strikes = db.relationship('Strike', backref='user', lazy=True)
 
 
-    def reset_daily_counters_if_needed(self):
-        """Reset daily counters if it's a new day"""
-        try:
-            current_date = datetime.utcnow().date()
-
-            # Reset upload counters if new day
-            if self.daily_upload_reset and current_date > self.daily_upload_reset.date():
-                self.daily_upload_bytes = 0
-                self.daily_upload_count = 0
-                self.daily_upload_reset = datetime.utcnow()
-            elif not self.daily_upload_reset:
-                self.daily_upload_reset = datetime.utcnow()
-
-            # Reset review counters if new day
-            if self.daily_review_reset and current_date > self.daily_review_reset.date():
-                self.daily_review_count = 0
-                self.daily_review_reset = datetime.utcnow()
-            elif not self.daily_review_reset:
-                self.daily_review_reset = datetime.utcnow()
-
-            db.session.commit()
-        except Exception as e:
-            pass  # Fail silently
+    def _is_today(self, stamp):
+        """True if a daily window stamp belongs to the current UTC day"""
+        return bool(stamp) and stamp.date() >= datetime.utcnow().date()
+
+    def _uploads_today(self):
+        """Today's (count, bytes) without writing: a stale window reads as empty"""
+        if not self._is_today(self.daily_upload_reset):
+            return 0, 0
+        return self.daily_upload_count or 0, self.daily_upload_bytes or 0
+
+    def _reviews_today(self):
+        """Today's review count without writing: a stale window reads as empty"""
+        if not self._is_today(self.daily_review_reset):
+            return 0
+        return self.daily_review_count or 0
+
+    def reserve_upload(self, file_size):
+        """Atomically check and count an upload against today's quota; returns a token or None"""
+        from quotas import quota_engine
+        return quota_engine.reserve_upload(self, file_size)
+
+    def refund_upload(self, file_size, reservation):
+        """Give back a reserve_upload() whose upload failed"""
+        from quotas import quota_engine
+        quota_engine.refund_upload(self, file_size, reservation)
+
+    def reserve_review(self):
+        """Atomically check and count a review against today's quota; returns a token or None"""
+        from quotas import quota_engine
+        return quota_engine.reserve_review(self)
+
+    def refund_review(self, reservation):
+        """Give back a reserve_review() whose review failed"""
+        from quotas import quota_engine
+        quota_engine.refund_review(self, reservation)
 
     def get_daily_upload_remaining(self):
         """Calculate remaining daily upload capacity in bytes"""
-        try:
-            self.reset_daily_counters_if_needed()
-            max_daily = 500 * 1024 * 1024  # 500MB in bytes
-            current_usage = self.daily_upload_bytes or 0
-            return max_daily - current_usage
-        except Exception as e:
-            return 500 * 1024 * 1024
+        from quotas import quota_engine
+        return DAILY_UPLOAD_BYTES - quota_engine.upload_bytes_used(self)
 
     def can_upload_today(self):
         """Check if user can upload more files today (max 3 per day)"""
-        try:
-            self.reset_daily_counters_if_needed()
-            return (self.daily_upload_count or 0) < 3
-        except Exception as e:
-            return True
+        from quotas import quota_engine
+        return quota_engine.uploads_used(self) < DAILY_UPLOAD_LIMIT
 
     def can_review_today(self):
         """Check if user can review more content today (max 5 per day)"""
-        try:
-            self.reset_daily_counters_if_needed()
-            return (self.daily_review_count or 0) < 5
-        except Exception as e:
-            return True
+        from quotas import quota_engine
+        return quota_engine.can_review(self)
 
     def get_remaining_uploads_today(self):
         """Get remaining upload count for today"""
-        try:
-            self.reset_daily_counters_if_needed()
-            return 3 - (self.daily_upload_count or 0)
-        except Exception as e:
-            return 3
+        from quotas import quota_engine
+        return DAILY_UPLOAD_LIMIT - quota_engine.uploads_used(self)
 
     def get_remaining_reviews_today(self):
         """Get remaining review count for today"""
-        try:
-            self.reset_daily_counters_if_needed()
-            return 5 - (self.daily_review_count or 0)
-        except Exception as e:
-            return 5
+        from quotas import quota_engine
+        return max(0, DAILY_REVIEW_LIMIT - quota_engine.reviews_used(self))
 
     def can_upload(self, file_size):
         """Check if user can upload a file of given size"""
-        return (self.get_daily_upload_remaining() >= file_size and
-                self.can_upload_today() and
-                not self.is_banned and
-                file_size <= 100 * 1024 * 1024)  # 100MB limit per file
+        from quotas import quota_engine
+        return quota_engine.can_upload(self, file_size)
 
     def add_strike(self, strike_type, reason):
         strike = Strike()
@@ -129,8 +149,15 @@ class User(UserMixin, db.Model):
 
     def get_uploader_rank(self):
         """Get user's upload ranking info"""
+        memo = _request_memo('uploader_ranks')
+        if self.id in memo:
+            return memo[self.id]
         try:
-            upload_count = Upload.query.filter_by(user_id=self.id).count()
+            from leaderboard import uploader_board
+            from rank_service import format_rank
+            upload_count = uploader_board.count_for(self.id)
+            if upload_count is None:
+                upload_count = Upload.query.filter_by(user_id=self.id).count()
             
             # Define tier thresholds and names
             tiers = [
@@ -154,20 +181,30 @@ class User(UserMixin, db.Model):
                 else:
                     break
                     
-            return {
+            # Real standing from the activity histogram; tier label as fallback
+            percent = uploader_board.top_percent(upload_count)
+            memo[self.id] = {
                 'count': upload_count,
                 'tier_name': current_tier[1],
-                'rank': current_tier[2],
+                'rank': format_rank(percent) if percent is not None else current_tier[2],
                 'next_goal': current_tier[3],
                 'threshold': current_tier[0]
             }
+            return memo[self.id]
         except:
             return {'count': 0, 'tier_name': 'Newer User', 'rank': '99%', 'next_goal': 'Complete your first upload!', 'threshold': 0}
 
     def get_reviewer_rank(self):
         """Get user's review ranking info"""
+        memo = _request_memo('reviewer_ranks')
+        if self.id in memo:
+            return memo[self.id]
         try:
-            review_count = Review.query.filter_by(reviewer_id=self.id).count()
+            from leaderboard import reviewer_board
+            from rank_service import format_rank
+            review_count = reviewer_board.count_for(self.id)
+            if review_count is None:
+                review_count = Review.query.filter_by(reviewer_id=self.id).count()
             
             # Define tier thresholds and names
             tiers = [
@@ -191,13 +228,16 @@ class User(UserMixin, db.Model):
                 else:
                     break
                     
-            return {
+            # Real standing from the activity histogram; tier label as fallback
+            percent = reviewer_board.top_percent(review_count)
+            memo[self.id] = {
                 'count': review_count,
                 'tier_name': current_tier[1],
-                'rank': current_tier[2],
+                'rank': format_rank(percent) if percent is not None else current_tier[2],
                 'next_goal': current_tier[3],
                 'threshold': current_tier[0]
             }
+            return memo[self.id]
         except:
             return {'count': 0, 'tier_name': 'Newer Reviewer', 'rank': '99%', 'next_goal': 'Complete your first review!', 'threshold': 0}
 
@@ -219,25 +259,42 @@ class Upload(db.Model):
     duplicate_score = db.Column(db.Float, default=0.0)
     spam_score = db.Column(db.Float, default=0.0)
 
+    # SHA-256 of the stored bytes (content-addressed storage key, exact-duplicate lookup)
+    content_hash = db.Column(db.String(64), index=True)
+
+    # Review aggregates, maintained by apply_review() and repaired by `flask repair-review-counts`
+    review_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    good_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    bad_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+
     # Review tracking
     reviews = db.relationship('Review', backref='upload', lazy=True, cascade='all, delete-orphan')
 
+    # Keyset pagination order for the review queue (newest first)
+    __table_args__ = (
+        db.Index('ix_upload_uploaded_at_id', 'uploaded_at', 'id'),
+        db.Index('ix_upload_user_id', 'user_id'),
+    )
+
     def __init__(self, **kwargs):
         super(Upload, self).__init__(**kwargs)
         # Set deletion deadline to 48 hours from upload
         self.deletion_deadline = datetime.utcnow() + timedelta(hours=48)
 
     def get_average_rating(self):
-        try:
-            # Query reviews directly to avoid relationship property issues
-            from app import db
-            reviews_query = db.session.query(Review).filter_by(upload_id=self.id).all()
-            if not reviews_query:
-                return None
-            good_reviews = sum(1 for r in reviews_query if r.rating == 'good')
-            return good_reviews / len(reviews_query)
-        except Exception as e:
+        """Share of 'good' reviews, read from the maintained counters"""
+        if not self.review_count:
             return None
+        return (self.good_count or 0) / self.review_count
+
+    def apply_review(self, rating, delta=1):
+        """Adjust review aggregates for a review being added (delta=1) or removed (delta=-1).
+        Uses SQL expressions so concurrent reviews don't overwrite each other's counts."""
+        self.review_count = Upload.review_count + delta
+        if rating == 'good':
+            self.good_count = Upload.good_count + delta
+        elif rating == 'bad':
+            self.bad_count = Upload.bad_count + delta
 
     def can_delete_free(self):
         return datetime.utcnow() < self.deletion_deadline
@@ -249,6 +306,83 @@ class Upload(db.Model):
         hours_late = (datetime.utcnow() - self.deletion_deadline).total_seconds() / 3600
         return min(int(hours_late * 5), 100)  # Max 100 XP penalty
 
+class StoredObject(db.Model):
+    """A content-addressed file on disk, shared by every Upload with the same bytes"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(500), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ContentSignature(db.Model):
+    """MinHash signature of an upload's text, for near-duplicate detection"""
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), primary_key=True)
+    minhash = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LshBucket(db.Model):
+    """One LSH band of a signature; uploads sharing a band key are near-duplicate candidates"""
+    id = db.Column(db.Integer, primary_key=True)
+    band_key = db.Column(db.String(40), nullable=False, index=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), nullable=False, index=True)
+
+class ImageHash(db.Model):
+    """Perceptual hashes of an image upload; phash is also split into 16-bit
+    chunks so Hamming-near hashes can be found with indexed equality lookups"""
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), primary_key=True)
+    ahash = db.Column(db.BigInteger, nullable=False)
+    dhash = db.Column(db.BigInteger, nullable=False)
+    phash = db.Column(db.BigInteger, nullable=False)
+    phash_0 = db.Column(db.Integer, nullable=False, index=True)
+    phash_1 = db.Column(db.Integer, nullable=False, index=True)
+    phash_2 = db.Column(db.Integer, nullable=False, index=True)
+    phash_3 = db.Column(db.Integer, nullable=False, index=True)
+
+class AnalysisJob(db.Model):
+    """Queued AI analysis of an upload, processed by the background analysis workers"""
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_analysis_job_status_run_after', 'status', 'run_after'),
+    )
+
+class AiCacheEntry(db.Model):
+    """Cached AI analysis response, keyed by a hash of (function, model, normalized inputs)"""
+    key = db.Column(db.String(64), primary_key=True)
+    function = db.Column(db.String(64), nullable=False)
+    value = db.Column(db.Text, nullable=False)  # JSON
+    hits = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class PartialUpload(db.Model):
+    """A resumable upload in progress: bytes land in temp_path until finalized into an Upload"""
+    id = db.Column(db.String(32), primary_key=True)  # upload token
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    original_filename = db.Column(db.String(255), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    ai_consent = db.Column(db.Boolean, default=False)
+    total_size = db.Column(db.Integer, nullable=False)
+    received_bytes = db.Column(db.Integer, default=0, nullable=False)
+    temp_path = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(20), default='uploading', nullable=False)  # uploading, finalizing, complete, rejected
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_partial_upload_status_updated', 'status', 'updated_at'),
+    )
+
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), nullable=False)
@@ -262,16 +396,22 @@ class Review(db.Model):
     is_flagged = db.Column(db.Boolean, default=False)
     quality_score = db.Column(db.Float, default=1.0)
 
+    # Lookups used by the review queue: "already reviewed by me" and "reviews per upload"
+    __table_args__ = (
+        db.Index('ix_review_reviewer_upload', 'reviewer_id', 'upload_id'),
+        db.Index('ix_review_upload_id', 'upload_id'),
+    )
+
 class Strike(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     strike_type = db.Column(db.String(20), nullable=False)  # 'uploader' or 'reviewer'
     reason = db.Column(db.String(500), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class WithdrawalRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     amount_xp = db.Column(db.Integer, nullable=False)
     amount_usd = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
@@ -283,7 +423,7 @@ class WithdrawalRequest(db.Model):
 
 class AdminAction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     action_type = db.Column(db.String(50), nullable=False)
     target_id = db.Column(db.Integer, nullable=False)  # ID of affected user/upload/etc
     description = db.Column(db.Text, nullable=False)
@@ -291,7 +431,7 @@ class AdminAction(db.Model):
 
 class Rating(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
     category = db.Column(db.String(50), nullable=False)
     description = db.Column(db.Text, nullable=False)
@@ -1,23 +1,112 @@
 import json
 import os
-from openai import OpenAI
+import re
+from openai import AsyncOpenAI
+from app import app
+from ai_cache import analysis_cache, cache_key
+from ai_client import AnalysisClientPool, CALL_TIMEOUT_SECONDS
+from text_classifier import text_classifier, CONFIDENT
 
 # Alpha Nex AI Content Analysis Service
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
+ANALYSIS_MODEL = "gpt-4o"
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Retries are left to the analysis queue; the pool enforces deadlines and the breaker
+analysis_pool = AnalysisClientPool(
+    lambda: AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=CALL_TIMEOUT_SECONDS, max_retries=0)
+) if OPENAI_API_KEY else None
 
-def detect_duplicate_content(file_path, description):
+BATCH_MAX_ITEMS = 10  # uploads packed into one batched request
+BATCH_TOKENS_PER_ITEM = 200
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_URL_RE = re.compile(r'https?://|www\.', re.IGNORECASE)
+_PROMO_RE = re.compile(r'\b(buy|cheap|discount|free|click|subscribe|promo|offer|deal|winner|'
+                       r'earn|cash|bonus|guaranteed|limited time)\b', re.IGNORECASE)
+
+def heuristic_spam_score(description):
+    """Local spam estimate 0.0-1.0 used when the AI provider is unavailable"""
+    text = description or ''
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return 0.5
+    score = min(0.4, 0.1 * len(_PROMO_RE.findall(text)))
+    score += min(0.3, 0.15 * len(_URL_RE.findall(text)))
+    if len(words) >= 8 and len(set(words)) / len(words) < 0.5:
+        score += 0.2  # repetitive
+    letters = [c for c in text if c.isalpha()]
+    if len(letters) >= 10 and sum(c.isupper() for c in letters) / len(letters) > 0.6:
+        score += 0.15  # shouting
+    if len(words) < 4:
+        score += 0.1
+    return round(min(1.0, score), 3)
+
+def heuristic_review_quality(content_text):
+    """Local review quality estimate 0.0-1.0 from length and vocabulary variety"""
+    words = _WORD_RE.findall((content_text or '').lower())
+    if not words:
+        return 0.0
+    variety = len(set(words)) / len(words)
+    return round(min(1.0, len(words) / 60) * 0.7 + variety * 0.3, 3)
+
+def heuristic_analysis(description, category):
+    spam_score = heuristic_spam_score(description)
+    return {
+        "appropriate": True,
+        "confidence": 0.3,
+        "category_match": True,
+        "issues": ["Possible spam"] if spam_score >= 0.5 else [],
+        "suggestions": []
+    }
+
+def _fallback_spam_score(local, description):
+    return round(local[0], 3) if local else heuristic_spam_score(description)
+
+def _complete(messages, max_tokens, client=None):
+    """Content of one JSON-mode chat completion, through the pool unless a client is given"""
+    kwargs = dict(model=ANALYSIS_MODEL, messages=messages,
+                  response_format={"type": "json_object"}, max_tokens=max_tokens)
+    if client is not None:
+        return client.chat.completions.create(**kwargs).choices[0].message.content
+    return analysis_pool.complete(**kwargs)
+
+def local_duplicate_score(file_path, category, content_hash=None, upload_id=None):
+    """Duplicate score 0.0-1.0 from the local hash/MinHash/image index"""
+    from duplicate_index import duplicate_score
+    try:
+        return duplicate_score(file_path, category, content_hash, exclude_id=upload_id)
+    except Exception as e:
+        app.logger.error(f"Duplicate index lookup failed: {e}")
+        return 0.0
+
+def detect_duplicate_content(file_path, description, category='text', content_hash=None, upload_id=None,
+                             raise_errors=False):
     """
-    Analyze content for potential duplicates and spam using AI.
+    Analyze content for potential duplicates and spam.
     Returns tuple of (duplicate_score, spam_score) both 0.0-1.0
-    Uses GPT-4o for intelligent content analysis.
+    The duplicate score comes from the local hash/MinHash index (the file itself);
+    GPT-4o is only asked for the spam score of the description.
+    Pass upload_id when the file is already stored so it isn't matched against itself.
+    With raise_errors a provider failure is raised (so a queue can retry) instead of
+    answered with the local fallback score.
     """
-    if not openai_client:
-        # Return default scores if OpenAI is not available
-        return 0.0, 0.0
+    duplicate_score = local_duplicate_score(file_path, category, content_hash, upload_id)
+
+    # The local classifier answers confident cases; the AI provider gets the rest
+    local = text_classifier.spam_score(description)
+    if local and (local[1] >= CONFIDENT or not analysis_pool):
+        return duplicate_score, round(local[0], 3)
+
+    if not analysis_pool:
+        # Return default spam score if OpenAI is not available
+        return duplicate_score, 0.0
+    
+    key = cache_key('detect_duplicate_content', ANALYSIS_MODEL, description)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return duplicate_score, cached['spam_score']
     
     try:
         # Create analysis prompt
@@ -26,9 +115,7 @@ def detect_duplicate_content(file_path, description):
         
         Description: "{description}"
         
-        Please evaluate:
-        1. Duplicate/repetitive content likelihood (0.0-1.0)
-        2. Spam/low-quality content likelihood (0.0-1.0)
+        Please evaluate the spam/low-quality content likelihood (0.0-1.0)
         
         Consider factors like:
         - Generic or template-like descriptions
@@ -37,42 +124,45 @@ def detect_duplicate_content(file_path, description):
         - Common spam patterns
         
         Respond with JSON in this format:
-        {{"duplicate_score": number, "spam_score": number}}
+        {{"spam_score": number}}
         """
         
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a content quality analyzer. Evaluate content descriptions for duplicate/spam likelihood and return scores between 0.0 (clean) and 1.0 (problematic)."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=150
-        )
-        
-        content = response.choices[0].message.content
+        content = _complete([
+            {
+                "role": "system",
+                "content": "You are a content quality analyzer. Evaluate content descriptions for spam likelihood and return a score between 0.0 (clean) and 1.0 (problematic)."
+            },
+            {"role": "user", "content": prompt}
+        ], 50)
         result = json.loads(content) if content else {}
-        duplicate_score = max(0.0, min(1.0, result.get("duplicate_score", 0.0)))
         spam_score = max(0.0, min(1.0, result.get("spam_score", 0.0)))
+        analysis_cache.set(key, 'detect_duplicate_content', {'spam_score': spam_score})
         
         return duplicate_score, spam_score
         
     except Exception as e:
-        print(f"OpenAI analysis failed: {e}")
-        # Return conservative scores on error
-        return 0.2, 0.2
+        if raise_errors:
+            raise
+        app.logger.error(f"OpenAI analysis failed: {e}")
+        return duplicate_score, _fallback_spam_score(local, description)
 
 def check_content_quality(content_text):
     """
     Evaluate content quality for review accuracy.
     Returns quality score 0.0-1.0
     """
-    if not openai_client:
+    local = text_classifier.quality_score(content_text)
+    if local and (local[1] >= CONFIDENT or not analysis_pool):
+        return round(local[0], 3)
+
+    if not analysis_pool:
         return 0.5  # Default neutral score
     
+    key = cache_key('check_content_quality', ANALYSIS_MODEL, content_text)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return cached['quality_score']
+    
     try:
         prompt = f"""
         Evaluate the quality of this content review:
@@ -89,35 +179,36 @@ def check_content_quality(content_text):
         {{"quality_score": number}}
         """
         
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a review quality evaluator. Score reviews based on their constructiveness and specificity."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=50
-        )
-        
-        content = response.choices[0].message.content
+        content = _complete([
+            {
+                "role": "system", 
+                "content": "You are a review quality evaluator. Score reviews based on their constructiveness and specificity."
+            },
+            {"role": "user", "content": prompt}
+        ], 50)
         result = json.loads(content) if content else {}
-        return max(0.0, min(1.0, result.get("quality_score", 0.5)))
+        quality_score = max(0.0, min(1.0, result.get("quality_score", 0.5)))
+        analysis_cache.set(key, 'check_content_quality', {'quality_score': quality_score})
+        return quality_score
         
     except Exception as e:
-        print(f"Quality check failed: {e}")
-        return 0.5
+        app.logger.error(f"Quality check failed: {e}")
+        return round(local[0], 3) if local else heuristic_review_quality(content_text)
 
-def analyze_content_description(description, category):
+def analyze_content_description(description, category, raise_errors=False):
     """
     Analyze if content description matches its category and is appropriate.
     Returns analysis results with suggestions.
+    With raise_errors a provider failure is raised instead of answered heuristically.
     """
-    if not openai_client:
+    if not analysis_pool:
         return {"appropriate": True, "confidence": 0.5, "suggestions": []}
     
+    key = cache_key('analyze_content_description', ANALYSIS_MODEL, description, category)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return cached
+    
     try:
         prompt = f"""
         Analyze this content description and category match:
@@ -140,28 +231,115 @@ def analyze_content_description(description, category):
         }}
         """
         
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a content moderation assistant evaluating uploads for appropriateness and category matching."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=300
-        )
-        
-        content = response.choices[0].message.content
-        return json.loads(content) if content else {}
+        content = _complete([
+            {
+                "role": "system",
+                "content": "You are a content moderation assistant evaluating uploads for appropriateness and category matching."
+            },
+            {"role": "user", "content": prompt}
+        ], 300)
+        result = json.loads(content) if content else {}
+        if result:
+            analysis_cache.set(key, 'analyze_content_description', result)
+        return result
         
     except Exception as e:
-        print(f"Content analysis failed: {e}")
-        return {
-            "appropriate": True,
-            "confidence": 0.5,
-            "category_match": True,
-            "issues": [],
-            "suggestions": []
-        }
+        if raise_errors:
+            raise
+        app.logger.error(f"Content analysis failed: {e}")
+        return heuristic_analysis(description, category)
+
+def _clamp(value, default):
+    try:
+        return max(0.0, min(1.0, float(value)))
+    except (TypeError, ValueError):
+        return default
+
+def _normalize_batch_item(raw):
+    """Coerce one model-reported batch entry into the shape callers rely on"""
+    return {
+        "spam_score": _clamp(raw.get("spam_score"), 0.0),
+        "appropriate": raw.get("appropriate") is not False,
+        "confidence": _clamp(raw.get("confidence"), 0.5),
+        "category_match": raw.get("category_match") is not False,
+        "issues": [str(i) for i in raw.get("issues") or []],
+        "suggestions": [str(s) for s in raw.get("suggestions") or []],
+    }
+
+def _request_batch(chunk, client=None):
+    """One chat completion for up to BATCH_MAX_ITEMS (ref, description, category) tuples"""
+    payload = [{"ref": ref, "category": category, "description": description}
+               for ref, description, category in chunk]
+    prompt = f"""
+    Evaluate each upload below independently.
+    
+    Uploads:
+    {json.dumps(payload, ensure_ascii=False)}
+    
+    For every upload give:
+    - spam_score: spam/low-quality likelihood 0.0-1.0 (generic or template-like text,
+      promotional language, lack of specific details, common spam patterns)
+    - appropriate: whether it is appropriate for a professional platform
+    - confidence: 0.0-1.0
+    - category_match: whether the description matches its category
+    - issues, suggestions: lists of short strings
+    
+    Respond with JSON, one entry per upload, echoing its ref:
+    {{"results": [{{"ref": string, "spam_score": number, "appropriate": boolean,
+    "confidence": number, "category_match": boolean, "issues": [], "suggestions": []}}]}}
+    """
+    content = _complete([
+        {
+            "role": "system",
+            "content": "You are a content moderation assistant. You receive a list of uploads and evaluate each one on its own for spam likelihood, appropriateness and category matching."
+        },
+        {"role": "user", "content": prompt}
+    ], BATCH_TOKENS_PER_ITEM * len(chunk) + 50, client)
+    result = json.loads(content) if content else {}
+    entries = result.get("results") if isinstance(result, dict) else None
+    return {str(e.get("ref")): e for e in entries or [] if isinstance(e, dict)}
+
+def analyze_descriptions_batch(items, client=None):
+    """
+    Analyze many upload descriptions with as few requests as possible. Items the
+    local classifier is confident about never reach the AI provider.
+    items is a list of dicts with 'id', 'description' and 'category'. Returns
+    {id: {"spam_score", "appropriate", "confidence", "category_match", "issues", "suggestions"}}
+    for the items that were analyzed; items missing from the result failed and
+    should be retried. client defaults to the pooled OpenAI client and may be any
+    object with a compatible synchronous chat.completions.create (e.g. a local stub).
+    """
+    results = {}
+    pending = []
+    for item in items:
+        local = text_classifier.spam_score(item['description'])
+        if local and local[1] >= CONFIDENT:
+            results[item['id']] = _normalize_batch_item({"spam_score": local[0], "confidence": local[1]})
+            continue
+        if client is None and not analysis_pool:
+            results[item['id']] = _normalize_batch_item(
+                {"spam_score": local[0], "confidence": local[1]} if local else {})
+            continue
+        key = cache_key('analyze_descriptions_batch', ANALYSIS_MODEL, item['description'], item['category'])
+        cached = analysis_cache.get(key)
+        if cached is not None:
+            results[item['id']] = cached
+        else:
+            pending.append((item, key))
+
+    for start in range(0, len(pending), BATCH_MAX_ITEMS):
+        chunk = pending[start:start + BATCH_MAX_ITEMS]
+        try:
+            # Refs are positions within the request, so no database ids reach the model
+            entries = _request_batch([(str(i), item['description'], item['category'])
+                                      for i, (item, _) in enumerate(chunk)], client)
+        except Exception as e:
+            app.logger.warning(f"Batch analysis of {len(chunk)} items failed: {e}")
+            continue
+        for i, (item, key) in enumerate(chunk):
+            raw = entries.get(str(i))
+            if raw is None:
+                continue
+            results[item['id']] = _normalize_batch_item(raw)
+            analysis_cache.set(key, 'analyze_descriptions_batch', results[item['id']])
+    return results
@@ -0,0 +1,155 @@
+"""
+Banned phrase matching for Alpha Nex
+Moderator-maintained phrase list compiled into an Aho-Corasick automaton, so checking a
+description is one pass over its text however many phrases are configured. The list
+file is reloaded when it changes.
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from app import app
+
+PHRASES_PATH = os.environ.get("SPAM_PHRASES_PATH", os.path.join("instance", "spam_phrases.txt"))
+WORD_BOUNDARY = os.environ.get("SPAM_PHRASES_WORD_BOUNDARY", "1") == "1"
+STRIP_ACCENTS = os.environ.get("SPAM_PHRASES_STRIP_ACCENTS", "1") == "1"
+RELOAD_CHECK_SECONDS = 5
+
+# Used when no phrase file exists
+DEFAULT_PHRASES = ['free money', 'click here', 'guaranteed', 'act now']
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize(text, strip_accents=STRIP_ACCENTS):
+    """NFKC, casefold, optionally drop accents, collapse whitespace"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    if strip_accents:
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class PhraseAutomaton:
+    """Aho-Corasick automaton over normalized phrases"""
+
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.phrase = [None]  # phrase ending at this node
+        self.output = [-1]  # nearest proper suffix node that ends a phrase
+        for phrase in phrases:
+            self._add(phrase)
+        self._link()
+
+    def _add(self, phrase):
+        node = 0
+        for char in phrase:
+            nxt = self.goto[node].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.phrase.append(None)
+                self.output.append(-1)
+            node = nxt
+        self.phrase[node] = phrase
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                target = self.fail[child]
+                self.output[child] = target if self.phrase[target] is not None else self.output[target]
+                queue.append(child)
+
+    def matches(self, text):
+        """Yield (start, end, phrase) for every occurrence, in order of end position"""
+        node = 0
+        goto, fail = self.goto, self.fail
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            hit = node if self.phrase[node] is not None else self.output[node]
+            while hit > 0:
+                phrase = self.phrase[hit]
+                yield i + 1 - len(phrase), i + 1, phrase
+                hit = self.output[hit]
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+class PhraseList:
+    """Phrase file (one phrase per line, # comments) with mtime-based hot reload"""
+
+    def __init__(self, path=PHRASES_PATH, word_boundary=WORD_BOUNDARY, strip_accents=STRIP_ACCENTS):
+        self.path = path
+        self.word_boundary = word_boundary
+        self.strip_accents = strip_accents
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._compile(DEFAULT_PHRASES)
+
+    def _compile(self, phrases):
+        normalized = {normalize(p, self.strip_accents) for p in phrases}
+        normalized.discard('')
+        self.phrases = sorted(normalized)
+        self.automaton = PhraseAutomaton(self.phrases)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            if mtime is None:
+                self._compile(DEFAULT_PHRASES)
+                return
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._compile(line.split('#', 1)[0] for line in f)
+            except OSError as e:
+                app.logger.error(f"Phrase list reload failed, keeping the previous list: {e}")
+
+    def reload(self):
+        self._checked_at = 0.0
+        self._refresh()
+
+    def _matches(self, text):
+        self._refresh()
+        text = normalize(text, self.strip_accents)
+        for start, end, phrase in self.automaton.matches(text):
+            if self.word_boundary and ((start > 0 and _is_word_char(text[start - 1])) or
+                                       (end < len(text) and _is_word_char(text[end]))):
+                continue
+            yield phrase
+
+    def find_all(self, text):
+        """Matched phrases in order of appearance (repeats included)"""
+        return list(self._matches(text))
+
+    def first_match(self, text):
+        return next(self._matches(text), None)
+
+
+spam_phrases = PhraseList()
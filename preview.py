@@ -0,0 +1,457 @@
+"""
+File previews for Alpha Nex
+Only a bounded prefix (plus a few header seeks for media) is read. The real format is
+sniffed from magic bytes, a category-specific preview is rendered (text head, CSV rows,
+archive listing, image dimensions, audio/video metadata) and the result is cached per
+content in memory and on disk, so repeat viewers never touch the file again.
+"""
+import csv
+import fnmatch
+import glob
+import io
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+from app import app
+from utils import format_file_size
+from archive_inspector import inspect_archive, ArchiveRejected
+
+PREVIEW_VERSION = 4  # bump to invalidate cached previews after a format change
+PREFIX_BYTES = 64 * 1024
+TEXT_PREVIEW_CHARS = 2000
+CSV_PREVIEW_ROWS = 20
+MEMORY_CACHE_ENTRIES = 500
+
+# (offset, magic bytes, kind, format); checked in order
+_MAGIC = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image', 'png'),
+    (0, b'\xff\xd8\xff', 'image', 'jpeg'),
+    (0, b'GIF87a', 'image', 'gif'),
+    (0, b'GIF89a', 'image', 'gif'),
+    (0, b'BM', 'image', 'bmp'),
+    (0, b'II*\x00', 'image', 'tiff'),
+    (0, b'MM\x00*', 'image', 'tiff'),
+    (0, b'\x00\x00\x01\x00', 'image', 'ico'),
+    (0, b'8BPS', 'image', 'psd'),
+    (0, b'%PDF-', 'document', 'pdf'),
+    (0, b'PK\x03\x04', 'archive', 'zip'),
+    (0, b'PK\x05\x06', 'archive', 'zip'),
+    (0, b'\x1f\x8b', 'archive', 'gzip'),
+    (0, b'BZh', 'archive', 'bzip2'),
+    (0, b'\xfd7zXZ\x00', 'archive', 'xz'),
+    (0, b"7z\xbc\xaf'\x1c", 'archive', '7z'),
+    (0, b'Rar!\x1a\x07', 'archive', 'rar'),
+    (257, b'ustar', 'archive', 'tar'),
+    (0, b'ID3', 'audio', 'mp3'),
+    (0, b'fLaC', 'audio', 'flac'),
+    (0, b'OggS', 'audio', 'ogg'),
+    (0, b'#!AMR', 'audio', 'amr'),
+    (0, b'\x1aE\xdf\xa3', 'video', 'matroska'),
+    (0, b'\x00\x00\x01\xba', 'video', 'mpeg'),
+    (0, b'\x00\x00\x01\xb3', 'video', 'mpeg'),
+    (0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11', 'video', 'asf'),
+    (0, b'FLV\x01', 'video', 'flv'),
+]
+
+_RIFF_FORMATS = {b'WAVE': ('audio', 'wav'), b'AVI ': ('video', 'avi'), b'WEBP': ('image', 'webp')}
+
+# Zip-based documents and packages, told apart by their first entry; they are not screened as archives
+_ZIP_MIMETYPES = {b'application/epub+zip': 'epub', b'application/vnd.oasis.opendocument': 'opendocument'}
+
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _zip_container(prefix):
+    """('document', fmt) for OOXML/OpenDocument/EPUB and ('binary', 'jar') for jars, else None"""
+    if len(prefix) < 30:
+        return None
+    name_length, extra_length = struct.unpack_from('<2H', prefix, 26)
+    name = prefix[30:30 + name_length]
+    if name in (b'[Content_Types].xml', b'_rels/.rels'):
+        return 'document', 'ooxml'
+    if name == b'mimetype':
+        content = prefix[30 + name_length + extra_length:][:64]
+        for mimetype, fmt in _ZIP_MIMETYPES.items():
+            if content.startswith(mimetype):
+                return 'document', fmt
+    if name.startswith(b'META-INF/'):
+        return 'binary', 'jar'
+    return None
+
+
+def sniff(prefix):
+    """(kind, format) from magic bytes; kind is image/audio/video/archive/document/text/binary"""
+    if prefix[:4] == b'PK\x03\x04':
+        container = _zip_container(prefix)
+        if container:
+            return container
+    if prefix[:4] == b'RIFF' and prefix[8:12] in _RIFF_FORMATS:
+        return _RIFF_FORMATS[prefix[8:12]]
+    if prefix[4:8] == b'ftyp':
+        brand = prefix[8:12]
+        return ('audio', 'm4a') if brand in (b'M4A ', b'M4B ') else ('video', 'mp4')
+    for offset, magic, kind, fmt in _MAGIC:
+        if prefix[offset:offset + len(magic)] == magic:
+            return kind, fmt
+    if len(prefix) > 1 and prefix[0] == 0xff and prefix[1] & 0xe0 == 0xe0:
+        return 'audio', 'mp3'  # bare MPEG audio frame
+    if _looks_like_text(prefix):
+        return 'text', None
+    return 'binary', None
+
+
+def _looks_like_text(prefix):
+    if b'\x00' in prefix[:8192]:
+        return False
+    try:
+        prefix.decode('utf-8')
+        return True
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the prefix bound is still text
+        return e.start >= len(prefix) - 3
+
+
+def _decode(prefix):
+    return prefix.decode('utf-8', errors='ignore')
+
+
+def _format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+def _text_preview(prefix, truncated):
+    text = _decode(prefix)
+    if truncated or len(text) > TEXT_PREVIEW_CHARS:
+        text = text[:TEXT_PREVIEW_CHARS] + '\n\n... (truncated - download full file to see more)'
+    return {'type': 'text', 'content': text}
+
+
+def _csv_preview(prefix, truncated):
+    text = _decode(prefix)
+    if truncated:
+        text = text.rsplit('\n', 1)[0]  # drop the partial last line
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096])
+    except csv.Error:
+        dialect = csv.excel
+    rows = []
+    for row in csv.reader(io.StringIO(text), dialect):
+        rows.append(row)
+        if len(rows) >= CSV_PREVIEW_ROWS:
+            break
+    content = '\n'.join(' | '.join(row) for row in rows)
+    return {'type': 'table', 'rows': rows, 'content': content + f'\n\n(first {len(rows)} rows)'}
+
+
+def _archive_preview(path, fmt, filename='', deep=False):
+    try:
+        report = inspect_archive(path, fmt, filename, deep=deep)
+    except ArchiveRejected as e:
+        return {'type': 'archive', 'format': fmt, 'members': [], 'rejected': str(e),
+                'content': f"{fmt.upper()} archive rejected: {e}"}
+    members, total = report['members'], report.get('member_count')
+    lines = [f"{m['name']}  ({format_file_size(m['size'])})" for m in members]
+    if total is not None and total > len(members):
+        lines.append(f"... and {total - len(members)} more")
+    if report['inspected']:
+        lines.append(f"\n{total} entries, {format_file_size(report['uncompressed_size'])} "
+                     f"uncompressed ({report['ratio']:g}:1)")
+    content = '\n'.join(lines) if members else f"{fmt.upper()} archive (listing not available)"
+    return dict(report, type='archive', content=content, deep=deep)
+
+
+def _image_preview(path, fmt):
+    preview = {'type': 'image', 'format': fmt}
+    try:
+        from PIL import Image
+        with Image.open(path) as img:  # header only; renditions come from thumbnails.py
+            preview.update(width=img.width, height=img.height, mode=img.mode)
+    except Exception as e:
+        app.logger.info(f"Image preview unavailable for {path}: {e}")
+    lines = [f"Format: {(fmt or 'image').upper()}"]
+    if 'width' in preview:
+        lines.append(f"Dimensions: {preview['width']} x {preview['height']} ({preview['mode']})")
+    preview['content'] = '\n'.join(lines)
+    return preview
+
+
+def _wav_info(prefix):
+    info, pos, byte_rate = {}, 12, None
+    while pos + 8 <= len(prefix):
+        chunk_id, size = prefix[pos:pos + 4], struct.unpack_from('<I', prefix, pos + 4)[0]
+        if chunk_id == b'fmt ' and pos + 24 <= len(prefix):
+            channels, sample_rate, byte_rate = struct.unpack_from('<HII', prefix, pos + 10)
+            info.update(channels=channels, sample_rate=sample_rate)
+        elif chunk_id == b'data':
+            if byte_rate:
+                info['duration'] = size / byte_rate
+            break
+        pos += 8 + size + (size & 1)
+    return info
+
+
+def _flac_info(prefix):
+    if len(prefix) < 42 or prefix[4] & 0x7f != 0:  # first block must be STREAMINFO
+        return {}
+    bits = int.from_bytes(prefix[18:26], 'big')
+    sample_rate = bits >> 44
+    channels = ((bits >> 41) & 0x7) + 1
+    total_samples = bits & 0xfffffffff
+    info = {'sample_rate': sample_rate, 'channels': channels}
+    if sample_rate and total_samples:
+        info['duration'] = total_samples / sample_rate
+    return info
+
+
+def _mp3_info(prefix, size):
+    pos = 0
+    if prefix[:3] == b'ID3' and len(prefix) >= 10:
+        tag_size = (prefix[6] << 21) | (prefix[7] << 14) | (prefix[8] << 7) | prefix[9]
+        pos = 10 + tag_size
+    audio_start = pos
+    while pos + 4 <= len(prefix):
+        if prefix[pos] == 0xff and prefix[pos + 1] & 0xe0 == 0xe0:
+            version = (prefix[pos + 1] >> 3) & 0x3  # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+            layer = (prefix[pos + 1] >> 1) & 0x3  # 1 = Layer III
+            bitrate_index = prefix[pos + 2] >> 4
+            rate_index = (prefix[pos + 2] >> 2) & 0x3
+            if version != 1 and layer == 1 and 0 < bitrate_index < 15 and rate_index < 3:
+                bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index]
+                info = {'sample_rate': _MP3_SAMPLE_RATES[version][rate_index], 'bitrate_kbps': bitrate,
+                        'channels': 1 if prefix[pos + 3] >> 6 == 3 else 2}
+                # Constant-bitrate estimate; good enough for a preview
+                info['duration'] = (size - audio_start) * 8 / (bitrate * 1000)
+                return info
+        pos += 1
+    return {}
+
+
+def _mp4_duration(path, size):
+    """Duration from moov/mvhd, found by seeking over box headers rather than reading them"""
+    def boxes(f, start, end):
+        pos = start
+        for _ in range(256):
+            if pos + 8 > end:
+                return
+            f.seek(pos)
+            box_size, box_type = struct.unpack('>I4s', f.read(8))
+            header = 8
+            if box_size == 1:
+                box_size = struct.unpack('>Q', f.read(8))[0]
+                header = 16
+            elif box_size == 0:
+                box_size = end - pos
+            if box_size < header:
+                return
+            yield box_type, pos + header, pos + box_size
+            pos += box_size
+
+    with open(path, 'rb') as f:
+        for box_type, body, box_end in boxes(f, 0, size):
+            if box_type != b'moov':
+                continue
+            for child_type, child_body, _ in boxes(f, body, box_end):
+                if child_type == b'mvhd':
+                    f.seek(child_body)
+                    version = f.read(4)[0]
+                    if version == 1:
+                        timescale, duration = struct.unpack('>16xIQ', f.read(28))
+                    else:
+                        timescale, duration = struct.unpack('>8xII', f.read(16))
+                    return duration / timescale if timescale else None
+    return None
+
+
+def _media_preview(path, kind, fmt, prefix, size):
+    info = {}
+    try:
+        if fmt == 'wav':
+            info = _wav_info(prefix)
+        elif fmt == 'flac':
+            info = _flac_info(prefix)
+        elif fmt == 'mp3':
+            info = _mp3_info(prefix, size)
+        elif fmt in ('mp4', 'm4a'):
+            duration = _mp4_duration(path, size)
+            if duration:
+                info['duration'] = duration
+    except (struct.error, IndexError, OSError) as e:
+        app.logger.info(f"Media metadata unavailable for {path}: {e}")
+
+    lines = [f"Format: {(fmt or kind).upper()}"]
+    if info.get('duration'):
+        lines.append(f"Duration: {_format_duration(info['duration'])}")
+    if info.get('sample_rate'):
+        lines.append(f"Sample rate: {info['sample_rate']} Hz")
+    if info.get('channels'):
+        lines.append(f"Channels: {info['channels']}")
+    if info.get('bitrate_kbps'):
+        lines.append(f"Bitrate: {info['bitrate_kbps']} kbps")
+    lines.append(f"Size: {format_file_size(size)}")
+    return dict(info, type=kind, format=fmt, content='\n'.join(lines))
+
+
+def render_preview(path, category, filename='', deep=False):
+    """Build the preview dict for a file (no caching); deep also decompresses archives"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        prefix = f.read(PREFIX_BYTES)
+    truncated = size > len(prefix)
+    kind, fmt = sniff(prefix)
+
+    if kind == 'text':
+        if filename.lower().endswith('.csv'):
+            preview = _csv_preview(prefix, truncated)
+        else:
+            preview = _text_preview(prefix, truncated)
+    elif kind == 'archive':
+        preview = _archive_preview(path, fmt, filename, deep)
+    elif kind == 'image':
+        preview = _image_preview(path, fmt)
+    elif kind in ('audio', 'video'):
+        preview = _media_preview(path, kind, fmt, prefix, size)
+    elif kind == 'document':
+        preview = {'type': 'document', 'format': fmt,
+                   'content': f"{fmt.upper()} document ({format_file_size(size)}) - download to view."}
+    else:
+        preview = {'type': 'binary',
+                   'content': f"Binary file ({format_file_size(size)}) - preview not available, download to view."}
+    preview.update(category=category, detected=kind, size=size)
+    return preview
+
+
+class PreviewCache:
+    """Rendered previews by content key: in-process LRU over JSON files in uploads/.previews"""
+
+    def __init__(self, max_entries=MEMORY_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _folder(self):
+        folder = os.path.join(app.config['UPLOAD_FOLDER'], '.previews')
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _remember(self, key, preview):
+        with self._lock:
+            self._memory[key] = preview
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            preview = self._memory.get(key)
+            if preview is not None:
+                self._memory.move_to_end(key)
+                return preview
+        try:
+            with open(os.path.join(self._folder(), f"{key}.json"), encoding='utf-8') as f:
+                preview = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, preview)
+        return preview
+
+    def set(self, key, preview):
+        self._remember(key, preview)
+        path = os.path.join(self._folder(), f"{key}.json")
+        try:
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(preview, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            app.logger.warning(f"Preview cache write failed: {e}")
+
+    def discard(self, pattern):
+        """Drop every entry whose key matches the glob pattern, in memory and on disk"""
+        with self._lock:
+            for key in [key for key in self._memory if fnmatch.fnmatchcase(key, pattern)]:
+                del self._memory[key]
+        for path in glob.glob(os.path.join(glob.escape(self._folder()), f"{pattern}.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+preview_cache = PreviewCache()
+
+
+def _cache_key(upload):
+    if upload.content_hash:
+        return f"v{PREVIEW_VERSION}-{upload.content_hash}"
+    stat = os.stat(upload.file_path)  # legacy rows without a hash: key on the file itself
+    return f"v{PREVIEW_VERSION}-u{upload.id}-{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def remove_previews(upload, include_shared=True):
+    """
+    Drop an upload's cached previews (every version) once the transaction commits: the
+    per-upload ones of a legacy row always, the hash-keyed ones only with include_shared
+    (no other upload has the same bytes any more).
+    """
+    from content_store import on_commit
+    patterns = [f"v*-u{upload.id}-*"]
+    if upload.content_hash and include_shared:
+        patterns.append(f"v*-{upload.content_hash}")
+
+    def remove():
+        for pattern in patterns:
+            preview_cache.discard(pattern)
+    on_commit(remove)
+
+
+def screen_upload(path, category, filename, content_hash):
+    """
+    Check an incoming file before it enters the content store. Archives get the quick
+    inspection, which decompresses nothing (raises ArchiveRejected for bombs and unsafe
+    paths), and the preview is cached; inspect_upload() does the rest in the background.
+    """
+    with open(path, 'rb') as f:
+        kind, _ = sniff(f.read(PREFIX_BYTES))
+    if kind != 'archive':
+        return
+    preview = render_preview(path, category, filename)
+    if preview.get('rejected'):
+        raise ArchiveRejected(preview['rejected'])
+    preview_cache.set(f"v{PREVIEW_VERSION}-{content_hash}", preview)
+
+
+def inspect_upload(upload):
+    """
+    Deep archive inspection for the analysis worker: nested zips and compressed streams
+    are decompressed and counted. The full preview replaces the quick one in the cache.
+    Returns the rejection reason, or None if the file is fine (or not an archive).
+    """
+    with open(upload.file_path, 'rb') as f:
+        kind, _ = sniff(f.read(PREFIX_BYTES))
+    if kind != 'archive':
+        return None
+    key = _cache_key(upload)
+    preview = preview_cache.get(key)
+    if preview is None or not preview.get('deep'):
+        preview = render_preview(upload.file_path, upload.category, upload.original_filename, deep=True)
+        preview_cache.set(key, preview)
+    return preview.get('rejected')
+
+
+def get_preview(upload):
+    """Cached preview for an upload; raises FileNotFoundError if its file is gone"""
+    key = _cache_key(upload)
+    preview = preview_cache.get(key)
+    if preview is None:
+        preview = render_preview(upload.file_path, upload.category, upload.original_filename)
+        preview_cache.set(key, preview)
+    return dict(preview, category=upload.category)
@@ -0,0 +1,334 @@
+"""
+Daily quota engine for Alpha Nex
+Upload/review allowances are reserved atomically in memory (or a shared store),
+persisted to the User columns in batches as increments, and bulk-reset nightly.
+The local store counts per process; multi-worker deployments should set QUOTA_REDIS_URL.
+"""
+import atexit
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import and_, bindparam, case, or_, update
+from app import app, db, scheduler
+from models import User, DAILY_UPLOAD_LIMIT, DAILY_UPLOAD_BYTES, DAILY_REVIEW_LIMIT, MAX_UPLOAD_BYTES
+
+FLUSH_INTERVAL_SECONDS = 10
+QUOTA_REDIS_URL = os.environ.get("QUOTA_REDIS_URL")
+
+UPLOADS, UPLOAD_BYTES, REVIEWS = 'uploads', 'upload_bytes', 'reviews'
+
+
+class LocalQuotaStore:
+    """Process-local counter store; stands in for a shared store like Redis"""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._counters.get(key)
+
+    def seed(self, key, value):
+        """Set a counter only if it doesn't exist yet"""
+        with self._lock:
+            self._counters.setdefault(key, value)
+
+    def incr(self, key, amount):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            return self._counters[key]
+
+    def reserve(self, increments, limits):
+        """Apply every increment only if none takes its counter past its limit (all or nothing)"""
+        with self._lock:
+            if any(self._counters.get(key, 0) + amount > limits[key] for key, amount in increments.items()):
+                return False
+            for key, amount in increments.items():
+                self._counters[key] = self._counters.get(key, 0) + amount
+            return True
+
+    def expire_before(self, day):
+        """Drop counters for days before `day`"""
+        prefix = f"quota:{day}:"
+        with self._lock:
+            for key in [k for k in self._counters if k < prefix]:
+                del self._counters[key]
+
+
+class RedisQuotaStore:
+    """Shared counter store so every worker sees the same consumption"""
+
+    TTL_SECONDS = 2 * 24 * 3600
+
+    # KEYS: counters; ARGV: amount, limit per key, then the TTL
+    RESERVE_SCRIPT = """
+    for i, key in ipairs(KEYS) do
+        local used = tonumber(redis.call('GET', key) or '0')
+        if used + tonumber(ARGV[2 * i - 1]) > tonumber(ARGV[2 * i]) then
+            return 0
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        redis.call('INCRBY', key, ARGV[2 * i - 1])
+        redis.call('EXPIRE', key, ARGV[#ARGV])
+    end
+    return 1
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("QUOTA_REDIS_URL is set but the redis package is not installed") from e
+        self._redis = redis.Redis.from_url(url)
+        self._reserve = self._redis.register_script(self.RESERVE_SCRIPT)
+
+    def get(self, key):
+        value = self._redis.get(key)
+        return int(value) if value is not None else None
+
+    def seed(self, key, value):
+        self._redis.set(key, value, nx=True, ex=self.TTL_SECONDS)
+
+    def incr(self, key, amount):
+        pipe = self._redis.pipeline()
+        pipe.incrby(key, amount)
+        pipe.expire(key, self.TTL_SECONDS)
+        return pipe.execute()[0]
+
+    def reserve(self, increments, limits):
+        keys = list(increments)
+        args = []
+        for key in keys:
+            args += [increments[key], limits[key]]
+        args.append(self.TTL_SECONDS)
+        return bool(self._reserve(keys=keys, args=args))
+
+    def expire_before(self, day):
+        pass  # Keys carry a TTL
+
+
+class QuotaEngine:
+    """Per-day allowance buckets: each UTC day refills uploads, bytes and reviews to the policy caps"""
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = {}  # (user_id, day) -> {field: consumption not yet persisted}
+        self._lock = threading.Lock()
+
+    def _today(self):
+        return datetime.utcnow().date().isoformat()
+
+    def _key(self, user_id, field, day=None):
+        return f"quota:{day or self._today()}:{user_id}:{field}"
+
+    def _used(self, user, field):
+        """Today's usage, seeded from the persisted User columns on first sight"""
+        if user.id is None:
+            return 0  # an unsaved guest hasn't used anything (and must not share a None key)
+        key = self._key(user.id, field)
+        value = self.store.get(key)
+        if value is None:
+            upload_count, upload_bytes = user._uploads_today()
+            seeded = {UPLOADS: upload_count, UPLOAD_BYTES: upload_bytes, REVIEWS: user._reviews_today()}
+            for seed_field, seed_value in seeded.items():
+                self.store.seed(self._key(user.id, seed_field), seed_value)
+            value = self.store.get(key)
+        return value or 0
+
+    def uploads_used(self, user):
+        return self._used(user, UPLOADS)
+
+    def upload_bytes_used(self, user):
+        return self._used(user, UPLOAD_BYTES)
+
+    def reviews_used(self, user):
+        return self._used(user, REVIEWS)
+
+    def can_upload(self, user, file_size):
+        """Check the per-file, daily count and daily byte limits (advisory; reserve_upload decides)"""
+        return (not user.is_banned and
+                file_size <= MAX_UPLOAD_BYTES and
+                self.uploads_used(user) < DAILY_UPLOAD_LIMIT and
+                self.upload_bytes_used(user) + file_size <= DAILY_UPLOAD_BYTES)
+
+    def can_review(self, user):
+        return self.reviews_used(user) < DAILY_REVIEW_LIMIT
+
+    def _add_pending(self, user_id, day, deltas):
+        with self._lock:
+            entry = self._pending.setdefault((user_id, day), {UPLOADS: 0, UPLOAD_BYTES: 0, REVIEWS: 0})
+            for field, amount in deltas.items():
+                entry[field] += amount
+
+    def reserve_upload(self, user, file_size):
+        """
+        Check and take one upload of file_size from today's allowance in a single atomic
+        step. Returns the day it was counted against (pass it to refund_upload), or None
+        if the upload is not allowed.
+        """
+        if user.is_banned or file_size > MAX_UPLOAD_BYTES:
+            return None
+        self._used(user, UPLOADS)  # make sure today's counters are seeded
+        day = self._today()
+        count_key, bytes_key = self._key(user.id, UPLOADS, day), self._key(user.id, UPLOAD_BYTES, day)
+        if not self.store.reserve({count_key: 1, bytes_key: file_size},
+                                  {count_key: DAILY_UPLOAD_LIMIT, bytes_key: DAILY_UPLOAD_BYTES}):
+            return None
+        self._add_pending(user.id, day, {UPLOADS: 1, UPLOAD_BYTES: file_size})
+        return day
+
+    def refund_upload(self, user, file_size, day):
+        """Give back a reservation whose upload didn't go through"""
+        self.store.incr(self._key(user.id, UPLOADS, day), -1)
+        self.store.incr(self._key(user.id, UPLOAD_BYTES, day), -file_size)
+        self._add_pending(user.id, day, {UPLOADS: -1, UPLOAD_BYTES: -file_size})
+
+    def reserve_review(self, user):
+        """Check and take one review from today's allowance atomically; returns the day or None"""
+        self._used(user, REVIEWS)  # make sure today's counters are seeded
+        day = self._today()
+        key = self._key(user.id, REVIEWS, day)
+        if not self.store.reserve({key: 1}, {key: DAILY_REVIEW_LIMIT}):
+            return None
+        self._add_pending(user.id, day, {REVIEWS: 1})
+        return day
+
+    def refund_review(self, user, day):
+        """Give back a reservation whose review didn't go through"""
+        self.store.incr(self._key(user.id, REVIEWS, day), -1)
+        self._add_pending(user.id, day, {REVIEWS: -1})
+
+    def flush(self):
+        """
+        Add consumption since the last flush to the User columns in one batched UPDATE.
+        Increments rather than absolute values, so workers never overwrite each other.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        today = self._today()
+        rows = []
+        for (user_id, day), deltas in pending.items():
+            if not any(deltas.values()):
+                continue
+            day_start = datetime.combine(date.fromisoformat(day), time.min)
+            rows.append({
+                'user_id': user_id,
+                'day_start': day_start,
+                'day_end': day_start + timedelta(days=1),
+                # Usage from a day that has since ended is stamped with that day so it reads as stale
+                'stamp': datetime.utcnow() if day == today else day_start,
+                'd_uploads': deltas[UPLOADS],
+                'd_upload_bytes': deltas[UPLOAD_BYTES],
+                'd_reviews': deltas[REVIEWS],
+            })
+        if not rows:
+            return 0
+
+        try:
+            db.session.execute(_increment_statement(), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for (user_id, day), deltas in pending.items():
+                self._add_pending(user_id, day, deltas)  # Retry on the next flush
+            raise
+        self.store.expire_before(today)
+        return len(rows)
+
+
+def _increment_statement():
+    """UPDATE adding a day's increments to one user's daily columns (executed per row)"""
+    user = User.__table__
+    day_start, day_end = bindparam('day_start'), bindparam('day_end')
+
+    def added(column, window, delta):
+        # Same day: add. Older (or no) window: the day's usage replaces it. Newer: leave it.
+        return case((and_(window >= day_start, window < day_end), column + bindparam(delta)),
+                    (or_(window.is_(None), window < day_start), bindparam(delta)),
+                    else_=column)
+
+    def stamped(window):
+        return case((or_(window.is_(None), window < day_start), bindparam('stamp')), else_=window)
+
+    upload_window, review_window = user.c.daily_upload_reset, user.c.daily_review_reset
+    return (
+        update(user)
+        .where(user.c.id == bindparam('user_id'))
+        .values(
+            daily_upload_count=added(user.c.daily_upload_count, upload_window, 'd_uploads'),
+            daily_upload_bytes=added(user.c.daily_upload_bytes, upload_window, 'd_upload_bytes'),
+            daily_upload_reset=stamped(upload_window),
+            daily_review_count=added(user.c.daily_review_count, review_window, 'd_reviews'),
+            daily_review_reset=stamped(review_window),
+        )
+    )
+
+
+class QuotaExceeded(Exception):
+    """The upload or review would pass today's allowance"""
+
+
+def _make_store():
+    if QUOTA_REDIS_URL:
+        # Configured but unusable must not quietly become per-process counting
+        try:
+            return RedisQuotaStore(QUOTA_REDIS_URL)
+        except Exception as e:
+            app.logger.critical(f"Quota store at QUOTA_REDIS_URL unavailable: {e}")
+            raise
+    return LocalQuotaStore()
+
+
+quota_engine = QuotaEngine(_make_store())
+
+
+def flush_quota_usage():
+    """Persist buffered quota consumption (scheduled and at exit)"""
+    with app.app_context():
+        try:
+            flushed = quota_engine.flush()
+            if flushed:
+                app.logger.debug(f"Persisted quota usage for {flushed} users")
+        except Exception as e:
+            app.logger.error(f"Quota flush failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def reset_daily_quotas():
+    """Zero every upload/review window that started before today (one UPDATE per window)"""
+    with app.app_context():
+        try:
+            midnight = datetime.combine(datetime.utcnow().date(), time.min)
+            now = datetime.utcnow()
+
+            uploads = db.session.execute(
+                update(User)
+                .where((User.daily_upload_reset < midnight) | (User.daily_upload_reset.is_(None)))
+                .values(daily_upload_count=0, daily_upload_bytes=0, daily_upload_reset=now)
+            )
+            reviews = db.session.execute(
+                update(User)
+                .where((User.daily_review_reset < midnight) | (User.daily_review_reset.is_(None)))
+                .values(daily_review_count=0, daily_review_reset=now)
+            )
+            db.session.commit()
+            app.logger.info(f"Daily quota reset: {uploads.rowcount} upload windows, {reviews.rowcount} review windows")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Daily quota reset failed: {e}")
+        finally:
+            db.session.remove()
+
+
+if scheduler:
+    try:
+        scheduler.add_job(reset_daily_quotas, 'cron', hour=0, minute=5, timezone='UTC',
+                          id='reset_daily_quotas', replace_existing=True)
+        scheduler.add_job(flush_quota_usage, 'interval', seconds=FLUSH_INTERVAL_SECONDS,
+                          id='flush_quota_usage', replace_existing=True)
+    except Exception as e:
+        app.logger.error(f"Quota job registration failed: {e}")
+
+atexit.register(flush_quota_usage)
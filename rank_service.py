@@ -0,0 +1,77 @@
+"""
+Rank service for Alpha Nex
+Bucketed histogram of per-user activity counts answering "top N%" in O(log buckets)
+"""
+import math
+import threading
+from bisect import bisect_right
+
+# Exact buckets for small counts (where most users are), then doubling ranges
+EXACT_BUCKETS = 64
+BUCKET_BOUNDS = list(range(EXACT_BUCKETS)) + [EXACT_BUCKETS * 2 ** i for i in range(20)]
+
+
+class CountHistogram:
+    """Number of users per count bucket, kept in a Fenwick tree for fast prefix sums"""
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self._tree = [0] * (len(bounds) + 1)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def bucket_for(self, count):
+        return max(bisect_right(self.bounds, count) - 1, 0)
+
+    def _update(self, bucket, delta):
+        i = bucket + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket):
+        """Users in buckets [0, bucket)"""
+        total, i = 0, bucket
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def rebuild(self, counts, total_users):
+        """Reset from {user_id: count} for active users; everyone else sits in bucket 0"""
+        with self._lock:
+            self._tree = [0] * (len(self.bounds) + 1)
+            self._total = 0
+            for count in counts.values():
+                self._update(self.bucket_for(count), 1)
+                self._total += 1
+            inactive = max(total_users - self._total, 0)
+            self._update(0, inactive)
+            self._total += inactive
+
+    def add_user(self, count=0):
+        with self._lock:
+            self._update(self.bucket_for(count), 1)
+            self._total += 1
+
+    def move(self, old_count, new_count):
+        """Move one user from the bucket for old_count to the one for new_count"""
+        old_bucket, new_bucket = self.bucket_for(old_count), self.bucket_for(new_count)
+        if old_bucket == new_bucket:
+            return
+        with self._lock:
+            self._update(old_bucket, -1)
+            self._update(new_bucket, 1)
+
+    def top_percent(self, count):
+        """Share of users (as a percentage 1-100) with a count at or above this one"""
+        with self._lock:
+            if self._total <= 0:
+                return 100
+            at_or_above = self._total - self._prefix(self.bucket_for(count))
+        return min(max(math.ceil(100 * at_or_above / self._total), 1), 100)
+
+
+def format_rank(percent):
+    """Render a percentile the way the rank dicts always have (e.g. '12%')"""
+    return f"{percent}%"
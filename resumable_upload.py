@@ -0,0 +1,286 @@
+"""
+Resumable uploads for Alpha Nex
+init -> append chunks at an offset -> finalize, so a dropped connection only
+costs the chunk in flight. Abandoned partials are expired by a scheduled job.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from flask import request, jsonify
+from sqlalchemy import func, update
+from werkzeug.utils import secure_filename
+from app import app, db, scheduler
+from models import PartialUpload, MAX_UPLOAD_BYTES
+from routes import create_upload_record
+from quotas import QuotaExceeded
+from identity import get_session_identity, get_session_user, get_or_create_user_for_session
+from upload_stream import CHUNK_SIZE, partial_folder
+from content_store import hash_file, ingest
+from preview import screen_upload
+from archive_inspector import ArchiveRejected
+from utils import allowed_file, validate_content_description, ALLOWED_EXTENSIONS
+
+RESUMABLE_CHUNK_SIZE = 5 * 1024 * 1024  # suggested client chunk size
+PARTIAL_EXPIRY_HOURS = 24
+
+
+def _current_user():
+    """The session's saved user; an unsaved guest can't own a partial upload yet"""
+    user = get_session_user()
+    return user if user.id is not None else None
+
+
+def _in_flight(user):
+    """(count, total bytes) of the user's partial uploads that haven't finished"""
+    if user.id is None:
+        return 0, 0
+    return db.session.query(func.count(PartialUpload.id),
+                            func.coalesce(func.sum(PartialUpload.total_size), 0))\
+        .filter(PartialUpload.user_id == user.id,
+                PartialUpload.status.in_(('uploading', 'finalizing'))).one()
+
+
+def _get_partial(token, owner):
+    """The partial if it belongs to owner (a User or an identity.Identity)"""
+    partial = PartialUpload.query.get(token)
+    if not partial or partial.user_id != owner.id:
+        return None
+    return partial
+
+
+def _state(partial):
+    return {
+        'upload_token': partial.id,
+        'offset': partial.received_bytes,
+        'total_size': partial.total_size,
+        'status': partial.status,
+        'upload_id': partial.upload_id,
+        'chunk_size': RESUMABLE_CHUNK_SIZE
+    }
+
+
+@app.route('/api/uploads/resumable', methods=['POST'])
+def resumable_init():
+    """Start a resumable upload; the file's metadata is sent up front"""
+    try:
+        user = get_session_user()
+
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename') or '')
+        description = (data.get('description') or '').strip()
+        category = data.get('category')
+        try:
+            total_size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'File size is required'}), 400
+
+        if not filename or not allowed_file(filename):
+            return jsonify({'error': 'File type not allowed!'}), 400
+        if category not in ALLOWED_EXTENSIONS:
+            return jsonify({'error': 'Invalid category'}), 400
+        if not 10 <= len(description) <= 500:
+            return jsonify({'error': 'Description must be 10-500 characters long.'}), 400
+        valid, message = validate_content_description(description)
+        if not valid:
+            return jsonify({'error': message}), 400
+        if not data.get('ai_consent'):
+            return jsonify({'error': 'AI consent is required'}), 400
+        if total_size <= 0 or total_size > MAX_UPLOAD_BYTES:
+            return jsonify({'error': 'File too large! Maximum size is 100MB.'}), 413
+        # Unfinished partials hold their share of today's allowance (and disk) until they expire
+        open_count, open_bytes = _in_flight(user)
+        if (not user.can_upload(total_size)
+                or open_count >= user.get_remaining_uploads_today()
+                or open_bytes + total_size > user.get_daily_upload_remaining()):
+            return jsonify({'error': 'Daily upload limit reached (3 files / 500MB per day, '
+                                     'unfinished uploads included).'}), 429
+
+        token = uuid.uuid4().hex
+        temp_path = os.path.join(partial_folder(), f"resumable_{token}")
+        open(temp_path, 'wb').close()
+
+        user = get_or_create_user_for_session()  # a new guest's row only once the request is valid
+        partial = PartialUpload()
+        partial.id = token
+        partial.user_id = user.id
+        partial.original_filename = filename
+        partial.description = description
+        partial.category = category
+        partial.ai_consent = True
+        partial.total_size = total_size
+        partial.received_bytes = 0
+        partial.temp_path = temp_path
+        partial.status = 'uploading'
+        db.session.add(partial)
+        db.session.commit()
+
+        return jsonify(_state(partial)), 201
+
+    except Exception as e:
+        app.logger.error(f"Resumable init error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/uploads/resumable/<token>', methods=['GET'])
+def resumable_status(token):
+    """Report how many bytes the server has, so the client knows where to resume"""
+    # Chunk requests only need to know who is calling, usually without a user query
+    identity = get_session_identity()
+    partial = _get_partial(token, identity) if identity else None
+    if not partial:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(_state(partial))
+
+
+@app.route('/api/uploads/resumable/<token>', methods=['PATCH'])
+def resumable_append(token):
+    """Append the raw request body at ?offset=N (must equal the server's current offset)"""
+    try:
+        identity = get_session_identity()
+        partial = _get_partial(token, identity) if identity else None
+        if not partial:
+            return jsonify({'error': 'Upload not found'}), 404
+        if partial.status != 'uploading':
+            return jsonify(_state(partial)), 409
+
+        offset = request.args.get('offset', type=int)
+        if offset != partial.received_bytes:
+            # Client is out of sync; tell it where to resume
+            return jsonify(dict(_state(partial), error='Offset mismatch')), 409
+
+        remaining = partial.total_size - offset
+        if request.content_length and request.content_length > remaining:
+            return jsonify({'error': 'Chunk exceeds declared file size'}), 413
+
+        written = 0
+        try:
+            with open(partial.temp_path, 'r+b') as f:
+                f.seek(offset)
+                while written < remaining:
+                    chunk = request.stream.read(min(CHUNK_SIZE, remaining - written))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    written += len(chunk)
+                f.truncate()
+        finally:
+            # Record whatever arrived, even if the client dropped mid-chunk.
+            # The offset guard makes concurrent retries of the same chunk harmless.
+            if written:
+                db.session.execute(
+                    update(PartialUpload)
+                    .where(PartialUpload.id == token, PartialUpload.received_bytes == offset)
+                    .values(received_bytes=offset + written, updated_at=datetime.utcnow())
+                )
+                db.session.commit()
+
+        db.session.refresh(partial)
+        return jsonify(_state(partial))
+
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Resumable append error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/uploads/resumable/<token>/complete', methods=['POST'])
+def resumable_finalize(token):
+    """Turn a fully received partial into an Upload (idempotent: repeats return the same upload)"""
+    claimed = False
+    try:
+        user = _current_user()
+        partial = _get_partial(token, user) if user else None
+        if not partial:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        # Claim the partial; only one request can move it from uploading to finalizing
+        claimed = db.session.execute(
+            update(PartialUpload)
+            .where(PartialUpload.id == token,
+                   PartialUpload.status == 'uploading',
+                   PartialUpload.received_bytes == PartialUpload.total_size)
+            .values(status='finalizing', updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        db.session.refresh(partial)
+
+        if not claimed:
+            if partial.status == 'complete':
+                return jsonify(_state(partial))
+            if partial.status == 'finalizing':
+                return jsonify(dict(_state(partial), error='Finalization in progress')), 409
+            return jsonify(dict(_state(partial), error='Upload incomplete')), 400
+
+        # Chunks may have been retried out of order, so hash the assembled file in one pass
+        unique_filename = f"{uuid.uuid4()}_{partial.original_filename}"
+        content_hash = hash_file(partial.temp_path)
+        try:
+            screen_upload(partial.temp_path, partial.category, partial.original_filename, content_hash)
+        except ArchiveRejected as e:
+            os.remove(partial.temp_path)
+            partial.status = 'rejected'
+            db.session.commit()
+            return jsonify(dict(_state(partial), error=f'Archive rejected: {e}')), 422
+        file_path = ingest(partial.temp_path, content_hash, partial.total_size)
+
+        upload = create_upload_record(user, file_path, unique_filename, partial.original_filename,
+                                      partial.total_size, partial.description, partial.category,
+                                      partial.ai_consent, content_hash=content_hash, partial=partial)
+
+        return jsonify(dict(_state(partial), upload_id=upload.id)), 201
+
+    except QuotaExceeded:
+        db.session.rollback()
+        _release_claim(token)
+        return jsonify({'error': 'Daily upload limit reached (3 files / 500MB per day).'}), 429
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Resumable finalize error: {e}")
+        if claimed:
+            _release_claim(token)
+        return jsonify({'error': str(e)}), 500
+
+
+def _release_claim(token):
+    """
+    Hand a failed finalization back to 'uploading' so the client can retry. The
+    rolled-back ingest never moved the temp file, so the bytes are still there.
+    """
+    try:
+        db.session.execute(
+            update(PartialUpload)
+            .where(PartialUpload.id == token, PartialUpload.status == 'finalizing')
+            .values(status='uploading', updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Could not release finalize claim on {token}: {e}")
+
+
+def expire_partial_uploads():
+    """Delete abandoned partials and their bytes, and forget old completed ones"""
+    with app.app_context():
+        try:
+            cutoff = datetime.utcnow() - timedelta(hours=PARTIAL_EXPIRY_HOURS)
+            expired = PartialUpload.query.filter(PartialUpload.updated_at < cutoff).limit(500).all()
+            for partial in expired:
+                if partial.status != 'complete' and os.path.exists(partial.temp_path):
+                    os.remove(partial.temp_path)
+                db.session.delete(partial)
+            db.session.commit()
+            if expired:
+                app.logger.info(f"Expired {len(expired)} resumable uploads")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Partial upload expiry failed: {e}")
+        finally:
+            db.session.remove()
+
+
+if scheduler:
+    try:
+        scheduler.add_job(expire_partial_uploads, 'interval', hours=1,
+                          id='expire_partial_uploads', replace_existing=True)
+    except Exception as e:
+        app.logger.error(f"Partial upload expiry job registration failed: {e}")
@@ -0,0 +1,62 @@
+"""
+Review queue engine for Alpha Nex
+Finds uploads a user may still review with a single set-based query
+"""
+from datetime import datetime
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import joinedload
+from models import Upload, Review
+
+MAX_REVIEWS_PER_UPLOAD = 5
+QUEUE_PAGE_SIZE = 20
+
+
+def encode_cursor(upload):
+    """Build a keyset cursor from the last upload on a page"""
+    return f"{upload.uploaded_at.isoformat()}_{upload.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a keyset cursor, returning (uploaded_at, id) or None if invalid"""
+    try:
+        timestamp, upload_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(upload_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_review_queue(user_id, cursor=None, page_size=QUEUE_PAGE_SIZE):
+    """
+    Get one page of uploads the user can review, newest first.
+    An upload is eligible when it is not the user's own, the user has not
+    reviewed it yet and it has fewer than MAX_REVIEWS_PER_UPLOAD reviews.
+    Returns (uploads, next_cursor).
+    """
+    already_reviewed = select(Review.id)\
+        .where(Review.upload_id == Upload.id, Review.reviewer_id == user_id)\
+        .correlate(Upload)\
+        .exists()
+
+    query = Upload.query\
+        .options(joinedload(Upload.user))\
+        .filter(Upload.user_id != user_id,
+                ~already_reviewed,
+                Upload.review_count < MAX_REVIEWS_PER_UPLOAD)
+
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        uploaded_at, upload_id = position
+        query = query.filter(or_(
+            Upload.uploaded_at < uploaded_at,
+            and_(Upload.uploaded_at == uploaded_at, Upload.id < upload_id)
+        ))
+
+    # Fetch one extra row to know whether another page exists
+    uploads = query.order_by(Upload.uploaded_at.desc(), Upload.id.desc())\
+                   .limit(page_size + 1).all()
+
+    has_more = len(uploads) > page_size
+    uploads = uploads[:page_size]
+    next_cursor = encode_cursor(uploads[-1]) if has_more and uploads else None
+
+    return uploads, next_cursor
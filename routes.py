@@ -3,65 +3,81 @@ Simplified Alpha Nex Routes - Direct Access Without Demo User System
 """
 import os
 import uuid
+from functools import wraps
 from datetime import datetime, timedelta
 from flask import render_template, redirect, url_for, flash, request, session, jsonify, send_file
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func
 from app import app, db
-from models import User, Upload, Review, Strike, WithdrawalRequest, AdminAction, Rating
+from models import User, Upload, Review, Strike, WithdrawalRequest, AdminAction, Rating, AnalysisJob
 from forms import UploadForm, ReviewForm, RatingForm
+from review_queue import get_review_queue, MAX_REVIEWS_PER_UPLOAD
+from leaderboard import uploader_board, reviewer_board, register_new_user
+from quotas import QuotaExceeded  # (also registers the quota flush/reset jobs)
+from upload_stream import prepare_upload_request, store_streamed_file
+from content_store import release as release_object, remove_after_commit as remove_file_after_commit
+from duplicate_index import remove_from_index
+from analysis_worker import enqueue_analysis
+from identity import get_session_user, get_or_create_user_for_session
+from file_delivery import deliver_upload
+from preview import get_preview, remove_previews
+from archive_inspector import ArchiveRejected
+from thumbnails import (get_thumbnail, remove_thumbnails, choose_format as choose_thumbnail_format,
+                        SIZES as THUMBNAIL_SIZES, MIMETYPES as THUMBNAIL_MIMETYPES,
+                        CACHE_MAX_AGE as THUMBNAIL_MAX_AGE)
 # from openai_service import analyze_content_quality  # Not needed for simplified version
 
-def get_or_create_user_for_session():
-    """Get or create a unique user for this session"""
-    # Get user name from session
-    user_name = session.get('user_name', 'Anonymous')
-    
-    # Create a unique username based on session name and timestamp
-    session_id = session.get('session_id')
-    if not session_id:
-        session_id = str(uuid.uuid4())[:8]
-        session['session_id'] = session_id
+def create_upload_record(user, file_path, unique_filename, filename, file_size,
+                         description, category, ai_consent, content_hash=None, partial=None):
+    """Create the Upload row for a stored file, award upload XP and count it against the quota.
+    A finalized resumable upload (partial) is marked complete in the same transaction.
+    Raises QuotaExceeded if today's allowance can't cover the file."""
+    # Check-and-count in one step, so concurrent uploads can't both pass the check
+    reservation = user.reserve_upload(file_size)
+    if not reservation:
+        raise QuotaExceeded()
+    try:
+        upload = _add_upload_record(user, file_path, unique_filename, filename, file_size,
+                                    description, category, ai_consent, content_hash, partial)
+    except Exception:
+        user.refund_upload(file_size, reservation)
+        raise
+    uploader_board.adjust(user.id)
+    return upload
+
+
+def _add_upload_record(user, file_path, unique_filename, filename, file_size,
+                       description, category, ai_consent, content_hash, partial):
+    upload = Upload()
+    upload.user_id = user.id
+    upload.filename = unique_filename
+    upload.original_filename = filename
+    upload.file_path = file_path
+    upload.file_size = file_size
+    upload.description = description
+    upload.category = category
+    upload.status = 'pending'
+    upload.ai_consent = ai_consent
+    upload.content_hash = content_hash
     
-    username = f"user_{session_id}"
+    # Update user stats - give XP for upload
+    user.xp_points += 20
     
-    # Try to find existing user for this session
-    user = User.query.filter_by(username=username).first()
+    db.session.add(upload)
+    db.session.add(user)  # Make sure user changes are saved
+    db.session.flush()
     
-    if not user:
-        # Create new user for this session
-        user = User()
-        user.username = username
-        user.name = user_name
-        user.email = f"{username}@alphanex.com"
-        user.password_hash = generate_password_hash('alphanex123')
-        user.xp_points = 0
-        user.daily_upload_count = 0
-        user.daily_upload_bytes = 0
-        user.daily_review_count = 0
-        user.daily_upload_reset = datetime.utcnow()
-        user.daily_review_reset = datetime.utcnow()
-        user.uploader_strikes = 0
-        user.reviewer_strikes = 0
-        user.is_banned = False
-        
-        db.session.add(user)
-        db.session.commit()
-        
-        # Store user ID in session
-        session['user_id'] = user.id
-    else:
-        # Update name if it changed
-        if user.name != user_name:
-            user.name = user_name
-            db.session.add(user)
-            db.session.commit()
-        
-        # Store user ID in session
-        session['user_id'] = user.id
+    # Duplicate indexing and spam/category analysis run in the background workers,
+    # once the commit has moved the file into the content store
+    enqueue_analysis(upload)
     
-    return user
+    if partial is not None:
+        partial.upload_id = upload.id
+        partial.status = 'complete'
+        db.session.add(partial)
+    db.session.commit()
+    return upload
 
 def create_demo_content_for_reviews():
     """Create demo content from a test user for reviews"""
@@ -76,6 +92,7 @@ def create_demo_content_for_reviews():
         demo_user.xp_points = 300
         db.session.add(demo_user)
         db.session.flush()
+        register_new_user()
         
         # Ensure uploads directory exists
         upload_folder = 'uploads'
@@ -136,6 +153,7 @@ def create_demo_content_for_reviews():
             db.session.add(upload)
         
         db.session.commit()
+        uploader_board.adjust(demo_user.id, len(demo_files))
 
 def create_test_content_old():
     """Create sample content for review system"""
@@ -324,6 +342,7 @@ def signup():
         
         db.session.add(user)
         db.session.commit()
+        register_new_user()
         
         flash('Account created successfully! Please log in.', 'success')
         return redirect(url_for('login'))
@@ -342,20 +361,46 @@ def health():
         app.logger.error(f"Health check failed: {e}")
         return "Database Error", 503
 
+ADMIN_EMAILS = {email.strip().lower()
+                for email in os.environ.get("ADMIN_EMAILS", "admin@alphanex.com").split(",") if email.strip()}
+
+def admin_required(view):
+    """Limit a view to logged-in accounts listed in ADMIN_EMAILS; everyone else gets a 403"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        user_id = session.get('user_id')
+        user = User.query.get(user_id) if user_id else None
+        if not user or (user.email or '').lower() not in ADMIN_EMAILS:
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapped
+
+@app.route('/api/ai_cache/stats')
+@admin_required
+def ai_cache_stats():
+    """Hit rate and size of the AI analysis cache in this worker"""
+    from ai_cache import analysis_cache
+    return jsonify(analysis_cache.summary())
+
+@app.route('/api/ai_client/stats')
+@admin_required
+def ai_client_stats():
+    """Call outcomes and circuit breaker state of the AI client pool in this worker"""
+    from openai_service import analysis_pool
+    return jsonify(analysis_pool.summary() if analysis_pool else {'enabled': False})
+
+@app.route('/api/guest_gc/stats')
+@admin_required
+def guest_gc_stats():
+    """Rows reclaimed by the abandoned guest collector in this worker"""
+    from guest_gc import gc_stats
+    return jsonify(gc_stats)
+
 @app.route('/dashboard')
 def dashboard():
     """Dashboard page"""
-    # Auto-create demo user session if not exists
-    if 'user_id' not in session:
-        user = get_or_create_user_for_session()
-        session['user_id'] = user.id
-        session['user_name'] = 'Demo User'
-    
     try:
-        user_id = session.get('user_id')
-        user = User.query.get(user_id)
-        if not user:
-            return redirect(url_for('login'))
+        user = get_session_user()
         user_name = user.name
         
         # Get user stats
@@ -421,16 +466,18 @@ def dashboard():
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_file():
     """File upload endpoint"""
-    if 'user_id' not in session:
-        user = get_or_create_user_for_session()
-        session['user_id'] = user.id
-        session['user_name'] = 'Demo User'
-    
     try:
-        user = User.query.get(session['user_id'])
-        if not user:
-            user = get_or_create_user_for_session()
-            session['user_id'] = user.id
+        # A new guest's row is only written once the body is in (see below), so no write
+        # transaction stays open while the file streams
+        user = get_session_user()
+        
+        # Enforce quotas before the body is parsed; the file then streams to disk under that limit
+        if request.method == 'POST':
+            quota_error = prepare_upload_request(user)
+            if quota_error:
+                flash(quota_error, 'error')
+                return redirect(url_for('upload_file'))
+        
         form = UploadForm()
         
         if form.validate_on_submit():
@@ -441,40 +488,15 @@ def upload_file():
                 # Process file upload
                 filename = secure_filename(file.filename)
                 unique_filename = f"{uuid.uuid4()}_{filename}"
-                upload_folder = 'uploads'
-                file_path = os.path.join(upload_folder, unique_filename)
-                
-                # Ensure upload directory exists
-                os.makedirs(upload_folder, exist_ok=True)
-                
-                # Save file
-                file.save(file_path)
-                file_size = os.path.getsize(file_path)
-                
-                # Check file size limit (100MB)
-                if file_size > 100 * 1024 * 1024:
-                    os.remove(file_path)
-                    flash('File too large! Maximum size is 100MB.', 'error')
-                    return redirect(url_for('upload_file'))
                 
-                # Create upload record
-                upload = Upload()
-                upload.user_id = user.id
-                upload.filename = unique_filename
-                upload.original_filename = filename
-                upload.file_path = file_path
-                upload.file_size = file_size
-                upload.description = form.description.data
-                upload.category = form.category.data
-                upload.status = 'pending'
-                upload.ai_consent = form.ai_consent.data
+                # Move the streamed file into the content store
+                file_path, file_size, content_hash = store_streamed_file(file, form.category.data)
                 
-                # Update user stats - give XP for upload
-                user.xp_points += 20
-                
-                db.session.add(upload)
-                db.session.add(user)  # Make sure user changes are saved
-                db.session.commit()
+                # Create upload record (and the guest's row, in the same transaction)
+                user = get_or_create_user_for_session()
+                create_upload_record(user, file_path, unique_filename, filename, file_size,
+                                     form.description.data, form.category.data, form.ai_consent.data,
+                                     content_hash=content_hash)
                 
                 motivational_messages = [
                     "🎉 Awesome upload! You're contributing amazing content!",
@@ -499,6 +521,15 @@ def upload_file():
                              demo_user=user,
                              current_user=user)
                              
+    except RequestEntityTooLarge:
+        flash('File too large for your remaining upload allowance (max 100MB per file, 500MB per day).', 'error')
+        return redirect(url_for('upload_file'))
+    except ArchiveRejected as e:
+        flash(f'Archive rejected: {e}.', 'error')
+        return redirect(url_for('upload_file'))
+    except QuotaExceeded:
+        flash('Daily upload limit reached (3 files / 500MB per day).', 'error')
+        return redirect(url_for('upload_file'))
     except Exception as e:
         app.logger.error(f"Upload error: {e}")
         return render_template('error.html', error=f"Upload error: {str(e)}")
@@ -506,37 +537,19 @@ def upload_file():
 @app.route('/review')
 def review_content():
     """Content review page"""
-    if 'user_id' not in session:
-        user = get_or_create_user_for_session()
-        session['user_id'] = user.id
-        session['user_name'] = 'Demo User'
-    
     try:
-        user = User.query.get(session['user_id'])
-        if not user:
-            user = get_or_create_user_for_session()
-            session['user_id'] = user.id
+        user = get_session_user()
         
         # Create demo content if needed
         create_demo_content_for_reviews()
         
-        # Get uploads that need review (not from current user and not already reviewed)
-        reviewed_upload_ids = [r.upload_id for r in Review.query.filter_by(reviewer_id=user.id).all()]
-        
-        uploads = Upload.query.filter(
-            Upload.user_id != user.id,  # Cannot review own uploads
-            ~Upload.id.in_(reviewed_upload_ids)  # Haven't reviewed yet
-        ).order_by(Upload.uploaded_at.desc()).all()
-        
-        # Filter out uploads that already have 5 reviews
-        available_uploads = []
-        for upload in uploads:
-            review_count = Review.query.filter_by(upload_id=upload.id).count()
-            if review_count < 5:  # Max 5 reviews per upload
-                available_uploads.append(upload)
-        
-        return render_template('reviewer/review.html', 
-                             uploads=available_uploads, 
+        # Get one page of uploads this user can still review (max 5 reviews per upload)
+        available_uploads, next_cursor = get_review_queue(
+            user.id, cursor=request.args.get('after'))
+
+        return render_template('reviewer/review.html',
+                             uploads=available_uploads,
+                             next_cursor=next_cursor,
                              demo_user=user,
                              current_user=user)
                              
@@ -544,19 +557,30 @@ def review_content():
         app.logger.error(f"Review error: {e}")
         return render_template('error.html', error=f"Review error: {str(e)}")
 
+def _add_review(user, upload, rating, description):
+    review = Review()
+    review.upload_id = upload.id
+    review.reviewer_id = user.id
+    review.rating = rating
+    review.description = description if description else ''
+    review.xp_earned = 10  # Review XP
+    
+    # Update user stats - give XP for review
+    user.xp_points += 15
+    
+    # Keep the upload's review aggregates in the same transaction
+    upload.apply_review(review.rating)
+    
+    db.session.add(review)
+    db.session.add(user)  # Make sure user changes are saved
+    db.session.commit()
+    return review
+
 @app.route('/review/<int:upload_id>', methods=['GET', 'POST'])
 def review_upload(upload_id):
     """Review a specific upload"""
-    if 'user_id' not in session:
-        user = get_or_create_user_for_session()
-        session['user_id'] = user.id
-        session['user_name'] = 'Demo User'
-    
     try:
-        user = User.query.get(session['user_id'])
-        if not user:
-            user = get_or_create_user_for_session()
-            session['user_id'] = user.id
+        user = get_session_user()
         upload = Upload.query.get_or_404(upload_id)
         form = ReviewForm()
         
@@ -567,28 +591,33 @@ def review_upload(upload_id):
                 flash('You have already reviewed this upload.', 'warning')
                 return redirect(url_for('review_content'))
             
+            # Enforce the 5 reviews per upload cap
+            if upload.review_count >= MAX_REVIEWS_PER_UPLOAD:
+                flash('This upload has already received the maximum number of reviews.', 'warning')
+                return redirect(url_for('review_content'))
+            
             # Validate required description for bad ratings
             if form.rating.data == 'bad' and (not form.description.data or len(form.description.data.strip()) < 10):
                 flash('Detailed reasoning is required when rating content as "Bad" (minimum 10 characters).', 'error')
+                existing_reviews = Review.query.filter_by(upload_id=upload_id).all()
                 return render_template('reviewer/review_upload.html', upload=upload, form=form, 
-                                     review_count=review_count, existing_reviews=existing_reviews,
+                                     review_count=upload.review_count, existing_reviews=existing_reviews,
                                      demo_user=user, current_user=user)
             
-            # Create review
-            review = Review()
-            review.upload_id = upload_id
-            review.reviewer_id = user.id
-            review.rating = form.rating.data
-            review.description = form.description.data if form.description.data else ''
-            review.xp_earned = 10  # Review XP
-            
-            # Update user stats - give XP for review
-            user.xp_points += 15
+            # Create review (a new guest's row is written with it, after the form was read)
+            user = get_or_create_user_for_session()
             
-            db.session.add(review)
-            db.session.add(user)  # Make sure user changes are saved
-            db.session.commit()
-            db.session.commit()
+            # Check-and-count in one step, so concurrent reviews can't both pass the daily cap
+            reservation = user.reserve_review()
+            if not reservation:
+                flash('Daily review limit reached (5 reviews per day). Try again tomorrow.', 'warning')
+                return redirect(url_for('review_content'))
+            try:
+                _add_review(user, upload, form.rating.data, form.description.data)
+            except Exception:
+                user.refund_review(reservation)
+                raise
+            reviewer_board.adjust(user.id)
             
             motivational_messages = [
                 "🎉 Amazing review! You're helping make the platform better!",
@@ -610,7 +639,7 @@ def review_upload(upload_id):
                              upload=upload, 
                              form=form,
                              existing_reviews=existing_reviews, 
-                             review_count=len(existing_reviews), 
+                             review_count=upload.review_count, 
                              demo_user=user,
                              current_user=user)
                              
@@ -621,16 +650,8 @@ def review_upload(upload_id):
 @app.route('/profile')
 def profile():
     """User profile page"""
-    if 'user_id' not in session:
-        user = get_or_create_user_for_session()
-        session['user_id'] = user.id
-        session['user_name'] = 'Demo User'
-    
     try:
-        user = User.query.get(session['user_id'])
-        if not user:
-            user = get_or_create_user_for_session()
-            session['user_id'] = user.id
+        user = get_session_user()
         
         # Get user's strikes and violation history
         strikes = Strike.query.filter_by(user_id=user.id)\
@@ -649,27 +670,12 @@ def profile():
 @app.route('/ranking')
 def ranking():
     """Ranking and leaderboard page"""
-    if 'user_id' not in session:
-        user = get_or_create_user_for_session()
-        session['user_id'] = user.id
-        session['user_name'] = 'Demo User'
-    
     try:
-        user = User.query.get(session['user_id'])
-        
-        # Get top uploaders (by upload count)
-        top_uploaders = db.session.query(User)\
-            .join(Upload)\
-            .group_by(User.id)\
-            .order_by(func.count(Upload.id).desc(), User.xp_points.desc())\
-            .limit(10).all()
-        
-        # Get top reviewers (by review count)
-        top_reviewers = db.session.query(User)\
-            .join(Review, User.id == Review.reviewer_id)\
-            .group_by(User.id)\
-            .order_by(func.count(Review.id).desc(), User.xp_points.desc())\
-            .limit(10).all()
+        user = get_session_user()
+        
+        # Top uploaders/reviewers come from the precomputed leaderboards
+        top_uploaders = [u for u, _ in uploader_board.top_users()]
+        top_reviewers = [u for u, _ in reviewer_board.top_users()]
         
         return render_template('ranking.html',
                              current_user=user,
@@ -683,11 +689,8 @@ def ranking():
 @app.route('/rating', methods=['GET', 'POST'])
 def rate_website():
     """Website rating and feedback page"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     try:
-        user = User.query.get(session['user_id'])
+        user = get_session_user()
         form = RatingForm()
         
         if request.method == 'POST':
@@ -696,7 +699,8 @@ def rate_website():
             app.logger.info(f"Form validation errors: {form.errors}")
             
             if form.validate_on_submit():
-                # Create rating record
+                # Create rating record (a new guest's row is written with it)
+                user = get_or_create_user_for_session()
                 rating = Rating()
                 rating.user_id = user.id
                 rating.rating = form.rating.data
@@ -728,7 +732,7 @@ def rate_website():
 def delete_upload(upload_id):
     """Delete an upload"""
     try:
-        user = get_or_create_user_for_session()
+        user = get_session_user()
         upload = Upload.query.get_or_404(upload_id)
         
         # Check if user owns this upload
@@ -736,17 +740,29 @@ def delete_upload(upload_id):
             flash('You can only delete your own uploads.', 'error')
             return redirect(url_for('dashboard'))
         
-        # Delete file from filesystem
-        if os.path.exists(upload.file_path):
-            os.remove(upload.file_path)
+        # Files go once the deletion commits (stored content only with its last reference)
+        last_reference = False
+        if upload.content_hash:
+            last_reference = release_object(upload.content_hash)
+        else:
+            remove_file_after_commit(upload.file_path)
+        remove_thumbnails(upload, include_shared=last_reference)
+        remove_previews(upload, include_shared=last_reference)
         
-        # Delete reviews for this upload
+        # Delete reviews for this upload (its review aggregates go with the row)
+        reviewer_ids = [r for (r,) in db.session.query(Review.reviewer_id).filter_by(upload_id=upload_id)]
         Review.query.filter_by(upload_id=upload_id).delete()
+        remove_from_index(upload_id)
+        AnalysisJob.query.filter_by(upload_id=upload_id).delete()
         
         # Delete upload record
         db.session.delete(upload)
         db.session.commit()
         
+        uploader_board.adjust(user.id, -1)
+        for reviewer_id in reviewer_ids:
+            reviewer_board.adjust(reviewer_id, -1)
+        
         flash('Upload deleted successfully.', 'success')
         return redirect(url_for('dashboard'))
         
@@ -757,48 +773,56 @@ def delete_upload(upload_id):
 
 @app.route('/file/<int:upload_id>')
 def serve_file(upload_id):
-    """Serve uploaded files for review"""
+    """Serve uploaded files for review (?inline=1 to view audio, video or images in the browser)"""
     try:
         upload = Upload.query.get_or_404(upload_id)
-        
-        # Check if file exists
-        if not os.path.exists(upload.file_path):
-            flash('File not found.', 'error')
-            return redirect(url_for('review_content'))
-        
-        return send_file(upload.file_path, 
-                        as_attachment=True,
-                        download_name=upload.original_filename)
+        return deliver_upload(upload, as_attachment=not request.args.get('inline'))
+    except FileNotFoundError:
+        flash('File not found.', 'error')
+        return redirect(url_for('review_content'))
     except Exception as e:
         app.logger.error(f"File serve error: {e}")
         flash('Error accessing file.', 'error')
         return redirect(url_for('review_content'))
 
+@app.route('/file/thumbnail/<int:upload_id>/<size>')
+def serve_thumbnail(upload_id, size):
+    """Downscaled WebP/JPEG rendition of an image upload (small, medium or large)"""
+    try:
+        upload = Upload.query.get_or_404(upload_id)
+        if upload.category != 'image' or size not in THUMBNAIL_SIZES:
+            return jsonify({'error': 'Thumbnail not available'}), 404
+        fmt = choose_thumbnail_format(request.accept_mimetypes)
+        path = get_thumbnail(upload, size, fmt)
+    except FileNotFoundError:
+        return jsonify({'error': 'File not found'}), 404
+    except Exception as e:
+        app.logger.error(f"Thumbnail error for upload {upload_id}: {e}")
+        return jsonify({'error': 'Thumbnail not available'}), 404
+
+    # An upload's renditions never change, so browsers can keep them for a year
+    response = send_file(path, mimetype=THUMBNAIL_MIMETYPES[fmt], conditional=True,
+                         etag=f"{upload.content_hash or upload.id}-{size}-{fmt}",
+                         max_age=THUMBNAIL_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
 @app.route('/file/preview/<int:upload_id>')
 def preview_file(upload_id):
-    """Preview file content for review (for text/code files)"""
+    """Preview file content for review (bounded read, cached per content)"""
     try:
         upload = Upload.query.get_or_404(upload_id)
-        
-        # Check if file exists
-        if not os.path.exists(upload.file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        # Only preview text-based files for security
-        if upload.category in ['text', 'code', 'document', 'audio', 'image']:
-            try:
-                with open(upload.file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    # Limit preview to first 2000 characters
-                    if len(content) > 2000:
-                        content = content[:2000] + '\n\n... (truncated - download full file to see more)'
-                return jsonify({'content': content, 'category': upload.category})
-            except Exception as e:
-                return jsonify({'error': f'Cannot read file: {str(e)}'}), 400
-        else:
-            return jsonify({'error': 'Preview not available for this file type'}), 400
-            
+        preview = get_preview(upload)
+        if preview.get('type') == 'image':
+            preview['thumbnail'] = url_for('serve_thumbnail', upload_id=upload.id, size='medium')
+        return jsonify(preview)
+    except FileNotFoundError:
+        return jsonify({'error': 'File not found'}), 404
     except Exception as e:
+        app.logger.error(f"Preview error for upload {upload_id}: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/logout')
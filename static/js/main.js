@@ -468,59 +468,102 @@
         
         // Start periodic updates
         startPeriodicUpdates: function() {
-            // Update upload status every 30 seconds if on dashboard
-            if (window.location.pathname === '/dashboard') {
-                setInterval(() => {
-                    this.updateUploadStatuses();
-                }, this.config.refreshInterval);
+            // One batched status poll; pushed changes only where the server enables the stream
+            if (window.location.pathname === '/dashboard' && document.querySelector('[data-upload-id]')) {
+                if (window.EventSource && document.body.dataset.statusStream === 'on') {
+                    this.openStatusStream();
+                } else {
+                    setInterval(() => {
+                        this.updateUploadStatuses();
+                    }, this.config.refreshInterval);
+                }
             }
         },
         
-        // Update upload statuses
-        updateUploadStatuses: function() {
-            const uploadRows = document.querySelectorAll('[data-upload-id]');
-            uploadRows.forEach(row => {
-                const uploadId = row.dataset.uploadId;
-                this.checkUploadStatus(uploadId);
+        // Upload ids shown on the page
+        getUploadIds: function() {
+            return Array.from(document.querySelectorAll('[data-upload-id]'))
+                .map(row => row.dataset.uploadId);
+        },
+        
+        // Server-sent status changes (EventSource reconnects by itself when the server closes)
+        openStatusStream: function() {
+            const source = new EventSource(`/api/upload_status/stream?ids=${this.getUploadIds().join(',')}`);
+            source.addEventListener('status', event => {
+                this.applyUploadStatuses(JSON.parse(event.data));
             });
+            source.onerror = () => {
+                console.warn('Status stream interrupted, reconnecting');
+            };
+            this.statusStream = source;
         },
         
-        // Check upload status
-        checkUploadStatus: function(uploadId) {
-            fetch(`/api/upload_status/${uploadId}`)
+        // Update upload statuses with a single batched request
+        updateUploadStatuses: function(uploadIds) {
+            const ids = uploadIds || this.getUploadIds();
+            if (!ids.length) return Promise.resolve();
+            return fetch(`/api/upload_status?ids=${ids.join(',')}`)
                 .then(response => response.json())
                 .then(data => {
                     if (data.error) {
                         console.error('Status check error:', data.error);
                         return;
                     }
-                    
-                    // Update UI based on status
-                    this.updateUploadStatusUI(uploadId, data);
+                    const returned = data.uploads.map(upload => String(upload.id));
+                    data.removed = ids.filter(id => !returned.includes(String(id)));
+                    this.applyUploadStatuses(data);
                 })
                 .catch(error => {
                     console.error('Status check failed:', error);
                 });
         },
         
+        // Apply a batch of statuses (and removals) to the dashboard rows
+        applyUploadStatuses: function(data) {
+            (data.uploads || []).forEach(upload => {
+                this.updateUploadStatusUI(upload.id, upload);
+            });
+            (data.removed || []).forEach(uploadId => {
+                const row = document.querySelector(`[data-upload-id="${uploadId}"]`);
+                if (row) this.fadeOut(row);
+            });
+        },
+        
         // Update upload status UI
         updateUploadStatusUI: function(uploadId, data) {
             const row = document.querySelector(`[data-upload-id="${uploadId}"]`);
             if (!row) return;
             
-            // Update countdown timer
-            const countdownEl = row.querySelector('.countdown');
-            if (countdownEl) {
-                if (data.hours_remaining > 0) {
+            // Status badge
+            const badgeEl = row.querySelector('.upload-status');
+            if (badgeEl && data.status) {
+                const color = data.status === 'approved' ? 'success' : data.status === 'rejected' ? 'danger' : 'warning';
+                badgeEl.className = `badge bg-${color} upload-status`;
+                badgeEl.textContent = data.status.charAt(0).toUpperCase() + data.status.slice(1);
+            }
+            
+            // Review count
+            const reviewsEl = row.querySelector('.upload-reviews');
+            if (reviewsEl) {
+                reviewsEl.textContent = `${data.review_count} review${data.review_count === 1 ? '' : 's'}`;
+            }
+            
+            // Deletion window
+            const windowEl = row.querySelector('.deletion-window');
+            if (windowEl) {
+                if (data.can_delete_free) {
                     const hours = Math.floor(data.hours_remaining);
                     const minutes = Math.floor((data.hours_remaining - hours) * 60);
-                    countdownEl.textContent = `${hours}h ${minutes}m remaining`;
-                    countdownEl.className = 'text-success small';
+                    windowEl.innerHTML = `<small class="text-success"><i class="fas fa-check-circle me-1"></i>Free deletion (${hours}h ${minutes}m left)</small>`;
                 } else {
-                    countdownEl.textContent = `${data.penalty} XP penalty`;
-                    countdownEl.className = 'text-warning small';
+                    windowEl.innerHTML = `<small class="text-warning"><i class="fas fa-coins me-1"></i>${data.penalty} XP penalty</small>`;
                 }
             }
+            
+            const deleteEl = row.querySelector('.delete-upload');
+            if (deleteEl) {
+                deleteEl.dataset.penalty = data.penalty;
+            }
         },
         
         // Utility functions
@@ -0,0 +1,38 @@
+"""Shared fixtures: the Flask app on a throwaway SQLite database and upload folder"""
+import os
+import tempfile
+
+import pytest
+
+# Must be set before app.py is imported (it reads DATABASE_URL at import time)
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix='alphanex-tests-'), "test.db"))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    pytest.importorskip("flask_sqlalchemy")
+    from app import app, db, scheduler
+    import identity
+    import preview
+    import quotas
+
+    if scheduler:
+        scheduler.pause()  # tests run background jobs by hand
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(quotas.quota_engine, 'store', quotas.LocalQuotaStore())
+    monkeypatch.setattr(quotas.quota_engine, '_pending', {})
+    identity.identity_cache._entries.clear()
+    preview.preview_cache._memory.clear()
+    os.makedirs(app.config['UPLOAD_FOLDER'])
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,39 @@
+"""Operational stats endpoints are for admins only"""
+from datetime import datetime
+
+import pytest
+
+STATS_URLS = ['/api/ai_cache/stats', '/api/ai_client/stats', '/api/guest_gc/stats']
+
+
+def _login(app, client, email):
+    from app import db
+    from models import User
+
+    with app.app_context():
+        user = User(username=email.split('@')[0], name='Staff', email=email, password_hash='!',
+                    is_guest=False, xp_points=0, created_at=datetime.utcnow())
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+
+@pytest.mark.parametrize('url', STATS_URLS)
+def test_stats_are_forbidden_to_guests(client, url):
+    assert client.get(url).status_code == 403
+
+
+@pytest.mark.parametrize('url', STATS_URLS)
+def test_stats_are_forbidden_to_other_accounts(app, client, url):
+    _login(app, client, 'someone@example.com')
+    assert client.get(url).status_code == 403
+
+
+@pytest.mark.parametrize('url', STATS_URLS)
+def test_stats_are_served_to_admins(app, client, url):
+    _login(app, client, 'admin@alphanex.com')
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.is_json
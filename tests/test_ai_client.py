@@ -0,0 +1,178 @@
+"""AnalysisClientPool, CircuitBreaker and RateLimiter against a local fake provider"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from ai_client import AnalysisClientPool, AnalysisUnavailable, BREAKER_FAILURES, RateLimited, Saturated
+
+
+class FakeProvider(ThreadingHTTPServer):
+    """Chat completions endpoint whose status and delay the test controls"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.status = 200
+        self.delay = 0.0
+        self.hits = 0
+
+    def handle_error(self, request, client_address):
+        pass  # clients that gave up on a slow answer close the socket early
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.hits += 1
+        time.sleep(self.server.delay)
+        body = json.dumps({'choices': [{'message': {'content': f"echo {request['messages'][-1]['content']}"}}]})
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeProviderClient:
+    """Minimal async client: chat.completions.create POSTs to the fake provider"""
+
+    def __init__(self, port):
+        self.port = port
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        body = json.dumps(kwargs).encode()
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        try:
+            writer.write(b"POST /v1/chat/completions HTTP/1.1\r\nHost: localhost\r\n"
+                         b"Content-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        head, _, payload = raw.partition(b"\r\n\r\n")
+        status = int(head.split()[1])
+        if status != 200:
+            raise RuntimeError(f"provider returned {status}")
+        content = json.loads(payload)['choices'][0]['message']['content']
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def provider():
+    server = FakeProvider()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_pool(provider, **options):
+    options.setdefault('timeout', 2)
+    return AnalysisClientPool(lambda: FakeProviderClient(provider.server_address[1]), **options)
+
+
+def ask(pool, text='hello', **options):
+    return pool.complete(model='test', messages=[{'role': 'user', 'content': text}], max_tokens=10, **options)
+
+
+def test_returns_provider_content(provider):
+    pool = make_pool(provider)
+    assert ask(pool) == 'echo hello'
+    assert pool.stats['succeeded'] == 1
+    assert pool.breaker.state == 'closed'
+
+
+def test_provider_errors_open_the_breaker_and_later_calls_fail_fast(provider):
+    provider.status = 500
+    pool = make_pool(provider)
+    for _ in range(BREAKER_FAILURES):
+        with pytest.raises(AnalysisUnavailable):
+            ask(pool)
+    assert pool.breaker.state == 'open'
+    assert pool.stats['failed'] == BREAKER_FAILURES
+
+    with pytest.raises(AnalysisUnavailable, match='circuit open'):
+        ask(pool)
+    assert provider.hits == BREAKER_FAILURES
+    assert pool.stats['short_circuited'] == 1
+
+
+def test_half_open_trial_closes_the_breaker_again(provider):
+    provider.status = 500
+    pool = make_pool(provider)
+    pool.breaker.cooldown = 0.2
+    for _ in range(BREAKER_FAILURES):
+        with pytest.raises(AnalysisUnavailable):
+            ask(pool)
+    assert pool.breaker.state == 'open'
+
+    provider.status = 200
+    time.sleep(0.3)
+    assert pool.breaker.state == 'half_open'
+    assert ask(pool) == 'echo hello'
+    assert pool.breaker.state == 'closed'
+    assert pool.breaker.failures == 0
+
+
+def test_failed_half_open_trial_reopens_at_once(provider):
+    provider.status = 500
+    pool = make_pool(provider)
+    pool.breaker.cooldown = 0.2
+    for _ in range(BREAKER_FAILURES):
+        with pytest.raises(AnalysisUnavailable):
+            ask(pool)
+    time.sleep(0.3)
+    with pytest.raises(AnalysisUnavailable):
+        ask(pool)
+    assert pool.breaker.state == 'open'
+    assert provider.hits == BREAKER_FAILURES + 1
+
+
+def test_slow_provider_times_out_and_counts_as_a_failure(provider):
+    provider.delay = 1.0
+    pool = make_pool(provider, timeout=0.3)
+    with pytest.raises(AnalysisUnavailable, match='timed out'):
+        ask(pool)
+    assert pool.stats['timed_out'] == 1
+    assert pool.breaker.failures == 1
+
+
+def test_waiting_for_a_slot_does_not_count_as_a_provider_failure(provider):
+    provider.delay = 0.6
+    pool = make_pool(provider, max_concurrency=1)
+    results = []
+    first = threading.Thread(target=lambda: results.append(ask(pool, 'first')))
+    first.start()
+    while provider.hits == 0:
+        time.sleep(0.01)
+
+    for _ in range(BREAKER_FAILURES + 1):
+        with pytest.raises(Saturated):
+            ask(pool, 'second', timeout=0.1)
+    first.join()
+
+    assert results == ['echo first']
+    assert pool.stats['saturated'] == BREAKER_FAILURES + 1
+    assert pool.breaker.failures == 0
+    assert pool.breaker.state == 'closed'
+    assert ask(pool, 'third') == 'echo third'  # the slot was handed back
+
+
+def test_rate_limit_wait_past_the_deadline_does_not_trip_the_breaker(provider):
+    pool = make_pool(provider, requests_per_minute=1)
+    assert ask(pool) == 'echo hello'
+    with pytest.raises(RateLimited):
+        ask(pool, timeout=0.2)
+    assert provider.hits == 1
+    assert pool.stats['rate_limited'] == 1
+    assert pool.breaker.failures == 0
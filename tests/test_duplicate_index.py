@@ -0,0 +1,128 @@
+"""Uploads get indexed for duplicate detection once the analysis job runs"""
+import io
+import os
+
+import pytest
+
+
+TEXT = ("The quarterly report covers revenue growth across three regions, hiring plans for "
+        "the engineering team, a summary of customer feedback from the spring survey and the "
+        "roadmap for the mobile application over the next two releases. ")
+
+
+def upload(client, data, filename, category):
+    response = client.post('/upload', data={
+        'file': (io.BytesIO(data), filename), 'description': f'Original {category} upload for testing',
+        'category': category, 'ai_consent': 'y'}, content_type='multipart/form-data')
+    assert response.status_code == 302, response.data[:500]
+
+
+def run_analysis(app):
+    from analysis_worker import _run_batch
+    from models import AnalysisJob
+
+    with app.app_context():
+        job_ids = [job.id for job in AnalysisJob.query.filter_by(status='queued')]
+    _run_batch(job_ids)
+
+
+def png(shade, size=64):
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', (size, size), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((8, 8, size // 2, size - 8), fill=(shade, 40, 40))
+    draw.ellipse((size // 2, 16, size - 4, size - 16), fill=(20, 20, shade))
+    out = io.BytesIO()
+    img.save(out, 'PNG')
+    return out.getvalue()
+
+
+def test_fresh_text_upload_is_indexed(app, client):
+    from models import ContentSignature, LshBucket, Upload
+
+    upload(client, (TEXT * 3).encode(), 'report.txt', 'text')
+    run_analysis(app)
+    with app.app_context():
+        upload_id = Upload.query.one().id
+        assert ContentSignature.query.filter_by(upload_id=upload_id).count() == 1
+        assert LshBucket.query.filter_by(upload_id=upload_id).count() > 0
+
+
+def test_fresh_image_uploads_are_indexed(app, client):
+    from models import ImageHash, Upload
+
+    upload(client, png(200), 'a.png', 'image')
+    upload(client, png(90), 'b.png', 'image')
+    run_analysis(app)
+    with app.app_context():
+        upload_ids = [u.id for u in Upload.query.order_by(Upload.id)]
+        assert len(upload_ids) == 2
+        assert all(ImageHash.query.filter_by(upload_id=i).count() == 1 for i in upload_ids)
+
+
+def test_near_duplicate_text_is_detected(app, client):
+    from models import Upload
+
+    upload(client, (TEXT * 3).encode(), 'report.txt', 'text')
+    run_analysis(app)
+    edited = (TEXT * 3).replace('spring survey', 'autumn survey', 1) + "Appendix: contact list."
+    upload(client, edited.encode(), 'report-v2.txt', 'text')
+    run_analysis(app)
+    with app.app_context():
+        first, second = Upload.query.order_by(Upload.id).all()
+        assert first.content_hash != second.content_hash
+        assert second.duplicate_score >= 0.5
+
+
+def test_unreadable_file_fails_the_job_instead_of_skipping_the_index(app, client):
+    from models import AnalysisJob, ContentSignature, Upload
+
+    upload(client, (TEXT * 3).encode(), 'report.txt', 'text')
+    with app.app_context():
+        os.remove(Upload.query.one().file_path)
+    run_analysis(app)
+    with app.app_context():
+        job = AnalysisJob.query.one()
+        assert job.status == 'queued' and job.last_error  # retried with backoff
+        assert ContentSignature.query.count() == 0
+
+
+def test_index_upload_raises_for_a_missing_file(app, client):
+    from duplicate_index import index_upload
+    from models import Upload
+
+    upload(client, (TEXT * 3).encode(), 'report.txt', 'text')
+    with app.app_context():
+        record = Upload.query.one()
+        os.remove(record.file_path)
+        with pytest.raises(OSError):
+            index_upload(record)
+
+
+def test_near_duplicate_image_is_detected(app, client):
+    from PIL import Image
+    from models import Upload
+
+    original = png(200, size=256)
+    upload(client, original, 'photo.png', 'image')
+    run_analysis(app)
+    # Same picture, re-encoded smaller as JPEG: different bytes, same perceptual hashes
+    with Image.open(io.BytesIO(original)) as img:
+        out = io.BytesIO()
+        img.resize((200, 200)).save(out, 'JPEG', quality=85)
+    upload(client, out.getvalue(), 'photo.jpg', 'image')
+    run_analysis(app)
+    with app.app_context():
+        first, second = Upload.query.order_by(Upload.id).all()
+        assert first.content_hash != second.content_hash
+        assert second.duplicate_score >= 0.5
+
+
+def test_compute_hashes_raises_for_a_missing_file(tmp_path):
+    from image_hash import compute_hashes
+
+    with pytest.raises(OSError):
+        compute_hashes(str(tmp_path / 'gone.png'))
+    (tmp_path / 'not-an-image.png').write_bytes(b'plain text')
+    assert compute_hashes(str(tmp_path / 'not-an-image.png')) is None
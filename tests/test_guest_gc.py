@@ -0,0 +1,51 @@
+"""Abandoned guest collection keeps anyone with something to lose"""
+from datetime import datetime, timedelta
+
+
+def _guest(username, xp=0, age_days=60):
+    from app import db
+    from models import User
+
+    user = User(username=username, name='Guest', email=f'{username}@alphanex.com',
+                password_hash='!guest', is_guest=True, xp_points=xp,
+                created_at=datetime.utcnow() - timedelta(days=age_days))
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def test_collects_only_old_guests_without_xp_or_rows(app):
+    from guest_gc import collect_guests
+    from models import User
+
+    with app.app_context():
+        abandoned = _guest('user_gone')
+        reviewer = _guest('user_reviewer', xp=15)  # their reviewed upload was deleted since
+        recent = _guest('user_recent', age_days=1)
+        deleted, _ = collect_guests()
+        assert deleted == 1
+        remaining = {user.id for user in User.query}
+        assert abandoned not in remaining
+        assert {reviewer, recent} <= remaining
+
+
+def test_mark_legacy_guests_matches_old_session_users_only(app):
+    from app import db
+    from models import User
+
+    with app.app_context():
+        legacy = [_guest(f'user_{n:08x}') for n in range(3)]
+        signup = User(username='user_alice', name='Alice', email='user_alice@alphanex.com',
+                      password_hash='pbkdf2:sha256:x', is_guest=False, xp_points=0)
+        db.session.add(signup)
+        User.query.filter(User.id.in_(legacy)).update({'is_guest': False})
+        db.session.commit()
+        signup_id = signup.id
+
+    result = app.test_cli_runner().invoke(args=['mark-legacy-guests', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Marked 2 users so far' in result.output
+    assert 'Marked 3 legacy session users as guests' in result.output
+    with app.app_context():
+        assert all(User.query.get(user_id).is_guest for user_id in legacy)
+        assert not User.query.get(signup_id).is_guest
@@ -0,0 +1,88 @@
+"""analyze_descriptions_batch against a stub client: chunking and matching results back"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+pytest.importorskip("openai")
+
+import openai_service  # noqa: E402
+
+
+class DictCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, function, value):
+        self.values[key] = value
+
+
+class StubClient:
+    """Synchronous chat.completions.create that scores each upload from its description"""
+
+    def __init__(self, drop_refs=(), fail_requests=()):
+        self.requests = []
+        self.drop_refs = set(drop_refs)
+        self.fail_requests = set(fail_requests)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        prompt = kwargs['messages'][-1]['content']
+        payload = json.loads(prompt.split('Uploads:', 1)[1].strip().split('\n', 1)[0])
+        self.requests.append(payload)
+        if len(self.requests) - 1 in self.fail_requests:
+            raise RuntimeError("provider error")
+        results = [{"ref": entry['ref'], "spam_score": int(entry['description'].split()[-1]) / 100,
+                    "appropriate": entry['category'] != 'blocked'}
+                   for entry in reversed(payload) if entry['ref'] not in self.drop_refs]
+        content = json.dumps({"results": results})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = DictCache()
+    monkeypatch.setattr(openai_service, 'analysis_cache', cache)
+    monkeypatch.setattr(openai_service, 'text_classifier', SimpleNamespace(spam_score=lambda text: None))
+    return cache
+
+
+def _items(count):
+    return [{'id': 1000 + n, 'description': f"upload number {n}", 'category': 'blocked' if n == 7 else 'text'}
+            for n in range(count)]
+
+
+def test_splits_into_batches_and_matches_results_to_items(cache):
+    client = StubClient()
+    results = openai_service.analyze_descriptions_batch(_items(23), client=client)
+
+    assert [len(request) for request in client.requests] == [10, 10, 3]
+    assert sorted(results) == [1000 + n for n in range(23)]
+    for n in range(23):
+        assert results[1000 + n]['spam_score'] == n / 100
+        assert results[1000 + n]['appropriate'] is (n != 7)
+    # Refs are positions within each request, not database ids
+    assert [entry['ref'] for entry in client.requests[2]] == ['0', '1', '2']
+
+
+def test_missing_and_failed_items_are_left_out_for_retry(cache):
+    client = StubClient(drop_refs={'4'}, fail_requests={1})
+    results = openai_service.analyze_descriptions_batch(_items(15), client=client)
+
+    assert 1004 not in results
+    assert not any(1000 + n in results for n in range(10, 15))
+    assert sorted(results) == [1000 + n for n in range(10) if n != 4]
+    assert len(cache.values) == 9
+
+
+def test_cached_items_are_not_requested_again(cache):
+    openai_service.analyze_descriptions_batch(_items(12), client=StubClient())
+    client = StubClient()
+    results = openai_service.analyze_descriptions_batch(_items(12), client=client)
+
+    assert client.requests == []
+    assert results[1011]['spam_score'] == 0.11
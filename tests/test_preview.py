@@ -0,0 +1,39 @@
+"""Cached previews go with the last upload that shares their content"""
+import io
+import os
+
+
+def _upload_notes(client):
+    response = client.post('/upload', data={
+        'file': (io.BytesIO(b'Weekly sync notes\n' * 20), 'notes.txt'),
+        'description': 'Meeting notes from the weekly sync', 'category': 'text', 'ai_consent': 'y'},
+        content_type='multipart/form-data')
+    assert response.status_code == 302
+
+
+def _cached_previews(app):
+    from preview import preview_cache
+
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], '.previews')
+    files = os.listdir(folder) if os.path.isdir(folder) else []
+    return files, list(preview_cache._memory)
+
+
+def test_preview_cache_is_cleared_with_the_last_reference(app, client):
+    from models import Upload
+
+    _upload_notes(client)
+    _upload_notes(client)
+    with app.app_context():
+        first, second = [upload.id for upload in Upload.query.order_by(Upload.id)]
+    assert client.get(f'/file/preview/{first}').status_code == 200
+    files, memory = _cached_previews(app)
+    assert len(files) == 1 and len(memory) == 1
+
+    client.get(f'/delete_upload/{first}')
+    assert _cached_previews(app) == (files, memory)  # still shared with the second upload
+
+    client.get(f'/delete_upload/{second}')
+    with app.app_context():
+        assert Upload.query.count() == 0
+    assert _cached_previews(app) == ([], [])
@@ -0,0 +1,47 @@
+"""Daily quota reservations: atomic in the store, enforced by the routes"""
+from datetime import datetime
+
+
+def _owner_with_uploads(count):
+    from app import db
+    from models import User, Upload
+
+    owner = User(username='owner', name='Owner', email='owner@example.com', password_hash='!guest',
+                 is_guest=True, xp_points=0, created_at=datetime.utcnow())
+    db.session.add(owner)
+    db.session.flush()
+    uploads = []
+    for n in range(count):
+        upload = Upload(user_id=owner.id, filename=f'f{n}.txt', original_filename=f'f{n}.txt',
+                        file_path=f'/nonexistent/f{n}.txt', file_size=10, category='text',
+                        description=f'Sample upload number {n}', status='pending')
+        db.session.add(upload)
+        uploads.append(upload)
+    db.session.commit()
+    return [upload.id for upload in uploads]
+
+
+def test_local_store_reserve_is_all_or_nothing(app):
+    import quotas
+    store = quotas.LocalQuotaStore()
+    assert store.reserve({'a': 1, 'b': 5}, {'a': 1, 'b': 10})
+    assert not store.reserve({'a': 1, 'b': 1}, {'a': 2, 'b': 5})  # b would pass its limit
+    assert store.get('a') == 1 and store.get('b') == 5
+
+
+def test_reviews_stop_at_the_daily_cap(app, client):
+    from app import db
+    from models import Review, User, DAILY_REVIEW_LIMIT
+
+    with app.app_context():
+        upload_ids = _owner_with_uploads(DAILY_REVIEW_LIMIT + 1)
+
+    for upload_id in upload_ids:
+        response = client.post(f'/review/{upload_id}', data={
+            'rating': 'good', 'description': 'Clear, specific and useful content.'})
+        assert response.status_code == 302
+
+    with app.app_context():
+        assert db.session.query(Review).count() == DAILY_REVIEW_LIMIT
+        reviewer = User.query.filter(User.username != 'owner').one()
+        assert reviewer.get_remaining_reviews_today() == 0
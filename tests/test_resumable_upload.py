@@ -0,0 +1,31 @@
+"""Resumable upload sessions count against the daily allowance while they are open"""
+MB = 1024 * 1024
+
+
+def _init(client, size, n=0):
+    return client.post('/api/uploads/resumable', json={
+        'filename': f'notes{n}.txt', 'description': 'Meeting notes from the weekly sync',
+        'category': 'text', 'size': size, 'ai_consent': True})
+
+
+def test_open_sessions_are_capped_by_the_daily_upload_count(client):
+    from models import DAILY_UPLOAD_LIMIT
+
+    for n in range(DAILY_UPLOAD_LIMIT):
+        assert _init(client, 1024, n).status_code == 201
+    assert _init(client, 1024, DAILY_UPLOAD_LIMIT).status_code == 429
+
+
+def test_open_sessions_count_against_the_daily_byte_allowance(app, client):
+    from models import PartialUpload, User
+    from quotas import quota_engine, UPLOAD_BYTES
+
+    assert _init(client, 100 * MB).status_code == 201
+    with app.app_context():
+        user = User.query.get(PartialUpload.query.one().user_id)
+        quota_engine.upload_bytes_used(user)  # seed today's counters
+        quota_engine.store.incr(quota_engine._key(user.id, UPLOAD_BYTES), 350 * MB)  # finished earlier
+
+    # 350MB used + 100MB in flight leaves 50MB of the 500MB day
+    assert _init(client, 60 * MB, 1).status_code == 429
+    assert _init(client, 50 * MB, 2).status_code == 201
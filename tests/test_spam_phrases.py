@@ -0,0 +1,24 @@
+"""Descriptions matching the banned phrase list are rejected on both upload paths"""
+import io
+
+SPAM = 'Guaranteed FREE money, click here to claim it'
+
+
+def test_upload_form_rejects_a_spam_description(app, client):
+    from models import Upload
+
+    response = client.post('/upload', data={
+        'file': (io.BytesIO(b'some notes'), 'notes.txt'), 'description': SPAM,
+        'category': 'text', 'ai_consent': 'y'}, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert b'spammy content' in response.data
+    with app.app_context():
+        assert Upload.query.count() == 0
+
+
+def test_resumable_init_rejects_a_spam_description(client):
+    response = client.post('/api/uploads/resumable', json={
+        'filename': 'notes.txt', 'description': SPAM, 'category': 'text', 'size': 10,
+        'ai_consent': True})
+    assert response.status_code == 400
+    assert 'spammy content' in response.get_json()['error']
@@ -0,0 +1,219 @@
+"""
+Local text classifier for Alpha Nex
+Hashed word unigram/bigram features with logistic regression, trained from review
+ratings and rejected uploads (`flask train-text-classifier`). Scores descriptions for
+spam and reviews for quality without a network call; the AI provider is only asked
+when the local model is missing or not confident.
+"""
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+from app import app
+
+MODEL_PATH = os.environ.get("TEXT_MODEL_PATH", os.path.join("instance", "text_classifier.bin"))
+FEATURE_BITS = 18
+MIN_EXAMPLES_PER_CLASS = 20
+CONFIDENT = 0.7  # |2p - 1| at or above this skips the AI provider
+RELOAD_CHECK_SECONDS = 30
+
+_MAGIC = b'ANTC1'
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_MASK = (1 << FEATURE_BITS) - 1
+
+
+def features(text):
+    """Sorted distinct hashed unigram and bigram ids"""
+    tokens = _TOKEN_RE.findall((text or '').lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return sorted({zlib.crc32(g.encode('utf-8')) & _MASK for g in grams})
+
+
+def _sigmoid(z):
+    if z < -35:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class LogisticModel:
+    """Sparse binary-feature logistic regression, inputs scaled by 1/sqrt(feature count)"""
+
+    def __init__(self, weights=None, bias=0.0):
+        self.weights = weights or {}
+        self.bias = bias
+
+    def _z(self, feats):
+        if not feats:
+            return self.bias
+        get = self.weights.get
+        return self.bias + sum(get(f, 0.0) for f in feats) / math.sqrt(len(feats))
+
+    def predict(self, feats):
+        return _sigmoid(self._z(feats))
+
+    @classmethod
+    def train(cls, examples, epochs=5, learning_rate=0.5, l2=1e-5, seed=0):
+        """examples: list of (feature ids, label 0/1); classes are balanced by weight"""
+        model = cls()
+        positives = sum(label for _, label in examples)
+        class_weight = {1: len(examples) / (2.0 * positives),
+                        0: len(examples) / (2.0 * (len(examples) - positives))}
+        rng = random.Random(seed)
+        order = list(examples)
+        weights = model.weights
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch)
+            for feats, label in order:
+                scale = 1.0 / math.sqrt(len(feats)) if feats else 0.0
+                gradient = (model.predict(feats) - label) * class_weight[label] * rate
+                model.bias -= gradient
+                for f in feats:
+                    w = weights.get(f, 0.0)
+                    weights[f] = w - gradient * scale - rate * l2 * w
+        # Near-zero weights don't change predictions; dropping them keeps the file small
+        model.weights = {f: w for f, w in weights.items() if abs(w) >= 1e-3}
+        return model
+
+    def to_bytes(self):
+        ids = sorted(self.weights)
+        return (struct.pack('>dI', self.bias, len(ids)) + array('I', ids).tobytes()
+                + array('f', [self.weights[i] for i in ids]).tobytes())
+
+    @classmethod
+    def from_bytes(cls, blob):
+        bias, count = struct.unpack_from('>dI', blob)
+        offset = struct.calcsize('>dI')
+        ids = array('I')
+        ids.frombytes(blob[offset:offset + 4 * count])
+        weights = array('f')
+        weights.frombytes(blob[offset + 4 * count:offset + 8 * count])
+        return cls(dict(zip(ids, weights)), bias)
+
+
+def save_models(models, path=MODEL_PATH, meta=None):
+    """Write {name: LogisticModel} as one zlib-compressed file (atomic replace)"""
+    header = {'feature_bits': FEATURE_BITS, 'meta': meta or {}, 'models': {}}
+    blobs = []
+    for name, model in models.items():
+        blob = model.to_bytes()
+        header['models'][name] = len(blob)
+        blobs.append(blob)
+    header_bytes = json.dumps(header).encode('utf-8')
+    payload = struct.pack('>I', len(header_bytes)) + header_bytes + b''.join(blobs)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_MAGIC + zlib.compress(payload, 9))
+    os.replace(temp_path, path)
+
+
+def load_models(path=MODEL_PATH):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(_MAGIC):
+        raise ValueError(f"{path} is not a text classifier model")
+    payload = zlib.decompress(data[len(_MAGIC):])
+    (header_len,) = struct.unpack_from('>I', payload)
+    header = json.loads(payload[4:4 + header_len])
+    if header['feature_bits'] != FEATURE_BITS:
+        raise ValueError("model was trained with a different feature size")
+    models, offset = {}, 4 + header_len
+    for name, size in header['models'].items():
+        models[name] = LogisticModel.from_bytes(payload[offset:offset + size])
+        offset += size
+    return models, header['meta']
+
+
+class TextClassifier:
+    """Loads the model file lazily and picks up a retrained file by its mtime"""
+
+    def __init__(self, path=MODEL_PATH):
+        self.path = path
+        self.models = {}
+        self.meta = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self.models, self._mtime = {}, None
+                return
+            if mtime != self._mtime:
+                try:
+                    self.models, self.meta = load_models(self.path)
+                    self._mtime = mtime
+                except Exception as e:
+                    app.logger.error(f"Text classifier load failed, scoring without it: {e}")
+
+    def reload(self):
+        self._checked_at = 0.0
+        self._refresh()
+
+    def score(self, name, text):
+        """(probability, confidence) from the named model, or None if it isn't trained"""
+        self._refresh()
+        model = self.models.get(name)
+        if model is None:
+            return None
+        p = model.predict(features(text))
+        return p, abs(2 * p - 1)
+
+    def spam_score(self, description):
+        return self.score('spam', description)
+
+    def quality_score(self, review_text):
+        return self.score('quality', review_text)
+
+
+def _split(examples, holdout, seed=0):
+    rng = random.Random(seed)
+    rng.shuffle(examples)
+    cut = int(len(examples) * holdout)
+    return examples[cut:], examples[:cut]
+
+
+def _accuracy(model, examples):
+    if not examples:
+        return None
+    correct = sum((model.predict(feats) >= 0.5) == bool(label) for feats, label in examples)
+    return round(correct / len(examples), 4)
+
+
+def train_models(spam_examples, quality_examples, epochs=5, holdout=0.1):
+    """
+    Train from (text, label) pairs. spam label 1 = spam; quality label 1 = good review.
+    Returns ({name: model}, report); models without enough examples of both classes are skipped.
+    """
+    models, report = {}, {}
+    for name, examples in (('spam', spam_examples), ('quality', quality_examples)):
+        labelled = [(features(text), int(label)) for text, label in examples if text]
+        positives = sum(label for _, label in labelled)
+        report[name] = {'examples': len(labelled), 'positives': positives}
+        if min(positives, len(labelled) - positives) < MIN_EXAMPLES_PER_CLASS:
+            report[name]['skipped'] = f"needs {MIN_EXAMPLES_PER_CLASS} examples of each class"
+            continue
+        train, test = _split(labelled, holdout)
+        report[name]['holdout_accuracy'] = _accuracy(LogisticModel.train(train, epochs), test)
+        models[name] = LogisticModel.train(labelled, epochs)
+        report[name]['features'] = len(models[name].weights)
+    return models, report
+
+
+text_classifier = TextClassifier()
@@ -0,0 +1,103 @@
+"""
+Image thumbnails for Alpha Nex
+Fixed-size WebP/JPEG renditions of image uploads, generated with Pillow on first request
+and stored next to the uploads, keyed by content hash. Renditions never change for an
+upload, so they are served with long-lived cache headers.
+"""
+import os
+import shutil
+import tempfile
+from app import app
+
+SIZES = {'small': 160, 'medium': 480, 'large': 1024}
+CACHE_MAX_AGE = 365 * 24 * 3600
+QUALITY = {'webp': 80, 'jpeg': 82}
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+MAX_SOURCE_PIXELS = 80 * 1000 * 1000  # refuse to decode anything bigger
+
+
+def _webp_supported():
+    try:
+        from PIL import features
+        return bool(features.check('webp'))
+    except Exception:
+        return False
+
+
+WEBP_SUPPORTED = _webp_supported()
+
+
+def choose_format(accept_mimetypes):
+    """WebP when both Pillow and the client support it, else JPEG"""
+    return 'webp' if WEBP_SUPPORTED and accept_mimetypes['image/webp'] else 'jpeg'
+
+
+def _key_folder(key):
+    return os.path.join(app.config['UPLOAD_FOLDER'], '.thumbs', key[:2], key)
+
+
+def _folder(upload):
+    return _key_folder(upload.content_hash or f"upload-{upload.id}")
+
+
+def thumbnail_path(upload, size, fmt):
+    return os.path.join(_folder(upload), f"{size}.{fmt}")
+
+
+def render_thumbnail(source_path, target_path, max_side, fmt):
+    """Write one rendition; the file appears atomically so concurrent readers never see half of it"""
+    from PIL import Image, ImageOps
+    with Image.open(source_path) as img:
+        if img.width * img.height > MAX_SOURCE_PIXELS:
+            raise ValueError("image too large to thumbnail")
+        img.draft('RGB', (max_side, max_side))  # JPEG decodes at reduced scale
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+        if fmt == 'jpeg' and img.mode == 'RGBA':
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        folder = os.path.dirname(target_path)
+        os.makedirs(folder, exist_ok=True)
+        # A unique temp file per render: threads of one process may render the same size at once
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, fmt.upper(), quality=QUALITY[fmt], optimize=fmt == 'jpeg')
+            os.replace(temp_path, target_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def get_thumbnail(upload, size, fmt):
+    """Path of the rendition, generating it on first use; raises FileNotFoundError/ValueError"""
+    if size not in SIZES:
+        raise ValueError(f"unknown thumbnail size '{size}'")
+    path = thumbnail_path(upload, size, fmt)
+    if not os.path.exists(path):
+        if not os.path.exists(upload.file_path):
+            raise FileNotFoundError(upload.file_path)
+        render_thumbnail(upload.file_path, path, SIZES[size], fmt)
+    return path
+
+
+def remove_thumbnails(upload, include_shared=True):
+    """
+    Delete an upload's renditions once the transaction commits: its own per-upload
+    folder always (legacy uploads), the hash-keyed one only with include_shared (no
+    other upload has the same bytes any more).
+    """
+    from content_store import on_commit
+    folders = [_key_folder(f"upload-{upload.id}")]
+    if upload.content_hash and include_shared:
+        folders.append(_key_folder(upload.content_hash))
+
+    def remove():
+        for folder in folders:
+            shutil.rmtree(folder, ignore_errors=True)
+    on_commit(remove)
@@ -0,0 +1,142 @@
+"""
+Upload status for the Alpha Nex dashboard
+One batched query answers for all of a user's uploads, either as JSON (the dashboard
+polls it) or as a server-sent event stream that only pushes rows whose status, review
+counts or deletion window changed. An open stream occupies a whole sync worker, so it
+is opt-in (STATUS_STREAM_ENABLED) for deployments running gthread/gevent workers, and
+it closes itself well inside the worker timeout; the browser's EventSource reconnects.
+"""
+import json
+import os
+import time
+from datetime import datetime
+from flask import Response, request, jsonify, stream_with_context
+from app import app, db
+from models import Upload
+from identity import get_session_identity
+
+MAX_UPLOADS = 50
+# Only enable with async or threaded workers (e.g. gunicorn -k gthread --threads 8)
+STREAM_ENABLED = os.environ.get("STATUS_STREAM_ENABLED", "").lower() in ('1', 'true', 'yes')
+STREAM_POLL_SECONDS = float(os.environ.get("STATUS_STREAM_POLL_SECONDS", "5"))
+STREAM_MAX_SECONDS = float(os.environ.get("STATUS_STREAM_MAX_SECONDS", "20"))  # gunicorn's timeout is 30s
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_RETRY_MS = 5000
+
+
+def _requested_ids():
+    """Upload ids from ?ids=1,2,3 (None means the user's most recent uploads)"""
+    raw = request.args.get('ids', '')
+    ids = [int(part) for part in raw.split(',') if part.strip().isdigit()]
+    return ids[:MAX_UPLOADS] or None
+
+
+def upload_statuses(user_id, upload_ids=None):
+    """Status dicts for a user's uploads in one query (only the columns the dashboard shows)"""
+    query = db.session.query(Upload.id, Upload.status, Upload.review_count, Upload.good_count,
+                             Upload.bad_count, Upload.deletion_deadline)\
+                      .filter(Upload.user_id == user_id)
+    if upload_ids:
+        query = query.filter(Upload.id.in_(upload_ids))
+    rows = query.order_by(Upload.uploaded_at.desc()).limit(MAX_UPLOADS).all()
+
+    now = datetime.utcnow()
+    statuses = []
+    for row in rows:
+        deadline = row.deletion_deadline or now
+        seconds_left = (deadline - now).total_seconds()
+        # Same rule as Upload.get_deletion_penalty, without loading the model
+        penalty = 0 if seconds_left > 0 else min(int(-seconds_left / 3600 * 5), 100)
+        statuses.append({
+            'id': row.id,
+            'status': row.status,
+            'review_count': row.review_count or 0,
+            'good_count': row.good_count or 0,
+            'bad_count': row.bad_count or 0,
+            'deletion_deadline': deadline.isoformat() + 'Z',
+            'hours_remaining': max(0, seconds_left / 3600),
+            'can_delete_free': seconds_left > 0,
+            'penalty': penalty
+        })
+    return statuses
+
+
+def _fingerprint(status):
+    """What has to differ for a row to be pushed again (not the ticking hours_remaining)"""
+    return (status['status'], status['review_count'], status['good_count'], status['bad_count'],
+            status['deletion_deadline'], status['can_delete_free'], status['penalty'])
+
+
+def _event(name, data, event_id=None):
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+@app.context_processor
+def status_stream_setting():
+    return {'status_stream_enabled': STREAM_ENABLED}
+
+
+@app.route('/api/upload_status')
+def upload_status_batch():
+    """Statuses of the session user's uploads (?ids=1,2,3, default: most recent)"""
+    try:
+        identity = get_session_identity()
+        if identity is None:
+            return jsonify({'uploads': []})
+        return jsonify({'uploads': upload_statuses(identity.id, _requested_ids())})
+    except Exception as e:
+        app.logger.error(f"Upload status error: {e}")
+        return jsonify({'error': 'Status unavailable'}), 500
+
+
+@app.route('/api/upload_status/stream')
+def upload_status_stream():
+    """Server-sent events: a snapshot, then only the uploads that changed"""
+    if not STREAM_ENABLED:
+        return Response(status=204)  # tells EventSource not to reconnect; the dashboard polls
+    identity = get_session_identity()
+    user_id = identity.id if identity else None
+    upload_ids = _requested_ids()
+
+    def generate():
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        if user_id is None:
+            yield _event('status', {'uploads': [], 'removed': []})
+            return
+        seen = {}
+        sequence = 0
+        started = last_sent = time.monotonic()
+        while True:
+            try:
+                statuses = upload_statuses(user_id, upload_ids)
+            except Exception as e:
+                app.logger.error(f"Upload status stream error: {e}")
+                return
+            finally:
+                db.session.remove()  # no connection or open transaction while we sleep
+
+            changed = [s for s in statuses if seen.get(s['id']) != _fingerprint(s)]
+            current = {s['id']: _fingerprint(s) for s in statuses}
+            removed = [upload_id for upload_id in seen if upload_id not in current]
+            seen = current
+            now = time.monotonic()
+            if changed or removed or sequence == 0:
+                sequence += 1
+                yield _event('status', {'uploads': changed, 'removed': removed}, sequence)
+                last_sent = now
+            elif now - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = now
+
+            if now - started + STREAM_POLL_SECONDS > STREAM_MAX_SECONDS:
+                return  # the client reconnects and gets a fresh snapshot
+            time.sleep(STREAM_POLL_SECONDS)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx hold events back
+    return response
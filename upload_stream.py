@@ -0,0 +1,129 @@
+"""
+Streaming upload handling for Alpha Nex
+Multipart file parts are written straight to disk in fixed-size chunks with the
+user's byte allowance enforced while the body is still arriving
+"""
+import hashlib
+import os
+import uuid
+from flask import Request, g, request
+from werkzeug.exceptions import RequestEntityTooLarge
+from app import app
+from models import MAX_UPLOAD_BYTES
+from content_store import ingest
+from preview import screen_upload
+
+CHUNK_SIZE = 64 * 1024
+PARTIAL_DIR = '.partial'
+# Room for multipart boundaries and the other form fields on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def partial_folder():
+    folder = os.path.join(app.config.get('UPLOAD_FOLDER', 'uploads'), PARTIAL_DIR)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+class LimitedFileStream:
+    """Write-through file that hashes what it stores and aborts once more than `limit` bytes arrive"""
+
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.bytes_written = 0
+        self.sha256 = hashlib.sha256()
+        self._file = open(path, 'w+b', buffering=CHUNK_SIZE)
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        if self.bytes_written > self.limit:
+            self.discard()
+            raise RequestEntityTooLarge()
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def discard(self):
+        """Close and delete the partial file"""
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def __getattr__(self, name):
+        if name == '_file':
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+
+class StreamingUploadRequest(Request):
+    """Request whose multipart file parts stream to disk under a per-request byte limit"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = getattr(g, 'upload_byte_limit', MAX_UPLOAD_BYTES)
+        path = os.path.join(partial_folder(), uuid.uuid4().hex)
+        stream = LimitedFileStream(path, limit)
+        g.setdefault('streamed_uploads', []).append(stream)
+        return stream
+
+
+app.request_class = StreamingUploadRequest
+
+
+@app.teardown_request
+def discard_unclaimed_uploads(exc=None):
+    """Remove streamed parts the view didn't move into place (rejected or failed uploads)"""
+    for stream in g.pop('streamed_uploads', []):
+        try:
+            stream.discard()
+        except Exception as e:
+            app.logger.warning(f"Could not discard partial upload {stream.path}: {e}")
+
+
+def prepare_upload_request(user):
+    """
+    Check quotas before the request body is parsed and set the streaming byte limit.
+    Returns an error message, or None if the upload may proceed.
+    """
+    if user.is_banned:
+        return 'Your account is not allowed to upload content.'
+    if not user.can_upload_today():
+        return 'Daily upload limit reached (3 files per day). Try again tomorrow.'
+
+    remaining = user.get_daily_upload_remaining()
+    limit = min(MAX_UPLOAD_BYTES, remaining)
+    if limit <= 0:
+        return 'Daily upload size limit reached (500MB per day). Try again tomorrow.'
+
+    if request.content_length and request.content_length > limit + MULTIPART_OVERHEAD:
+        return f'File too large! You can upload up to {limit / (1024 * 1024):.1f} MB right now.'
+
+    g.upload_byte_limit = limit
+    return None
+
+
+def store_streamed_file(file, category):
+    """Put an uploaded file into the content store and return (file_path, file_size, content_hash).
+    Streamed parts were hashed on the way in and are renamed without copying;
+    anything else is copied in chunks and hashed as it goes.
+    The bytes move into place when the caller commits; until then the temp file stays
+    registered, so a failed request still discards it at teardown.
+    Raises ArchiveRejected (and drops the file) for an unsafe archive."""
+    stream = file.stream
+    if not isinstance(stream, LimitedFileStream):
+        copy = LimitedFileStream(os.path.join(partial_folder(), uuid.uuid4().hex), MAX_UPLOAD_BYTES)
+        g.setdefault('streamed_uploads', []).append(copy)
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            copy.write(chunk)
+        stream = copy
+    stream.flush()
+    stream.close()
+    temp_path, size, digest = stream.path, stream.bytes_written, stream.sha256.hexdigest()
+
+    try:
+        screen_upload(temp_path, category, file.filename or '', digest)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return ingest(temp_path, digest, size), size, digest
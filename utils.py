@@ -96,12 +96,10 @@ def validate_content_description(description):
     if not description or len(description.strip()) < 10:
         return False, "Description must be at least 10 characters long."
 
-    # Check for spam patterns
-    spam_indicators = ['free money', 'click here', 'guaranteed', 'act now']
-    description_lower = description.lower()
-
-    for indicator in spam_indicators:
-        if indicator in description_lower:
-            return False, f"Description contains potentially spammy content: '{indicator}'"
+    # Check for spam patterns (moderator phrase list, see phrase_matcher.py)
+    from phrase_matcher import spam_phrases
+    indicator = spam_phrases.first_match(description)
+    if indicator:
+        return False, f"Description contains potentially spammy content: '{indicator}'"
 
     return True, "Description is valid."
\ No newline at end of file